@@ -0,0 +1,157 @@
+import os
+import json
+import math
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+# Every Budget created, so their statistics can be reported
+budgets = []
+
+# Memory one matrix cell costs while a request serves it: the float64 value read from the matrix,
+# a downsampling or delta temporary, and its share of the response (JSON or CSV text)
+BYTES_PER_CELL = 32
+
+# Seconds between attempts to take slots while queued
+POLL_INTERVAL = 0.05
+
+# 'admitted' at once, 'waited' in the queue and then admitted, 'rejected' after waiting, 'degraded' renders
+COUNTERS = ('admitted', 'waited', 'rejected', 'degraded')
+
+
+class BudgetExceeded(Exception):
+    """Raised when a request waited for memory longer than the budget's timeout."""
+
+
+class Budget:
+    """
+    Memory admission control for requests that read large matrix blocks.
+
+    A request may hold at most request_bytes: heatmaps larger than that are served downsampled
+    (see step and downsample). All heavy requests of all server and job processes together hold at
+    most total_bytes. That memory is split into slots, one lock file each; a request takes one slot
+    per slot_cells cells it reads, or runs without one if it reads fewer. A request that finds too
+    few free slots queues for up to timeout seconds and is then turned away with BudgetExceeded.
+    Admissions, queued and rejected requests and degraded renders are counted in a file next to
+    the slots, so job processes are counted too.
+
+    Parameters:
+    - name: Label used in file names and when reporting statistics
+    - directory: Folder of the slot and statistics files shared by the server's processes
+    - request_bytes: Memory one request may hold
+    - total_bytes: Memory all heavy requests may hold together
+    - timeout: Seconds a request waits for free slots
+    """
+
+    def __init__(self, name, directory, request_bytes, total_bytes, timeout=30.0):
+        self.name = name
+        self.directory = directory
+        self.request_cells = max(1, request_bytes // BYTES_PER_CELL)
+        self.slot_cells = max(1, self.request_cells // 4)
+        self.slots = max(1, total_bytes // BYTES_PER_CELL // self.slot_cells)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        budgets.append(self)
+
+    def step(self, n_rows, n_cols):
+        """Smallest tile size k for which an n_rows x n_cols block, averaged over k x k tiles, fits one request."""
+        k = max(1, math.ceil(math.sqrt(n_rows * n_cols / self.request_cells)))
+        while math.ceil(n_rows / k) * math.ceil(n_cols / k) > self.request_cells:
+            k += 1
+        return k
+
+    @contextmanager
+    def admit(self, cells):
+        """
+        Runs the block once enough slots for cells are free, waiting for them if needed. A request
+        larger than the whole budget takes every slot, so it runs alone.
+        """
+        needed = min(self.slots, math.ceil(cells / self.slot_cells)) if cells >= self.slot_cells else 0
+        if not needed:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        deadline = time.monotonic() + self.timeout
+        queued = False
+        while True:
+            held = self._try_slots(needed)
+            if held is not None:
+                break
+            if time.monotonic() >= deadline:
+                self.count('rejected')
+                raise BudgetExceeded(f"No memory for {cells} cells within {self.timeout:g} s")
+            queued = True
+            time.sleep(POLL_INTERVAL)
+        self.count('waited' if queued else 'admitted')
+        try:
+            yield
+        finally:
+            for f in held:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+
+    def _try_slots(self, needed):
+        # All or nothing: a request never waits while holding slots, so requests cannot deadlock
+        held = []
+        for slot in range(self.slots):
+            f = open(os.path.join(self.directory, f"{self.name}-slot-{slot}.lock"), 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            held.append(f)
+            if len(held) == needed:
+                return held
+        for f in held:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        return None
+
+    def count(self, counter):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{self.name}-stats.json"), 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        counts = json.loads(f.read() or '{}')
+                    except ValueError:
+                        counts = {}
+                    counts[counter] = counts.get(counter, 0) + 1
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(counts))
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def stats(self):
+        counts = {}
+        try:
+            with open(os.path.join(self.directory, f"{self.name}-stats.json")) as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                counts = json.loads(f.read() or '{}')
+        except (OSError, ValueError):
+            pass
+        return {'name': self.name, 'slots': self.slots, 'slot_bytes': self.slot_cells * BYTES_PER_CELL,
+                **{counter: counts.get(counter, 0) for counter in COUNTERS}}
+
+
+def downsample(block, step, axis=None):
+    """
+    Means of the step x step tiles of a 2-D block, or of groups of step rows or columns only (axis
+    0 or 1). Tiles at the end may be smaller; NaN cells are left out of their tile's mean.
+    """
+    axes = (0, 1) if axis is None else (axis,)
+    finite = np.isfinite(block)
+    sums = np.where(finite, block, 0.0)
+    counts = finite.astype(np.int32)
+    for ax in axes:
+        starts = np.arange(0, block.shape[ax], step)
+        sums = np.add.reduceat(sums, starts, axis=ax)
+        counts = np.add.reduceat(counts, starts, axis=ax)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
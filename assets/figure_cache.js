@@ -0,0 +1,185 @@
+// Browser cache of rendered industry heatmaps, keyed by industry, snapshot, data version, colour
+// scale, change mode and the server's render mode. Revisiting an industry is served from here
+// without any server work. Figures live in memory up to settings.max_bytes (least recently used
+// first out) and, with settings.persist, also in IndexedDB so they survive reloads. Seeing a newer
+// version of a snapshot drops every figure of its older versions.
+(function () {
+    var DB_NAME = 'covariance-heatmaps';
+    var FIGURES = 'figures';
+    var INDEX = 'index';
+
+    function FigureCache() {
+        this.maxBytes = 0;
+        this.persist = false;
+        this.entries = new Map();  // key -> {snapshot, version, bytes, figure}, least recently used first
+        this.bytes = 0;
+        this.versions = {};  // snapshot -> newest version seen
+        this.db = null;
+    }
+
+    FigureCache.prototype.configure = function (settings) {
+        settings = settings || {};
+        this.maxBytes = settings.max_bytes || 0;
+        if (settings.persist && !this.persist && window.indexedDB) {
+            this.persist = true;
+            this.db = openDatabase();
+        }
+    };
+
+    FigureCache.prototype.key = function (mode, industry, snapshot, version, color, delta) {
+        return JSON.stringify([mode, industry, snapshot, version, color, !!delta]);
+    };
+
+    // Records the version of a snapshot the page currently shows, dropping figures of older ones.
+    // Versions of changes are 'current:previous'; they are retired with the current snapshot
+    FigureCache.prototype.retire = function (snapshot, version) {
+        version = baseVersion(version);
+        if (this.versions[snapshot] === version) {
+            return;
+        }
+        this.versions[snapshot] = version;
+        var self = this;
+        this.entries.forEach(function (entry, key) {
+            if (entry.snapshot === snapshot && baseVersion(entry.version) !== version) {
+                self.remove(key);
+            }
+        });
+        if (this.db) {
+            this.db.then(function (db) {
+                readIndex(db).then(function (index) {
+                    var stale = index.filter(function (item) {
+                        return item.snapshot === snapshot && baseVersion(item.version) !== version;
+                    });
+                    deleteFromDatabase(db, stale.map(function (item) { return item.key; }));
+                });
+            });
+        }
+    };
+
+    FigureCache.prototype.get = function (key) {
+        var entry = this.entries.get(key);
+        if (!entry) {
+            return undefined;
+        }
+        this.entries.delete(key);
+        this.entries.set(key, entry);
+        return entry.figure;
+    };
+
+    // Promise of a figure from IndexedDB (undefined if it is not there), kept in memory once found
+    FigureCache.prototype.load = function (key) {
+        var self = this;
+        if (!this.db) {
+            return Promise.resolve(undefined);
+        }
+        return this.db.then(function (db) {
+            return request(db.transaction(FIGURES).objectStore(FIGURES).get(key));
+        }).then(function (record) {
+            if (!record || self.versions[record.snapshot] !== baseVersion(record.version)) {
+                return undefined;
+            }
+            self.keep(key, record.snapshot, record.version, record.figure, record.bytes);
+            return record.figure;
+        }).catch(function () {
+            return undefined;
+        });
+    };
+
+    // bytes is the length of the JSON text the figure arrived as: close to what it costs to
+    // transfer and about what it holds, without serializing it again here
+    FigureCache.prototype.put = function (key, snapshot, version, figure, bytes) {
+        this.keep(key, snapshot, version, figure, bytes);
+        if (this.db && bytes <= this.maxBytes) {
+            this.db.then(function (db) {
+                return storeInDatabase(db, {key: key, snapshot: snapshot, version: version, bytes: bytes,
+                                            figure: figure}, this.maxBytes);
+            }.bind(this)).catch(function () {});
+        }
+    };
+
+    FigureCache.prototype.keep = function (key, snapshot, version, figure, bytes) {
+        this.remove(key);
+        if (bytes > this.maxBytes) {
+            return;
+        }
+        this.entries.set(key, {snapshot: snapshot, version: version, bytes: bytes, figure: figure});
+        this.bytes += bytes;
+        var self = this;
+        this.entries.forEach(function (entry, oldest) {
+            if (self.bytes > self.maxBytes) {
+                self.remove(oldest);
+            }
+        });
+    };
+
+    FigureCache.prototype.remove = function (key) {
+        var entry = this.entries.get(key);
+        if (entry) {
+            this.bytes -= entry.bytes;
+            this.entries.delete(key);
+        }
+    };
+
+    function baseVersion(version) {
+        return String(version).split(':')[0];
+    }
+
+    function request(req) {
+        return new Promise(function (resolve, reject) {
+            req.onsuccess = function () { resolve(req.result); };
+            req.onerror = function () { reject(req.error); };
+        });
+    }
+
+    function openDatabase() {
+        var req = window.indexedDB.open(DB_NAME, 1);
+        req.onupgradeneeded = function () {
+            // Figures and their small index entries are kept apart, so eviction never reads figures
+            req.result.createObjectStore(FIGURES);
+            req.result.createObjectStore(INDEX, {keyPath: 'key'});
+        };
+        return request(req);
+    }
+
+    function readIndex(db) {
+        return request(db.transaction(INDEX).objectStore(INDEX).getAll());
+    }
+
+    function deleteFromDatabase(db, keys) {
+        if (!keys.length) {
+            return;
+        }
+        var tx = db.transaction([FIGURES, INDEX], 'readwrite');
+        keys.forEach(function (key) {
+            tx.objectStore(FIGURES).delete(key);
+            tx.objectStore(INDEX).delete(key);
+        });
+    }
+
+    function storeInDatabase(db, record, maxBytes) {
+        return readIndex(db).then(function (index) {
+            // Oldest first out, until the new figure fits
+            index.sort(function (a, b) { return a.stored - b.stored; });
+            var total = record.bytes;
+            index.forEach(function (item) {
+                if (item.key !== record.key) {
+                    total += item.bytes;
+                }
+            });
+            var evict = [];
+            for (var i = 0; i < index.length && total > maxBytes; i++) {
+                if (index[i].key !== record.key) {
+                    evict.push(index[i].key);
+                    total -= index[i].bytes;
+                }
+            }
+            deleteFromDatabase(db, evict);
+            var tx = db.transaction([FIGURES, INDEX], 'readwrite');
+            tx.objectStore(FIGURES).put(record, record.key);
+            tx.objectStore(INDEX).put({key: record.key, snapshot: record.snapshot, version: record.version,
+                                       bytes: record.bytes, stored: Date.now()});
+        });
+    }
+
+    window.heatmapFigureCache = new FigureCache();
+})();
@@ -0,0 +1,137 @@
+// Virtualized industry heatmaps: every panel of the heatmap list loads its graph when it scrolls
+// within LOAD_MARGIN of the viewport and releases it when it is more than RELEASE_MARGIN away, so
+// the browser and the server only hold the heatmaps around what is on screen.
+(function () {
+    var LOAD_MARGIN = '600px';
+    var RELEASE_MARGIN = '3000px';
+
+    var EMPTY_FIGURE = {data: [], layout: {xaxis: {visible: false}, yaxis: {visible: false}}};
+
+    function isDelta(delta) {
+        return (delta || []).indexOf('delta') >= 0;
+    }
+
+    // Unzoomed viewport of a newly shown figure, noting whether it has the value label trace
+    // (data[1]) that update_value_labels patches; placeholder figures have no traces
+    function viewportOf(figure) {
+        return {labels: !!(figure && figure.data && figure.data.length > 1)};
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        heatmaps: {
+            // Clientside callback of final_dash.py: for a visible panel, its figure from the browser
+            // cache or else a render request to the server; for a released one, the placeholder
+            // figure (and no zoom)
+            request_industry: function (visible, color, snapshot, delta, version, settings, graphId) {
+                var noUpdate = window.dash_clientside.no_update;
+                if (!visible) {
+                    return [noUpdate, EMPTY_FIGURE, viewportOf(EMPTY_FIGURE)];
+                }
+                var cache = window.heatmapFigureCache;
+                cache.configure(settings);
+                cache.retire(snapshot, version);
+                var key = cache.key(settings.mode, graphId.index, snapshot, version, color, isDelta(delta));
+                var renderRequest = [{color: color, snapshot: snapshot, delta: delta}, noUpdate, noUpdate];
+                var figure = cache.get(key);
+                if (figure) {
+                    return [noUpdate, figure, viewportOf(figure)];
+                }
+                if (!cache.persist) {
+                    return renderRequest;
+                }
+                return cache.load(key).then(function (stored) {
+                    return stored ? [noUpdate, stored, viewportOf(stored)] : renderRequest;
+                });
+            },
+
+            // Clientside callback of final_dash.py: caches a figure the server rendered and shows it
+            // unzoomed, unless its panel was released while it was being rendered
+            show_industry: function (payload, visible, settings) {
+                var noUpdate = window.dash_clientside.no_update;
+                if (!payload) {
+                    return [noUpdate, noUpdate];
+                }
+                // The server sends the payload already encoded as JSON text, whose length is the
+                // figure's size in the cache
+                var bytes = 0;
+                if (typeof payload === 'string') {
+                    bytes = payload.length;
+                    payload = JSON.parse(payload);
+                }
+                if (payload.cache && bytes) {
+                    var cache = window.heatmapFigureCache;
+                    cache.configure(settings);
+                    cache.retire(payload.snapshot, payload.version);
+                    cache.put(cache.key(settings.mode, payload.industry, payload.snapshot, payload.version,
+                                        payload.color, payload.delta),
+                              payload.snapshot, payload.version, payload.figure, bytes);
+                }
+                return visible ? [payload.figure, viewportOf(payload.figure)] : [noUpdate, noUpdate];
+            }
+        }
+    });
+
+    // Last visibility sent per panel, and the render it belongs to
+    var panels = new WeakMap();
+
+    function setVisible(panel, visible) {
+        var state = panels.get(panel);
+        if (!state || state.visible === visible) {
+            return;
+        }
+        state.visible = visible;
+        window.dash_clientside.set_props(
+            {type: 'industry-visible', index: panel.dataset.industry}, {data: visible}
+        );
+    }
+
+    var loader = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (entry.isIntersecting) {
+                setVisible(entry.target, true);
+            }
+        });
+    }, {rootMargin: LOAD_MARGIN});
+
+    var releaser = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (!entry.isIntersecting) {
+                setVisible(entry.target, false);
+            }
+        });
+    }, {rootMargin: RELEASE_MARGIN});
+
+    function track(panel) {
+        var state = panels.get(panel);
+        if (state && state.render === panel.dataset.render) {
+            return;
+        }
+        // A new panel, or one the server rendered again: it starts released. Observing it again
+        // makes both observers report its current position
+        panels.set(panel, {render: panel.dataset.render, visible: false});
+        loader.unobserve(panel);
+        releaser.unobserve(panel);
+        loader.observe(panel);
+        releaser.observe(panel);
+    }
+
+    function scan() {
+        document.querySelectorAll('.industry-panel').forEach(track);
+    }
+
+    function start() {
+        new MutationObserver(scan).observe(document.body, {
+            childList: true,
+            subtree: true,
+            attributes: true,
+            attributeFilter: ['data-render']
+        });
+        scan();
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', start);
+    } else {
+        start();
+    }
+})();
@@ -0,0 +1,108 @@
+"""
+Builds `_dash-update-component` requests the way the browser does, from the app's `/_dash-dependencies`,
+so benchmarks and load tests exercise the same code path as a real session.
+"""
+import json
+import time
+
+
+
+def parse_outputs(output):
+    # '..a.children...b.data..' (several outputs) or 'a.children' (one); '@hash' marks allow_duplicate
+    if output.startswith('..'):
+        parts = output[2:-2].split('...')
+    else:
+        parts = [output]
+    outputs = []
+    for part in parts:
+        component_id, prop = part.rsplit('.', 1)
+        outputs.append({'id': component_id, 'property': prop.split('@')[0]})
+    return outputs
+
+
+def component_key(component_id, prop):
+    # 'component-id.property'; pattern-matching ids ('{"index":["MATCH"],"type":"t"}') go by their type
+    if component_id.startswith('{'):
+        component_id = json.loads(component_id)['type']
+    return f"{component_id}.{prop}"
+
+
+def resolve_id(component_id, match):
+    # A pattern-matching id as the browser sends it, with MATCH replaced by the given index
+    if not component_id.startswith('{'):
+        return component_id
+    return {k: match if v == ['MATCH'] else v for k, v in json.loads(component_id).items()}
+
+
+def find_callback(dependencies, output):
+    """
+    The dependency entry of the server-side callback writing output ('component-id.property', or
+    'type.property' for pattern-matching ids).
+    """
+    for callback in dependencies:
+        if callback.get('clientside_function'):
+            continue
+        if any(component_key(o['id'], o['property']) == output for o in parse_outputs(callback['output'])):
+            return callback
+    raise KeyError(f"No callback outputs {output}")
+
+
+def callback_body(callback, values, changed=None, match=None):
+    """
+    Request body for one callback.
+
+    Parameters:
+    - callback: Entry of /_dash-dependencies (see find_callback)
+    - values: Dictionary of 'component-id.property' (or 'type.property') to the current value of
+      each input and state
+    - changed: The inputs that triggered the call (defaults to the first input)
+    - match: Index of the component a pattern-matching (MATCH) callback is called for
+    """
+    def resolve(dependency):
+        return {'id': resolve_id(dependency['id'], match), 'property': dependency['property']}
+
+    def with_value(dependency):
+        # The 'id' property of a component is its (resolved) id itself
+        resolved = resolve(dependency)
+        if resolved['property'] == 'id':
+            return {**resolved, 'value': resolved['id']}
+        return {**resolved, 'value': values.get(component_key(dependency['id'], dependency['property']))}
+
+    outputs = [resolve(o) for o in parse_outputs(callback['output'])]
+    inputs = [with_value(i) for i in callback['inputs']]
+    state = [with_value(s) for s in callback['state']]
+    first = inputs[0]['id']
+    if isinstance(first, dict):
+        first = json.dumps(first, sort_keys=True, separators=(',', ':'))
+    return {
+        'output': callback['output'],
+        'outputs': outputs if len(outputs) > 1 else outputs[0],
+        'inputs': inputs,
+        'state': state,
+        'changedPropIds': changed or [f"{first}.{inputs[0]['property']}"],
+    }
+
+
+def run_callback(post, body, poll_interval=0.05):
+    """
+    Sends a callback request and, if the callback runs as a background job, polls the job until
+    its result is ready, as the browser does.
+
+    Parameters:
+    - post: Function post(query, body) sending body to '/_dash-update-component' + query and
+      returning (status code, response bytes)
+    - body: Request body from callback_body
+    - poll_interval: Seconds between polls
+
+    Returns the status code and bytes of the response that carries the result.
+    """
+    status, content = post('', body)
+    data = json.loads(content) if status == 200 and content else {}
+    if 'cacheKey' not in data:
+        return status, content
+    query = f"?cacheKey={data['cacheKey']}&job={data['job']}"
+    while True:
+        time.sleep(poll_interval)
+        status, content = post(query, body)
+        if status != 200 or 'response' in json.loads(content or b'{}'):
+            return status, content
@@ -0,0 +1,129 @@
+"""
+Compares the heatmap figure built through make_subplots/go.Heatmap with the dictionary built by
+fast_figure, for one block of every industry size at each universe size: checks that both serialize
+to the same JSON and times building and serializing each.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import numpy as np
+import plotly
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+from plotly.subplots import make_subplots
+
+from run_benchmarks import DEFAULT_SIZES, REPO_DIR, git_commit
+from synthetic_data import industry_sizes
+
+sys.path.insert(0, REPO_DIR)
+import fast_figure  # noqa: E402
+
+
+def plotly_figure(blocks, tickers, titles, color_scale, zmin, zmax):
+    # The figure as update_heatmap_and_color_scale built it with plotly graph_objects
+    cols = 2
+    rows = (len(blocks) + cols - 1) // cols
+    fig = make_subplots(rows=rows, cols=cols, subplot_titles=titles)
+    label_traces = []
+    for idx, block in enumerate(blocks):
+        row, col = divmod(idx, cols)
+        fig.add_trace(go.Heatmap(z=block, x=tickers[idx], y=tickers[idx], colorscale=color_scale,
+                                 zmin=zmin, zmax=zmax), row=row + 1, col=col + 1)
+        label_traces.append((go.Heatmap(z=[], colorscale=color_scale, showscale=False, texttemplate='%{text}',
+                                        hoverinfo='skip', zmin=zmin, zmax=zmax), row + 1, col + 1))
+    for trace, row, col in label_traces:
+        fig.add_trace(trace, row=row, col=col)
+    fig.update_layout(title="Industry Covariance Heatmaps", width=1000, height=500 * rows, showlegend=False,
+                      margin=dict(t=50, b=50, l=50, r=50))
+    return fig
+
+
+def dict_figure(blocks, tickers, titles, color_scale, zmin, zmax):
+    # The same figure through fast_figure, as the app builds each industry's graph (with --industries 1)
+    cols = 2
+    rows = (len(blocks) + cols - 1) // cols
+    layout = fast_figure.subplot_grid(rows, cols, titles)
+    heatmaps = [fast_figure.heatmap_trace(idx + 1, z=block, x=tickers[idx], y=tickers[idx],
+                                          colorscale=color_scale, zmin=zmin, zmax=zmax)
+                for idx, block in enumerate(blocks)]
+    label_traces = [fast_figure.heatmap_trace(idx + 1, z=[], colorscale=color_scale, showscale=False,
+                                              texttemplate='%{text}', hoverinfo='skip', zmin=zmin, zmax=zmax)
+                    for idx in range(len(blocks))]
+    layout.update(title={'text': "Industry Covariance Heatmaps"}, width=1000, height=500 * rows,
+                  showlegend=False, margin=dict(t=50, b=50, l=50, r=50))
+    return fast_figure.figure(heatmaps + label_traces, layout)
+
+
+def time_build(build, args, repeat):
+    # Median build and serialization time; returns them with the last JSON
+    build_times, serialize_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fig = build(*args)
+        middle = time.perf_counter()
+        payload = to_json_plotly(fig)
+        build_times.append(middle - start)
+        serialize_times.append(time.perf_counter() - middle)
+    return float(np.median(build_times)), float(np.median(serialize_times)), payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark plotly graph_objects against fast_figure.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Numbers of tickers")
+    parser.add_argument('--industries', type=int, default=1, help="Industries of the same size per figure")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-cells', type=int, default=25_000_000,
+                        help="Skip industries whose figure has more cells than this")
+    parser.add_argument('--no-check', action='store_true', help="Do not compare the two JSON outputs")
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/figure_<commit>.json)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+    for n in args.sizes:
+        for industry, m in industry_sizes(n).items():
+            entry = {'tickers': n, 'industry': industry, 'size': m}
+            results.append(entry)
+            if args.industries * m * m > args.max_cells:
+                entry['skipped'] = f"more than {args.max_cells} cells"
+                continue
+            blocks, tickers = [], []
+            for _ in range(args.industries):
+                factor = rng.normal(size=(m, 8))
+                blocks.append(factor @ factor.T * 1e-4)
+                tickers.append([f"T{i}" for i in range(m)])
+            titles = [industry] * args.industries
+            figure_args = (blocks, tickers, titles, 'Viridis', -1e-3, 1e-3)
+
+            entry['plotly_build_s'], entry['plotly_serialize_s'], expected = \
+                time_build(plotly_figure, figure_args, args.repeat)
+            entry['fast_build_s'], entry['fast_serialize_s'], actual = \
+                time_build(dict_figure, figure_args, args.repeat)
+            entry['bytes'] = len(actual)
+            entry['speedup'] = ((entry['plotly_build_s'] + entry['plotly_serialize_s'])
+                                / (entry['fast_build_s'] + entry['fast_serialize_s']))
+            if not args.no_check:
+                entry['identical'] = json.loads(expected) == json.loads(actual)
+            print(f"{n:>6} {industry:<36} {m:>6}: plotly {entry['plotly_build_s'] + entry['plotly_serialize_s']:.3f}s, "
+                  f"fast {entry['fast_build_s'] + entry['fast_serialize_s']:.3f}s ({entry['speedup']:.1f}x)"
+                  + ('' if args.no_check else f", identical: {entry['identical']}"), file=sys.stderr)
+
+    commit = git_commit()
+    output = args.output or os.path.join(REPO_DIR, 'benchmarks', 'results', f"figure_{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'plotly': plotly.__version__,
+            'json_engine': plotly.io.json.config.default_engine,
+            'results': results,
+        }, f, indent=2)
+    print(f"Results written to '{output}'", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
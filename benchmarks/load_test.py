@@ -0,0 +1,311 @@
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import socket
+import argparse
+import datetime
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+import numpy as np
+
+from dash_client import callback_body, find_callback, run_callback
+from run_benchmarks import DATA_DIR, REPO_DIR, SNAPSHOT_NAME, git_commit, rss_mb
+from synthetic_data import write_synthetic_snapshot
+from build_artifacts import INDUSTRIES_PKL
+
+# Relative frequency of each user action, and the requests a browser sends for it
+DEFAULT_MIX = {'industry': 5, 'colour': 2, 'download': 1}
+COLOR_SCALES = ['Viridis', 'Cividis', 'Blues', 'YlGnBu', 'RdBu']
+
+
+def parse_mix(text):
+    # 'industry=5,colour=2,download=1'
+    mix = {}
+    for part in text.split(','):
+        action, _, weight = part.partition('=')
+        if action.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown action '{action}' (expected one of {', '.join(DEFAULT_MIX)})")
+        mix[action.strip()] = float(weight)
+    return mix
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(port):
+    # Runs the app in this process on a threaded development server, as in a single-instance deployment
+    sys.path.insert(0, REPO_DIR)
+    import final_dash
+    final_dash.app.server.run(host='127.0.0.1', port=port, threaded=True, debug=False)
+
+
+def start_server(snapshot_dir, port, timeout=600):
+    """Starts the app on the synthetic snapshots and waits until it answers."""
+    env = dict(os.environ, SNAPSHOT_DIR=snapshot_dir, RELOAD_INTERVAL='0')
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', str(port)],
+        env=env, cwd=os.path.dirname(snapshot_dir)
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The app exited with code {process.returncode} during startup")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_dash-dependencies", timeout=5).read()
+            return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError(f"The app did not answer within {timeout}s")
+
+
+class Recorder:
+    """Thread-safe log of (endpoint, start offset, latency, ok) for every request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def call(self, endpoint, send):
+        # send() returns the final status code; connection failures count as errors
+        start = time.perf_counter()
+        try:
+            ok = send() == 200
+        except (urllib.error.URLError, OSError):
+            ok = False
+        with self._lock:
+            self.samples.append((endpoint, start - self.start, time.perf_counter() - start, ok))
+        return ok
+
+
+class Session:
+    """One simulated analyst: keeps its own dropdown values and sends what the browser would send."""
+
+    def __init__(self, base_url, dependencies, industries, snapshot, recorder, rng, timeout, browser_cache=True):
+        self.base_url = base_url
+        self.panels = find_callback(dependencies, 'heatmap-container.children')
+        self.heatmap = find_callback(dependencies, 'industry-payload.data')
+        self.summary = find_callback(dependencies, 'summary-heatmap.figure')
+        self.industries = industries
+        self.recorder = recorder
+        self.rng = rng
+        self.timeout = timeout
+        # Graphs the browser's figure cache holds, which are shown without asking the server
+        self.cached = set() if browser_cache else None
+        self.values = {
+            'industry-dropdown.value': [rng.choice(industries)],
+            'color-dropdown.value': 'Viridis',
+            'snapshot-dropdown.value': snapshot,
+            'delta-toggle.value': [],
+            'summary-measure.value': 'correlation',
+            'summary-stat.value': 'mean',
+        }
+
+    def post(self, query, body):
+        request = urllib.request.Request(
+            f"{self.base_url}/_dash-update-component{query}", data=json.dumps(body).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.status, response.read()
+
+    def get(self, url):
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            response.read()
+            return response.status
+
+    def post_callback(self, endpoint, callback, changed, match=None):
+        # Background callbacks are polled until their job finishes, so latency covers the whole render
+        body = callback_body(callback, self.values, [changed] if changed else None, match)
+        return self.recorder.call(endpoint, lambda: run_callback(self.post, body)[0])
+
+    def render_graphs(self, endpoint):
+        # Every selected industry's graph, as the browser asks for them once their panels are in view
+        self.values['industry-request.data'] = {
+            'color': self.values['color-dropdown.value'],
+            'snapshot': self.values['snapshot-dropdown.value'],
+            'delta': self.values['delta-toggle.value'],
+        }
+        for industry in self.values['industry-dropdown.value']:
+            key = (industry, self.values['color-dropdown.value'])
+            if self.cached is not None and key in self.cached:
+                continue
+            if self.post_callback(endpoint, self.heatmap, None, industry) and self.cached is not None:
+                self.cached.add(key)
+
+    def industry(self):
+        # Pick one or two industries, as analysts comparing blocks do
+        self.values['industry-dropdown.value'] = self.rng.sample(self.industries, self.rng.choice([1, 1, 2]))
+        self.post_callback('panels (industry)', self.panels, 'industry-dropdown.value')
+        self.render_graphs('heatmap (industry)')
+
+    def colour(self):
+        self.values['color-dropdown.value'] = self.rng.choice(COLOR_SCALES)
+        self.render_graphs('heatmap (colour)')
+        self.post_callback('summary (colour)', self.summary, 'color-dropdown.value')
+
+    def download(self):
+        industry = self.rng.choice(self.values['industry-dropdown.value'])
+        url = f"{self.base_url}/download/{quote(industry)}?snapshot={self.values['snapshot-dropdown.value']}"
+        self.recorder.call('download', lambda: self.get(url))
+
+    def run(self, mix, think, stop):
+        actions, weights = list(mix), list(mix.values())
+        # Stagger the first requests so sessions do not start in lockstep
+        stop.wait(self.rng.uniform(0, think))
+        while not stop.is_set():
+            getattr(self, self.rng.choices(actions, weights)[0])()
+            stop.wait(self.rng.expovariate(1 / think) if think > 0 else 0)
+
+
+def sample_memory(pid, interval, recorder, stop, samples):
+    while not stop.is_set():
+        rss, _ = rss_mb(pid)
+        if rss is not None:
+            samples.append([round(time.perf_counter() - recorder.start, 2), round(rss, 1)])
+        stop.wait(interval)
+
+
+def summarize(samples, duration):
+    """Throughput, error rate and latency percentiles per endpoint.
+
+    Throughput counts the requests that finished within the load window of `duration` seconds; requests still in
+    flight when it ended are drained afterwards and reported as `late`, with their latencies kept in the percentiles.
+    """
+    report = {}
+    for endpoint in sorted({s[0] for s in samples}):
+        rows = [s for s in samples if s[0] == endpoint]
+        latencies = np.array([s[2] for s in rows if s[3]])
+        errors = sum(not s[3] for s in rows)
+        late = sum(s[1] + s[2] > duration for s in rows)
+        stats = {
+            'requests': len(rows),
+            'late': late,
+            'errors': errors,
+            'error_rate': errors / len(rows),
+            'throughput_per_s': (len(rows) - late) / duration,
+        }
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats.update(p50_s=float(p50), p95_s=float(p95), p99_s=float(p99), max_s=float(latencies.max()))
+        report[endpoint] = stats
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate concurrent browser sessions against a locally started app on synthetic data."
+    )
+    parser.add_argument('--sessions', type=int, default=10, help="Concurrent simulated analysts")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds of load")
+    parser.add_argument('--think', type=float, default=2.0, help="Mean think time between actions, in seconds")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="Relative action frequencies, e.g. industry=5,colour=2,download=1")
+    parser.add_argument('--tickers', type=int, default=9782, help="Size of the synthetic universe")
+    parser.add_argument('--max-industry', type=int, default=None,
+                        help="Leave out industries with more tickers than this")
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help="Where synthetic snapshots are generated (shared with run_benchmarks.py)")
+    parser.add_argument('--url', help="Load an already running app instead of starting one (no memory samples)")
+    parser.add_argument('--timeout', type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument('--sample-interval', type=float, default=1.0, help="Seconds between server memory samples")
+    parser.add_argument('--no-browser-cache', action='store_true',
+                        help="Fetch every graph again, as if the browser kept no rendered figures")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/load_<commit>.json)")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    snapshot_dir = os.path.join(os.path.abspath(args.data_dir), f"n{args.tickers}", "snapshots")
+    write_synthetic_snapshot(os.path.join(snapshot_dir, SNAPSHOT_NAME), args.tickers, args.seed)
+    with open(os.path.join(snapshot_dir, SNAPSHOT_NAME, INDUSTRIES_PKL), "rb") as f:
+        industry_lists = pickle.load(f)
+    industries = [industry for industry, tickers in industry_lists.items()
+                  if args.max_industry is None or len(tickers) <= args.max_industry]
+    if not industries:
+        parser.error("No industry is small enough for --max-industry")
+
+    process = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        port = free_port()
+        print(f"Starting the app on {args.tickers} synthetic tickers", file=sys.stderr)
+        process = start_server(snapshot_dir, port)
+        base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        dependencies = json.loads(urllib.request.urlopen(f"{base_url}/_dash-dependencies").read())
+        recorder = Recorder()
+        stop = threading.Event()
+        memory = []
+        threads = []
+        if process is not None:
+            threads.append(threading.Thread(
+                target=sample_memory, args=(process.pid, args.sample_interval, recorder, stop, memory)
+            ))
+        for i in range(args.sessions):
+            session = Session(base_url, dependencies, industries, SNAPSHOT_NAME, recorder,
+                              random.Random(args.seed + i), args.timeout, not args.no_browser_cache)
+            threads.append(threading.Thread(target=session.run, args=(args.mix, args.think, stop)))
+        print(f"{args.sessions} sessions for {args.duration:.0f}s", file=sys.stderr)
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        # Rates are taken over the load window; the drain of requests in flight is timed separately
+        duration = time.perf_counter() - recorder.start
+        for thread in threads:
+            thread.join()
+        drain = time.perf_counter() - recorder.start - duration
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = summarize(recorder.samples, duration)
+    print(f"{'endpoint':<20} {'req/s':>7} {'late':>5} {'errors':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint, stats in report.items():
+        print(f"{endpoint:<20} {stats['throughput_per_s']:>7.2f} {stats['late']:>5} {stats['error_rate']:>7.1%} "
+              + ' '.join(f"{stats.get(p, float('nan')):>7.3f}s" for p in ('p50_s', 'p95_s', 'p99_s')))
+    print(f"Load window {duration:.1f}s, {drain:.1f}s to drain requests in flight", file=sys.stderr)
+    if memory:
+        print(f"Server memory: {memory[0][1]:.0f} MB at start, {max(m[1] for m in memory):.0f} MB peak")
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'tickers': args.tickers,
+        'sessions': args.sessions,
+        'think_s': args.think,
+        'mix': args.mix,
+        'duration_s': duration,
+        'drain_s': drain,
+        'cpus': os.cpu_count(),
+        'endpoints': report,
+        'server_rss_mb': memory,
+    }
+    output = args.output or os.path.join(REPO_DIR, 'benchmarks', 'results', f"load_{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to '{output}'", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import resource
+import subprocess
+import tempfile
+import tracemalloc
+from urllib.parse import quote
+import numpy as np
+
+from synthetic_data import write_synthetic_snapshot
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [9782, 20000, 50000]
+SNAPSHOT_NAME = "2024-01-31"
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'covariance-benchmarks')
+
+
+def rss_mb(pid='self'):
+    # Current and peak resident memory of a process (Linux /proc; elsewhere only this process's peak is known)
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            status = dict(line.split(':', 1) for line in f)
+        return int(status['VmRSS'].split()[0]) / 1024, int(status['VmHWM'].split()[0]) / 1024
+    except OSError:
+        if pid != 'self':
+            return None, None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+
+
+def measure(request, repeat):
+    """
+    Times request() repeat times, then runs it once more under tracemalloc for its peak allocation.
+    request() returns the status code and bytes of the response. Background callbacks run in a
+    worker process, so their traced peak only covers the request side.
+
+    Returns median and min latency, the response size and the traced peak in MB.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        status, content = request()
+        times.append(time.perf_counter() - start)
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}: {content[:200].decode(errors='replace')}")
+    tracemalloc.start()
+    status, content = request()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'median_s': float(np.median(times)),
+        'min_s': min(times),
+        'bytes': len(content),
+        'peak_alloc_mb': peak / 2**20,
+    }
+
+
+def run_worker(repeat, max_cells):
+    # Runs in a fresh process per matrix size, with SNAPSHOT_DIR pointing at the synthetic data
+    sys.path.insert(0, REPO_DIR)
+    start = time.perf_counter()
+    import final_dash
+    startup_s = time.perf_counter() - start
+    rss, peak = rss_mb()
+    result = {'startup_s': startup_s, 'startup_rss_mb': rss, 'startup_peak_rss_mb': peak, 'industries': []}
+
+    from dash_client import callback_body, find_callback, run_callback
+    client = final_dash.app.server.test_client()
+
+    def post(query, body):
+        response = client.post('/_dash-update-component' + query, json=body)
+        return response.status_code, response.get_data()
+
+    def get(url):
+        response = client.get(url)
+        return response.status_code, response.get_data()
+    dependencies = client.get('/_dash-dependencies').get_json()
+    heatmap = find_callback(dependencies, 'industry-payload.data')
+    snap = final_dash.store.get()
+
+    for industry, pos in sorted(snap.positions.items(), key=lambda item: len(item[1])):
+        entry = {'industry': industry, 'size': len(pos)}
+        result['industries'].append(entry)
+        if len(pos) ** 2 > max_cells:
+            entry['skipped'] = f"more than {max_cells} cells"
+            continue
+        # The render of one industry's graph, as requested once its panel scrolls into view
+        body = callback_body(heatmap, {
+            'industry-request.data': {'color': 'Viridis', 'snapshot': snap.name, 'delta': []},
+            'snapshot-dropdown.value': snap.name,
+            'delta-toggle.value': [],
+        }, match=industry)
+        entry['callback'] = measure(lambda: run_callback(post, body), repeat)
+        download = measure(lambda: get(f"/download/{quote(industry)}?snapshot={snap.name}"), repeat)
+        download['mb_per_s'] = download['bytes'] / 2**20 / download['median_s']
+        entry['download'] = download
+        print(f"  {industry} ({len(pos)}): callback {entry['callback']['median_s']:.3f}s, "
+              f"download {download['mb_per_s']:.1f} MB/s", file=sys.stderr)
+
+    result['final_rss_mb'], result['peak_rss_mb'] = rss_mb()
+    json.dump(result, sys.stdout)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_size(n, data_dir, repeat, max_cells, derive, seed):
+    """Generates (or reuses) the synthetic snapshot for n tickers and benchmarks it in a new process."""
+    snapshot_dir = os.path.join(os.path.abspath(data_dir), f"n{n}", "snapshots")
+    path = os.path.join(snapshot_dir, SNAPSHOT_NAME)
+    start = time.perf_counter()
+    manifest = write_synthetic_snapshot(path, n, seed)
+    result = {'tickers': n, 'version': manifest['version'], 'generate_s': time.perf_counter() - start}
+    if derive:
+        sys.path.insert(0, REPO_DIR)
+        from build_artifacts import derive_artifacts
+        start = time.perf_counter()
+        derive_artifacts(path)
+        result['derive_s'] = time.perf_counter() - start
+
+    env = dict(os.environ, SNAPSHOT_DIR=snapshot_dir, RELOAD_INTERVAL='0')
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--worker', '--repeat', str(repeat), '--max-cells', str(max_cells)],
+        env=env, cwd=data_dir, text=True
+    )
+    result['process_s'] = time.perf_counter() - start
+    result.update(json.loads(output))
+    return result
+
+
+def compare(baseline_file, results, threshold=0.2):
+    # Prints metrics that changed by more than threshold relative to a previous results file
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    old = {r['tickers']: r for r in baseline['results']}
+    for new in results['results']:
+        before = old.get(new['tickers'])
+        if before is None:
+            continue
+        pairs = [('startup_s', before['startup_s'], new['startup_s']),
+                 ('peak_rss_mb', before['peak_rss_mb'], new['peak_rss_mb'])]
+        old_industries = {i['industry']: i for i in before['industries']}
+        for industry in new['industries']:
+            previous = old_industries.get(industry['industry'], {})
+            for kind in ('callback', 'download'):
+                if kind in industry and kind in previous:
+                    for metric in ('median_s', 'bytes', 'peak_alloc_mb'):
+                        pairs.append((f"{industry['industry']} {kind} {metric}",
+                                      previous[kind][metric], industry[kind][metric]))
+        for name, a, b in pairs:
+            if a and abs(b / a - 1) > threshold:
+                print(f"{new['tickers']:>6} {name}: {a:.4g} -> {b:.4g} ({(b / a - 1) * 100:+.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark startup, heatmap callbacks and CSV downloads on synthetic covariance matrices."
+    )
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Numbers of tickers")
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help="Where synthetic snapshots are generated (and reused between runs)")
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per measurement")
+    parser.add_argument('--max-cells', type=int, default=25_000_000,
+                        help="Skip industries whose heatmap has more cells than this")
+    parser.add_argument('--derive', action='store_true',
+                        help="Also build (and time) the summary, network, neighbour and eigen artifacts")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', help="Earlier results file to report changes against")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.repeat, args.max_cells)
+        return
+
+    import dash
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'dash': dash.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': [],
+    }
+    os.makedirs(args.data_dir, exist_ok=True)
+    for n in args.sizes:
+        print(f"{n} tickers", file=sys.stderr)
+        results['results'].append(benchmark_size(n, args.data_dir, args.repeat, args.max_cells, args.derive, args.seed))
+
+    output = args.output or os.path.join(REPO_DIR, 'benchmarks', 'results', f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to '{output}'", file=sys.stderr)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import pickle
+import string
+import argparse
+import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from build_artifacts import (  # noqa: E402
+    COVARIANCE_NPY, INDUSTRIES_PKL, MANIFEST_FILE, TICKERS_PKL, write_manifest
+)
+
+# Industry sizes of the full 9,782-ticker universe; other sizes keep the same proportions
+REAL_INDUSTRY_SIZES = {
+    'Energy': 726,
+    'Manufacturing': 830,
+    'Industrial Applications & Services': 541,
+    'Financials': 450,
+    'Life Sciences': 925,
+    'Real Estate': 774,
+    'Trade & Services': 714,
+    'Technology': 889,
+    'No Industry': 3933,
+}
+
+# Style factors shared by all industries, on top of one market and one factor per industry
+STYLE_FACTORS = 5
+
+
+def industry_sizes(n):
+    # Scales the real distribution to n tickers, rounding by largest remainder so the sizes add up to n
+    total = sum(REAL_INDUSTRY_SIZES.values())
+    exact = {industry: size * n / total for industry, size in REAL_INDUSTRY_SIZES.items()}
+    sizes = {industry: int(value) for industry, value in exact.items()}
+    for industry in sorted(exact, key=lambda i: exact[i] - sizes[i], reverse=True)[:n - sum(sizes.values())]:
+        sizes[industry] += 1
+    return sizes
+
+
+def synthetic_tickers(n, rng):
+    # Unique 1-5 letter symbols, so labels (and payload sizes) look like the real ones
+    letters = np.array(list(string.ascii_uppercase))
+    tickers = set()
+    while len(tickers) < n:
+        for length in rng.integers(1, 6, size=n - len(tickers)):
+            tickers.add(''.join(rng.choice(letters, length)))
+    return sorted(tickers)
+
+
+def write_synthetic_snapshot(path, n, seed=0, block_rows=512):
+    """
+    Writes a snapshot folder holding a random n x n covariance matrix with the real industry mix.
+
+    The matrix comes from a factor model (market, one factor per industry and a few style factors,
+    plus idiosyncratic variance), so it is symmetric positive definite with realistic within- and
+    cross-industry structure. It is written a band of rows at a time into the memory-mapped
+    covariance.npy, so even 50,000 tickers never need the whole matrix in memory.
+
+    An existing snapshot generated with the same n and seed is reused.
+
+    Parameters:
+    - path: Snapshot folder to write, e.g. <data dir>/snapshots/2024-01-31
+    - n: Number of tickers
+    - seed: Random seed
+    - block_rows: Rows per band
+    """
+    synthetic = {'tickers': n, 'seed': seed}
+    manifest_file = os.path.join(path, MANIFEST_FILE)
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest.get('synthetic') == synthetic:
+            return manifest
+
+    rng = np.random.default_rng(seed)
+    names = synthetic_tickers(n, rng)
+    rng.shuffle(names)
+    industry_lists, tickers, start = {}, [], 0
+    for industry, size in industry_sizes(n).items():
+        industry_lists[industry] = sorted(names[start:start + size])
+        tickers.extend(industry_lists[industry])
+        start += size
+
+    # Daily-return scale loadings: market, own industry, styles
+    loadings = np.zeros((n, 1 + len(industry_lists) + STYLE_FACTORS))
+    loadings[:, 0] = rng.normal(1.0, 0.3, n) * 0.01
+    start = 0
+    for i, tickers_in_industry in enumerate(industry_lists.values()):
+        stop = start + len(tickers_in_industry)
+        loadings[start:stop, 1 + i] = rng.normal(0.8, 0.3, stop - start) * 0.01
+        start = stop
+    loadings[:, -STYLE_FACTORS:] = rng.normal(0.0, 0.004, (n, STYLE_FACTORS))
+    idiosyncratic = rng.uniform(1e-4, 4e-4, n)
+
+    os.makedirs(path, exist_ok=True)
+    values = np.lib.format.open_memmap(os.path.join(path, COVARIANCE_NPY), mode='w+', dtype=np.float64, shape=(n, n))
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        band = loadings[start:stop] @ loadings.T
+        band[np.arange(stop - start), np.arange(start, stop)] += idiosyncratic[start:stop]
+        values[start:stop] = band
+    values.flush()
+    with open(os.path.join(path, TICKERS_PKL), "wb") as f:
+        pickle.dump(tickers, f)
+    with open(os.path.join(path, INDUSTRIES_PKL), "wb") as f:
+        pickle.dump(industry_lists, f)
+    return write_manifest(path, tickers, values, synthetic=synthetic)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic covariance snapshot with the real industry mix.")
+    parser.add_argument('tickers', type=int, help="Number of tickers, e.g. 9782")
+    parser.add_argument('--snapshot-dir', default='snapshots')
+    parser.add_argument('--date', default=datetime.date.today().isoformat())
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    path = os.path.join(args.snapshot_dir, args.date)
+    manifest = write_synthetic_snapshot(path, args.tickers, args.seed)
+    print(f"Synthetic snapshot with {args.tickers} tickers written to '{path}' (version {manifest['version']})")
+
+
+if __name__ == "__main__":
+    main()
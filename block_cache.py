@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+
+# Every BlockCache created, so a data reload can drop entries of retired versions everywhere
+caches = []
+
+
+class BlockCache:
+    """
+    Thread-safe least-recently-used cache of NumPy results, bounded by total bytes.
+
+    Keys should start with the data version, so results computed for an older matrix are never
+    served and can be dropped with discard_version().
+
+    Parameters:
+    - name: Label used when reporting cache statistics
+    - max_bytes: Entries are evicted, oldest first, once their arrays exceed this many bytes
+    """
+
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        caches.append(self)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return value
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+        return value
+
+    def get_or_compute(self, key, compute, nbytes=lambda value: value.nbytes):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value, nbytes(value))
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {'name': self.name, 'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def discard_version(self, version):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == version]:
+                self._bytes -= self._entries.pop(key)[1]
+
+
+def discard_version(version):
+    """Drops every cached result computed for the given data version."""
+    for cache in caches:
+        cache.discard_version(version)
@@ -0,0 +1,626 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from factor_model import FACTOR_RANK, factor_error, fit_factor_model, industry_groups, save_factor_model
+from integrity import Checksums, IntegrityError, check_matrix, write_integrity, write_json
+
+# Source pickles produced by downsize_pickle.ipynb
+COVARIANCE_FILE = "new_sorted_covariance.pkl"
+INDUSTRIES_FILE = "new_sorted_industries.pkl"
+
+# Dated snapshots are written to SNAPSHOT_DIR/<date>/, each holding the files below
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "snapshots")
+MANIFEST_FILE = "manifest.json"
+COVARIANCE_NPY = "covariance.npy"
+TICKERS_PKL = "tickers.pkl"
+INDUSTRIES_PKL = "industries.pkl"
+SUMMARY_FILE = "industry_summary.pkl"
+EIGEN_FILE = "industry_eigen.pkl"
+NETWORK_FILE = "correlation_network.json"
+# CSR arrays of the network at the level with position {index}, one .npy file each (see save_network)
+NETWORK_ARRAY_FILE = "correlation_network_{index}_{part}.npy"
+NETWORK_PARTS = ('indptr', 'indices', 'corr')
+NEIGHBOURS_FILE = "neighbours.npz"
+# Replaces covariance.npy in snapshots packed as a difference to the next newer snapshot
+DELTA_FILE = "covariance_delta.npz"
+
+# Statistics stored for every pair of industries
+SUMMARY_MEASURES = ['covariance', 'correlation']
+SUMMARY_STATS = ['mean', 'median', 'max']
+
+# Number of leading eigenvectors kept per industry (all eigenvalues are kept)
+EIGEN_TOP_K = 20
+
+# |correlation| thresholds with a precomputed edge list in the co-movement network
+NETWORK_LEVELS = [0.5, 0.6, 0.7, 0.8, 0.9]
+
+# Most correlated tickers stored per ticker for the "similar tickers" lookup
+NEIGHBOURS_K = 50
+
+
+def industry_positions(tickers, industry_lists):
+    """
+    Maps every industry to the integer positions of its tickers in the matrix.
+
+    Parameters:
+    - tickers: Row (and column) labels of the covariance matrix
+    - industry_lists: Dictionary with industries as keys and ticker lists as values
+    """
+    index = pd.Index(tickers)
+    positions = {}
+    for industry, members in industry_lists.items():
+        found = index.get_indexer(members)
+        positions[industry] = found[found >= 0]
+    return positions
+
+
+def c_order(values):
+    # The matrix is symmetric, so a Fortran-ordered array's transpose has the same content in C order
+    if not values.flags.c_contiguous and values.flags.f_contiguous:
+        return values.T
+    return np.ascontiguousarray(values)
+
+
+def data_version(tickers, values):
+    """
+    Short content hash of a covariance matrix and its tickers, used to tell stale artifacts apart.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update("\n".join(map(str, tickers)).encode())
+    digest.update(c_order(values).data)
+    return digest.hexdigest()
+
+
+def color_limits(values, step=1024):
+    # Mean +/- 2 standard deviations of the whole matrix, accumulated a band of rows at a time
+    total, total_sq = 0.0, 0.0
+    for start in range(0, len(values), step):
+        band = np.asarray(values[start:start + step], dtype=float)
+        total += band.sum()
+        total_sq += np.square(band).sum()
+    count = values.shape[0] * values.shape[1]
+    mean = total / count
+    std = np.sqrt(max(total_sq / count - mean ** 2, 0.0))
+    return mean - 2 * std, mean + 2 * std
+
+
+def industry_summary(values, positions):
+    """
+    Reduces the covariance matrix to K x K statistics between every pair of industries.
+
+    The rows of each industry are read once and every industry block inside them is
+    reduced to its mean, median and max covariance and correlation. Only blocks on or
+    above the diagonal are computed; the rest are mirrored. Within an industry the
+    ticker-with-itself cells are left out, so the statistics describe how different
+    tickers move together.
+
+    Parameters:
+    - values: The full covariance matrix as a 2-D array
+    - positions: Dictionary with industries as keys and matrix positions as values
+
+    Returns a dictionary with the industry order under 'industries' and one K x K array
+    per (measure, statistic) pair under 'stats', e.g. stats[('correlation', 'mean')].
+    """
+    industries = list(positions)
+    k = len(industries)
+    std = np.sqrt(np.diag(values))
+    stats = {
+        (measure, stat): np.full((k, k), np.nan)
+        for measure in SUMMARY_MEASURES
+        for stat in SUMMARY_STATS
+    }
+
+    for i, row_industry in enumerate(industries):
+        rows = positions[row_industry]
+        band = np.asarray(values[rows])
+        for j in range(i, k):
+            cols = positions[industries[j]]
+            cov = band[:, cols]
+            corr = cov / np.outer(std[rows], std[cols])
+            if i == j:
+                off_diagonal = ~np.eye(len(rows), dtype=bool)
+                cov, corr = cov[off_diagonal], corr[off_diagonal]
+            if cov.size == 0:
+                continue
+            for measure, block in (('covariance', cov), ('correlation', corr)):
+                reduced = {
+                    'mean': block.mean(),
+                    'median': np.median(block),
+                    'max': block.max(),
+                }
+                for stat, value in reduced.items():
+                    stats[measure, stat][i, j] = value
+                    stats[measure, stat][j, i] = value
+
+    return {'industries': industries, 'stats': stats}
+
+
+def _eigen_block(block, top_k):
+    # Runs in a worker process: full spectrum, but only the leading eigenvectors are returned
+    eigenvalues, eigenvectors = np.linalg.eigh(block)
+    order = np.argsort(eigenvalues)[::-1]
+    return {
+        'eigenvalues': eigenvalues[order],
+        'eigenvectors': eigenvectors[:, order[:top_k]].astype(np.float32),
+    }
+
+
+def industry_eigen(values, positions, version, previous=None, top_k=EIGEN_TOP_K, max_workers=None):
+    """
+    Eigendecomposes every within-industry block in a process pool.
+
+    Industries already decomposed for the same data version (in previous) are reused, so each
+    block is solved once per version. Eigenvalues are stored in descending order; eigenvectors
+    are truncated to the top_k leading ones and stored as float32.
+
+    Parameters:
+    - values: The full covariance matrix as a 2-D array
+    - positions: Dictionary with industries as keys and matrix positions as values
+    - version: Data version of values (see data_version)
+    - previous: Result of an earlier call, or None
+    - top_k: Number of eigenvectors kept per industry
+    - max_workers: Size of the process pool (defaults to the number of CPUs)
+    """
+    reusable = {}
+    if previous and previous['version'] == version and previous['top_k'] == top_k:
+        reusable = previous['industries']
+
+    result = {'version': version, 'top_k': top_k, 'industries': {}}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for industry, pos in positions.items():
+            if industry in reusable:
+                result['industries'][industry] = reusable[industry]
+            elif len(pos):
+                futures[industry] = pool.submit(_eigen_block, values[np.ix_(pos, pos)], top_k)
+        for industry, future in futures.items():
+            result['industries'][industry] = future.result()
+    return result
+
+
+def correlation_network(values, levels=NETWORK_LEVELS, block_rows=512):
+    """
+    Sparse graph of strongly co-moving tickers: an edge wherever |correlation| >= level.
+
+    The matrix is scanned one band of rows at a time and only the edges above the lowest level are
+    kept, so memory grows with the number of edges rather than with n^2. Edges are stored in both
+    directions, so the edges of any ticker are one row slice.
+
+    Parameters:
+    - values: The full covariance matrix as a 2-D array
+    - levels: Thresholds to build an edge list for
+    - block_rows: Rows per band
+
+    Returns a dictionary with the sorted levels under 'levels' and, per level, a CSR edge list under
+    ('indptr', i), ('indices', i) and ('corr', i) with i the level's position.
+    """
+    levels = sorted(levels)
+    n = values.shape[0]
+    std = np.sqrt(np.diag(values))
+    rows, cols, corrs = [], [], []
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        corr = np.asarray(values[start:stop]) / np.outer(std[start:stop], std)
+        corr[np.arange(stop - start), np.arange(start, stop)] = 0.0
+        band_rows, band_cols = np.nonzero(np.abs(corr) >= levels[0])
+        rows.append((band_rows + start).astype(np.int32))
+        cols.append(band_cols.astype(np.int32))
+        corrs.append(corr[band_rows, band_cols].astype(np.float32))
+    rows, cols, corrs = np.concatenate(rows), np.concatenate(cols), np.concatenate(corrs)
+
+    network = {'levels': np.array(levels)}
+    for i, level in enumerate(levels):
+        keep = np.abs(corrs) >= level
+        # Edges come out of the scan ordered by row, so the row counts give the CSR pointers directly
+        network['indptr', i] = np.concatenate([[0], np.cumsum(np.bincount(rows[keep], minlength=n))])
+        network['indices', i] = cols[keep]
+        network['corr', i] = corrs[keep]
+    return network
+
+
+def save_network(network, path, version):
+    # Every CSR array goes to its own .npy file in the snapshot folder, so the app can memory-map
+    # them and read only the rows it shows; the levels and the data version go to NETWORK_FILE
+    for i in range(len(network['levels'])):
+        for part in NETWORK_PARTS:
+            np.save(os.path.join(path, NETWORK_ARRAY_FILE.format(index=i, part=part)), network[part, i])
+    with open(os.path.join(path, NETWORK_FILE), "w") as f:
+        json.dump({'version': version, 'levels': network['levels'].tolist()}, f)
+
+
+def _neighbour_band(matrix_file, start, stop, k):
+    # Runs in a worker process: each worker maps the matrix itself, so no band is pickled over
+    values = np.load(matrix_file, mmap_mode='r')
+    std = np.sqrt(np.diagonal(values))
+    corr = np.array(values[start:stop]) / np.outer(std[start:stop], std)
+    corr[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+    top = np.argpartition(-corr, k - 1, axis=1)[:, :k]
+    top_corr = np.take_along_axis(corr, top, axis=1)
+    order = np.argsort(-top_corr, axis=1)
+    return (np.take_along_axis(top, order, axis=1).astype(np.int32),
+            np.take_along_axis(top_corr, order, axis=1).astype(np.float32))
+
+
+def nearest_neighbours(matrix_file, k=NEIGHBOURS_K, block_rows=1024, max_workers=None):
+    """
+    The k most correlated other tickers of every ticker, found band by band in a process pool.
+
+    Parameters:
+    - matrix_file: Path of a snapshot's covariance.npy
+    - k: Neighbours kept per ticker
+    - block_rows: Rows per band
+    - max_workers: Size of the process pool (defaults to the number of CPUs)
+
+    Returns n x k arrays of neighbour positions (int32) and correlations (float32), strongest first.
+    """
+    n = np.load(matrix_file, mmap_mode='r').shape[0]
+    k = min(k, n - 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_neighbour_band, matrix_file, start, min(start + block_rows, n), k)
+                   for start in range(0, n, block_rows)]
+        bands = [future.result() for future in futures]
+    return np.concatenate([b[0] for b in bands]), np.concatenate([b[1] for b in bands])
+
+
+def snapshot_names(snapshot_dir):
+    # Published snapshots; folders still being built (see staging_folder) start with a dot
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return [name for name in sorted(os.listdir(snapshot_dir))
+            if not name.startswith('.') and os.path.exists(os.path.join(snapshot_dir, name, MANIFEST_FILE))]
+
+
+def staging_folder(path):
+    """
+    Hidden folder next to a snapshot's final path to build it in. Neither the app nor the packing
+    steps look at it until publish_snapshot renames it into place, so a snapshot is never seen
+    before its artifacts and checksums are complete.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{os.path.basename(os.path.normpath(path))}.", dir=parent)
+    # mkdtemp makes the folder private to its owner; snapshots are read by the app's user too
+    os.chmod(staging, 0o755)
+    return staging
+
+
+def publish_snapshot(staging, path):
+    # Moves a finished staging folder into place, replacing an earlier build of the same name.
+    # Processes that have the old files open keep reading them until they reload
+    old = None
+    if os.path.exists(path):
+        old = staging_folder(path)
+        os.rmdir(old)
+        os.rename(path, old)
+    os.rename(staging, path)
+    if old is not None:
+        shutil.rmtree(old)
+
+
+def write_snapshot(tickers, values, industry_lists, path, **extra):
+    """
+    Writes one covariance matrix as a snapshot folder the app can memory-map.
+
+    Parameters:
+    - tickers: Row (and column) labels of the matrix
+    - values: The covariance matrix as a 2-D array
+    - industry_lists: Dictionary with industries as keys and ticker lists as values
+    - path: Snapshot folder, conventionally SNAPSHOT_DIR/<YYYY-MM-DD> (or its staging_folder)
+    - extra: Additional manifest fields, e.g. name when writing to a staging folder
+    """
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, COVARIANCE_NPY), c_order(values))
+    with open(os.path.join(path, TICKERS_PKL), "wb") as f:
+        pickle.dump(list(tickers), f)
+    with open(os.path.join(path, INDUSTRIES_PKL), "wb") as f:
+        pickle.dump(industry_lists, f)
+    return write_manifest(path, tickers, values, **extra)
+
+
+def write_manifest(path, tickers, values, **extra):
+    """
+    Writes a snapshot's manifest.json: its data version, size and colour limits, plus any extra fields
+    (name defaults to the folder's name).
+    """
+    vmin, vmax = color_limits(values)
+    manifest = {
+        'name': os.path.basename(os.path.normpath(path)),
+        'version': data_version(tickers, values),
+        'tickers': len(tickers),
+        'vmin': vmin,
+        'vmax': vmax,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        **extra,
+    }
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def derive_artifacts(path, with_eigen=True):
+    """
+    Computes the industry summary, the correlation network, the nearest-neighbour table and (unless
+    with_eigen is False) the eigendecompositions of a snapshot folder.
+
+    The matrix is checked first (see integrity.check_matrix), and every file of the folder is
+    checksummed last, into integrity.json.
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        version = json.load(f)['version']
+    values = np.load(os.path.join(path, COVARIANCE_NPY), mmap_mode='r')
+    with open(os.path.join(path, TICKERS_PKL), "rb") as f:
+        tickers = pickle.load(f)
+    with open(os.path.join(path, INDUSTRIES_PKL), "rb") as f:
+        industry_lists = pickle.load(f)
+    positions = industry_positions(tickers, industry_lists)
+    asymmetry = check_matrix(values, tickers, industry_lists)
+    print(f"Matrix of '{path}' checked: finite, positive variances, symmetric (largest gap {asymmetry:.2g}), "
+          f"tickers in order")
+
+    summary_file = os.path.join(path, SUMMARY_FILE)
+    summary = industry_summary(values, positions)
+    summary['version'] = version
+    with open(summary_file, "wb") as f:
+        pickle.dump(summary, f)
+    print(f"Industry summary for {len(positions)} industries has been pickled as '{summary_file}'")
+
+    network = correlation_network(values)
+    save_network(network, path, version)
+    edges = ', '.join(f"{level}: {len(network['indices', i]) // 2}" for i, level in enumerate(network['levels']))
+    print(f"Correlation network (edges per level {edges}) has been saved in '{path}'")
+
+    neighbours_file = os.path.join(path, NEIGHBOURS_FILE)
+    indices, corr = nearest_neighbours(os.path.join(path, COVARIANCE_NPY))
+    np.savez(neighbours_file, indices=indices, corr=corr, version=np.array(version))
+    print(f"{indices.shape[1]} nearest neighbours per ticker have been saved as '{neighbours_file}'")
+
+    if with_eigen:
+        eigen_file = os.path.join(path, EIGEN_FILE)
+        previous = None
+        if os.path.exists(eigen_file):
+            with open(eigen_file, "rb") as f:
+                previous = pickle.load(f)
+        eigen = industry_eigen(values, positions, version, previous)
+        with open(eigen_file, "wb") as f:
+            pickle.dump(eigen, f)
+        print(f"Eigendecompositions for {len(eigen['industries'])} industries have been pickled as '{eigen_file}'")
+
+    checked = write_integrity(path, version, max_asymmetry=asymmetry)
+    print(f"Checksums of {checked / 2**20:.1f} MB of snapshot files have been written to '{path}'")
+
+
+def encode_delta(values, base):
+    """
+    Bit-exact difference of a matrix to another of the same shape and dtype: the XOR of their bit
+    patterns. Close values share sign, exponent and leading mantissa bits, so it is mostly zero
+    bytes and compresses well, and decode_delta restores the matrix exactly.
+    """
+    bits = np.dtype(f'u{values.dtype.itemsize}')
+    return np.bitwise_xor(np.asarray(values).view(bits), np.asarray(base).view(bits))
+
+
+def decode_delta(delta, base):
+    # Rows of a packed matrix from the same rows of its base. Snapshots packed before deltas were
+    # exact stored values - base as floats, which only restores them up to rounding
+    base = np.ascontiguousarray(base)
+    if delta.dtype.kind == 'u':
+        return np.bitwise_xor(delta, base.view(delta.dtype)).view(base.dtype)
+    return base + delta
+
+
+def _load_manifest(path):
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def _load_tickers(path):
+    with open(os.path.join(path, TICKERS_PKL), "rb") as f:
+        return pickle.load(f)
+
+
+def pack_deltas(snapshot_dir):
+    """
+    Stores every snapshot except the newest dense one as a compressed, bit-exact difference to that
+    snapshot (see encode_delta), so rebuilding any of them reads one dense snapshot and never a chain.
+
+    Snapshots packed against another base are first unpacked and packed again against the newest.
+    Snapshots whose tickers or dtype differ from it, or whose matrix fails its checksums, are left as
+    they are. The checksums of each packed matrix are kept in integrity.json, and the app verifies the
+    covariance.npy it rebuilds on first view against them. The manifest and integrity.json are
+    replaced atomically, and the dense matrix is only removed once both are written; a run stopped
+    in between leaves the snapshot dense, and the next run packs it again.
+    """
+    names = snapshot_names(snapshot_dir)
+    dense = [name for name in names if os.path.exists(os.path.join(snapshot_dir, name, COVARIANCE_NPY))
+             and 'delta_base' not in _load_manifest(os.path.join(snapshot_dir, name))]
+    if not dense:
+        return
+    target = dense[-1]
+    target_path = os.path.join(snapshot_dir, target)
+    target_version = _load_manifest(target_path)['version']
+    target_tickers = _load_tickers(target_path)
+    target_values = np.load(os.path.join(target_path, COVARIANCE_NPY), mmap_mode='r')
+    older = names[:names.index(target)]
+    # Snapshots packed against another base are unpacked first, newest first: a base is always newer
+    # than the snapshots packed against it, so it is dense again by the time they need it
+    for name in reversed(older):
+        path = os.path.join(snapshot_dir, name)
+        manifest = _load_manifest(path)
+        if manifest.get('delta_base') not in (None, target) and _load_tickers(path) == target_tickers:
+            try:
+                _unpack_delta(path, manifest, snapshot_dir)
+            except (OSError, IntegrityError) as e:
+                print(f"Could not unpack '{name}': {e}")
+
+    for name in older:
+        path = os.path.join(snapshot_dir, name)
+        manifest = _load_manifest(path)
+        matrix_file = os.path.join(path, COVARIANCE_NPY)
+        try:
+            checksums = Checksums(path, manifest['version'])
+        except IntegrityError as e:
+            print(f"Skipping '{name}': {e}")
+            continue
+        # Packed already (and possibly rebuilt by a view since), unless packing stopped before its
+        # checksums were written, in which case it is simply packed again
+        if manifest.get('delta_base') == target and (COVARIANCE_NPY in checksums.rebuilt
+                                                     or not os.path.exists(matrix_file)):
+            continue
+        if _load_tickers(path) != target_tickers:
+            print(f"Skipping '{name}': tickers differ from '{target}'")
+            continue
+        if not os.path.exists(matrix_file):
+            print(f"Skipping '{name}': it is not stored densely")
+            continue
+        try:
+            checksums.include(COVARIANCE_NPY)
+            checksums.verify_file(COVARIANCE_NPY)
+        except IntegrityError as e:
+            print(f"Skipping '{name}': {e}")
+            continue
+        values = np.load(matrix_file, mmap_mode='r')
+        if values.dtype != target_values.dtype or values.shape != target_values.shape:
+            print(f"Skipping '{name}': matrix type differs from '{target}'")
+            continue
+
+        fd, partial_file = tempfile.mkstemp(prefix=DELTA_FILE + '.', suffix='.partial', dir=path)
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, delta=encode_delta(values, target_values))
+        os.chmod(partial_file, 0o644)
+        os.replace(partial_file, os.path.join(path, DELTA_FILE))
+        manifest['delta_base'] = target
+        manifest['delta_base_version'] = target_version
+        write_json(os.path.join(path, MANIFEST_FILE), manifest, indent=2)
+        write_integrity(path, manifest['version'], rebuilt=[COVARIANCE_NPY])
+        del values
+        os.remove(matrix_file)
+        print(f"Snapshot '{name}' has been packed as a delta against '{target}'")
+
+
+def _unpack_delta(path, manifest, snapshot_dir):
+    # Writes the dense covariance.npy of a snapshot packed against an older base back, checked
+    # against its checksums from before packing (if any), unless a view already rebuilt it
+    matrix_file = os.path.join(path, COVARIANCE_NPY)
+    if os.path.exists(matrix_file):
+        return
+    base_path = os.path.join(snapshot_dir, manifest['delta_base'])
+    if _load_manifest(base_path)['version'] != manifest['delta_base_version']:
+        raise IntegrityError(f"packed against a different version of '{manifest['delta_base']}'")
+    checksums = Checksums(path, manifest['version'])
+    checksums.verify_file(DELTA_FILE)
+    with np.load(os.path.join(path, DELTA_FILE)) as packed:
+        delta = packed['delta']
+    values = decode_delta(delta, np.load(os.path.join(base_path, COVARIANCE_NPY), mmap_mode='r'))
+    del delta
+    fd, partial_file = tempfile.mkstemp(prefix=COVARIANCE_NPY + '.', suffix='.partial', dir=path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, values)
+        checksums.check_rebuilt(COVARIANCE_NPY, partial_file)
+        os.chmod(partial_file, 0o644)
+        os.replace(partial_file, matrix_file)
+    except BaseException:
+        os.remove(partial_file)
+        raise
+
+
+def pack_factors(path, rank=FACTOR_RANK, tolerance=None):
+    """
+    Stores a snapshot as its dense within-industry blocks plus a rank-k factor model of everything
+    else (covariance ~ B B' + D), replacing covariance.npy. The app reconstructs any block on demand.
+
+    Run it after derive_artifacts, which needs the dense matrix. The fit's error on the cross-industry
+    cells is printed and recorded in the manifest. With a tolerance, a snapshot whose relative
+    Frobenius error exceeds it is left dense, as is a snapshot that others are delta-packed against.
+
+    Returns the error measures, or None if the snapshot was left dense.
+    """
+    # Snapshots packed as deltas against this one are rebuilt from its exact values
+    manifest_file = os.path.join(path, MANIFEST_FILE)
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    name = manifest['name']
+    parent = os.path.dirname(os.path.abspath(path))
+    for other in snapshot_names(parent):
+        if other != name:
+            with open(os.path.join(parent, other, MANIFEST_FILE)) as f:
+                if json.load(f).get('delta_base') == name:
+                    print(f"Keeping '{path}' dense: snapshot '{other}' is packed as a delta against it")
+                    return None
+
+    matrix_file = os.path.join(path, COVARIANCE_NPY)
+    values = np.load(matrix_file, mmap_mode='r')
+    with open(os.path.join(path, TICKERS_PKL), "rb") as f:
+        tickers = pickle.load(f)
+    with open(os.path.join(path, INDUSTRIES_PKL), "rb") as f:
+        industry_lists = pickle.load(f)
+    positions = industry_positions(tickers, industry_lists)
+
+    loadings, residual = fit_factor_model(values, positions, rank)
+    error = factor_error(values, loadings, industry_groups(len(tickers), positions)[0])
+    print(f"Rank-{loadings.shape[1]} factor model of '{path}': relative error {error['relative_frobenius']:.2%} "
+          f"on cross-industry cells, at most {error['max_abs']:.3g} ({error['max_abs_correlation']:.3g} "
+          f"in correlation)")
+    if tolerance is not None and error['relative_frobenius'] > tolerance:
+        print(f"Keeping '{path}' dense: error above the tolerance of {tolerance:.2%}")
+        return None
+
+    stored = save_factor_model(path, values, positions, loadings, residual)
+    manifest['storage'] = 'factor'
+    manifest['factor_rank'] = int(loadings.shape[1])
+    manifest['factor_error'] = error
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=2)
+    dense = os.path.getsize(matrix_file)
+    del values
+    os.remove(matrix_file)
+    write_integrity(path, manifest['version'])
+    print(f"Snapshot '{path}' stored as factors: {stored / 2**20:.1f} MB instead of {dense / 2**20:.1f} MB "
+          f"({stored / dense:.1%})")
+    return error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a dated covariance snapshot from the sorted pickles.")
+    parser.add_argument('--date', default=datetime.date.today().isoformat(),
+                        help="Snapshot name, YYYY-MM-DD (default: today)")
+    parser.add_argument('--covariance', default=COVARIANCE_FILE, help="Pickled covariance DataFrame")
+    parser.add_argument('--industries', default=INDUSTRIES_FILE, help="Pickled industry dictionary")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--pack-deltas', action='store_true',
+                        help="Store older snapshots as compressed deltas to save disk")
+    parser.add_argument('--storage', choices=['dense', 'factor'], default='dense',
+                        help="'factor' keeps within-industry blocks dense and fits a factor model to the rest")
+    parser.add_argument('--factor-rank', type=int, default=FACTOR_RANK, help="Factors of the factor storage")
+    parser.add_argument('--factor-tolerance', type=float, default=None,
+                        help="Keep the snapshot dense if the relative cross-industry error is above this")
+    args = parser.parse_args()
+
+    with open(args.industries, "rb") as f:
+        industry_lists = pickle.load(f)
+    sigma_sorted = pd.read_pickle(args.covariance)
+    path = os.path.join(args.snapshot_dir, args.date)
+    # Built aside and renamed into place once complete, so a running app never picks it up half-written
+    staging = staging_folder(path)
+    write_snapshot(sigma_sorted.index, sigma_sorted.values, industry_lists, staging, name=args.date)
+    del sigma_sorted
+
+    derive_artifacts(staging)
+    if args.storage == 'factor':
+        pack_factors(staging, args.factor_rank, args.factor_tolerance)
+    publish_snapshot(staging, path)
+    print(f"Snapshot has been written to '{path}'")
+    if args.pack_deltas:
+        pack_deltas(args.snapshot_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+import os
+import json
+import fcntl
+import pickle
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from build_artifacts import (
+    COVARIANCE_NPY, DELTA_FILE, EIGEN_FILE, INDUSTRIES_PKL, MANIFEST_FILE, NEIGHBOURS_FILE, NETWORK_ARRAY_FILE,
+    NETWORK_FILE, NETWORK_PARTS, SNAPSHOT_DIR, SUMMARY_FILE, TICKERS_PKL, decode_delta, industry_positions,
+    industry_summary, snapshot_names
+)
+from factor_model import FACTOR_BLOCKS, FACTOR_INDEX, FACTOR_LOADINGS, FactorMatrix
+from integrity import Checksums
+
+
+def as_index(pos):
+    # Contiguous positions become a slice, so a memory-mapped read touches one run of pages
+    if len(pos) and pos[-1] - pos[0] + 1 == len(pos) and np.all(np.diff(pos) == 1):
+        return slice(int(pos[0]), int(pos[-1]) + 1)
+    return pos
+
+
+def open_matrix(path):
+    """
+    The covariance matrix of a snapshot folder: covariance.npy memory-mapped, or for snapshots
+    stored as a factor model (build_artifacts --storage factor) a FactorMatrix indexed the same way.
+    """
+    matrix_file = os.path.join(path, COVARIANCE_NPY)
+    if os.path.exists(matrix_file):
+        return np.load(matrix_file, mmap_mode='r')
+    return FactorMatrix(path)
+
+
+class Snapshot:
+    """
+    One dated covariance matrix on disk. Nothing but the manifest is read until the snapshot is
+    first used; the matrix itself is memory-mapped, so only the pages of viewed blocks are loaded.
+    Factor-stored snapshots reconstruct the blocks they are asked for (see open_matrix).
+
+    Files are checked against the build's checksums as they are used: the small ones when the
+    snapshot is opened, the matrix a block's chunks at a time on first access (see
+    integrity.Checksums), or all at once with verify_all.
+
+    Parameters:
+    - path: Snapshot folder written by build_artifacts.write_snapshot
+    - store: The SnapshotStore it belongs to (needed to rebuild delta-packed snapshots)
+    """
+
+    def __init__(self, path, store=None):
+        self.path = path
+        self.name = os.path.basename(path.rstrip(os.sep))
+        self.store = store
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest['version']
+        self.vmin = self.manifest['vmin']
+        self.vmax = self.manifest['vmax']
+        self._lock = threading.RLock()
+        self._opened = False
+        self._summary = None
+        self._eigen = None
+        self._network = {}
+        self._neighbours = None
+        self._std = None
+        self._ticker_industries = None
+        self._checksums = None
+        # Requests currently using the snapshot; a retired snapshot is released when this reaches 0
+        self.users = 0
+        self.retired = False
+
+    def open(self):
+        with self._lock:
+            if self._opened:
+                return self
+            checksums = self.checksums()
+            for name in (MANIFEST_FILE, TICKERS_PKL, INDUSTRIES_PKL, FACTOR_LOADINGS, FACTOR_INDEX):
+                checksums.verify_file(name)
+            matrix_file = os.path.join(self.path, COVARIANCE_NPY)
+            if not os.path.exists(matrix_file) and os.path.exists(os.path.join(self.path, DELTA_FILE)):
+                self._materialize(matrix_file)
+            # A rebuilt matrix is checked like any other file from here on
+            checksums.include(COVARIANCE_NPY)
+            self.values = open_matrix(self.path)
+            self._attach(checksums)
+            with open(os.path.join(self.path, TICKERS_PKL), "rb") as f:
+                self.tickers = pd.Index(pickle.load(f))
+            with open(os.path.join(self.path, INDUSTRIES_PKL), "rb") as f:
+                self.industry_lists = pickle.load(f)
+            self.positions = industry_positions(self.tickers, self.industry_lists)
+            self._opened = True
+        return self
+
+    def ticker_industries(self):
+        # Industry of every ticker ('Other' for unclassified tickers), built once per snapshot
+        with self._lock:
+            if self._ticker_industries is None:
+                industries = pd.Series('Other', index=self.tickers)
+                for industry, pos in self.positions.items():
+                    industries.iloc[pos] = industry
+                self._ticker_industries = industries
+            return self._ticker_industries
+
+    def checksums(self):
+        # The build's checksums, read on first use (without opening the snapshot). Without an
+        # integrity.json nothing is kept, so checksums written later are still picked up
+        with self._lock:
+            if self._checksums is not None:
+                return self._checksums
+            checksums = Checksums(self.path, self.version)
+            if checksums.found:
+                self._checksums = checksums
+                if 'values' in self.__dict__:
+                    self._attach(checksums)
+            return checksums
+
+    def _attach(self, checksums):
+        # Matrix chunks are verified from the memory map the requests read
+        if isinstance(self.values, np.memmap):
+            checksums.attach(COVARIANCE_NPY, self.values)
+        elif isinstance(self.values, FactorMatrix) and isinstance(self.values.blocks, np.memmap):
+            checksums.attach(FACTOR_BLOCKS, self.values.blocks)
+
+    def verify(self, rows=slice(None), cols=slice(None)):
+        """Verifies the chunks of the matrix files holding a block (a slice or positions each)."""
+        self.open()
+        if isinstance(self.values, np.memmap):
+            self.checksums().verify_block(COVARIANCE_NPY, self.values, rows, cols)
+        elif isinstance(self.values, FactorMatrix):
+            # Only within-industry blocks are read from disk, each a contiguous run of the block file
+            groups = np.intersect1d(self.values.groups[rows], self.values.groups[cols])
+            groups = groups[groups >= 0]
+            blocks = self.values.blocks
+            self.checksums().verify_spans(FACTOR_BLOCKS, blocks.offset + self.values.offsets[groups] * blocks.itemsize,
+                                          blocks.offset + self.values.offsets[groups + 1] * blocks.itemsize)
+
+    def verify_all(self):
+        """Verifies every file of the snapshot not verified yet; returns the number of bytes read."""
+        return self.checksums().verify_all()
+
+    def validate(self):
+        """Cheap consistency checks run before a reloaded snapshot replaces the served one."""
+        self.open()
+        n = len(self.tickers)
+        if self.values.shape != (n, n) or self.manifest['tickers'] != n:
+            raise ValueError(f"Snapshot '{self.name}': matrix shape {self.values.shape} does not match {n} tickers")
+        if not self.tickers.is_unique:
+            raise ValueError(f"Snapshot '{self.name}': duplicate tickers")
+        diagonal = self.values.diagonal()
+        if not (np.isfinite(diagonal).all() and (diagonal > 0).all()):
+            raise ValueError(f"Snapshot '{self.name}': variances must be finite and positive")
+        return self
+
+    def release_memory(self):
+        # Drop the memory map and everything derived from it; the OS unmaps once nothing refers to it
+        with self._lock:
+            for attr in ('values', 'tickers', 'industry_lists', 'positions'):
+                self.__dict__.pop(attr, None)
+            self._summary = None
+            self._eigen = None
+            self._network = {}
+            self._neighbours = None
+            self._std = None
+            self._ticker_industries = None
+            # The checksums hold a reference to the memory map too
+            self._checksums = None
+            self._opened = False
+
+    def _materialize(self, matrix_file):
+        # Snapshot stored as a compressed delta against a newer one: rebuild the dense file once.
+        # Server and job processes may open it at the same time: one rebuilds under the lock file,
+        # the others wait and then find the finished file
+        with open(matrix_file + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not os.path.exists(matrix_file):
+                    self._rebuild(matrix_file)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _rebuild(self, matrix_file):
+        # The rebuilt file must have exactly the bytes covariance.npy had when it was packed; it is
+        # checked against those checksums before it is renamed into place
+        checksums = self.checksums()
+        checksums.verify_file(DELTA_FILE)
+        with np.load(os.path.join(self.path, DELTA_FILE)) as packed:
+            delta = packed['delta']
+        base = self.store.get(self.manifest['delta_base'])
+        if base.version != self.manifest['delta_base_version']:
+            raise ValueError(f"Snapshot '{self.name}' was packed against a different version of '{base.name}'")
+        base.verify()
+        fd, partial_file = tempfile.mkstemp(prefix=COVARIANCE_NPY + '.', suffix='.partial', dir=self.path)
+        os.close(fd)
+        try:
+            out = np.lib.format.open_memmap(partial_file, mode='w+', dtype=base.values.dtype, shape=delta.shape)
+            step = 1024
+            for start in range(0, len(delta), step):
+                out[start:start + step] = decode_delta(delta[start:start + step], base.values[start:start + step])
+            out.flush()
+            del out
+            verified = checksums.check_rebuilt(COVARIANCE_NPY, partial_file)
+            os.replace(partial_file, matrix_file)
+        except BaseException:
+            os.remove(partial_file)
+            raise
+        checksums.include(COVARIANCE_NPY, verified)
+
+    def block(self, rows, cols):
+        """Covariance block for the given row and column positions, as an in-memory array."""
+        self.open()
+        rows, cols = as_index(rows), as_index(cols)
+        self.verify(rows, cols)
+        if isinstance(rows, slice) or isinstance(cols, slice):
+            return np.array(self.values[rows, cols])
+        return self.values[np.ix_(rows, cols)]
+
+    def submatrix(self, tickers):
+        """
+        Covariance of the given tickers (those the snapshot knows, each once) as a DataFrame. Only
+        their block is read, so unknown tickers are simply missing from its index.
+        """
+        self.open()
+        pos = self.tickers.get_indexer(pd.unique(pd.Index(tickers)))
+        pos = np.sort(pos[pos >= 0])
+        return pd.DataFrame(self.block(pos, pos), index=self.tickers[pos], columns=self.tickers[pos])
+
+    def summary(self):
+        # Industry-pair summary from the build, computed here if the build did not write one
+        with self._lock:
+            if self._summary is None:
+                self.open()
+                summary_file = os.path.join(self.path, SUMMARY_FILE)
+                if os.path.exists(summary_file):
+                    self.checksums().verify_file(SUMMARY_FILE)
+                    with open(summary_file, "rb") as f:
+                        self._summary = pickle.load(f)
+                if self._summary is None or self._summary['version'] != self.version:
+                    self.verify()
+                    self._summary = industry_summary(self.values, self.positions)
+                    self._summary['version'] = self.version
+            return self._summary
+
+    def eigen(self):
+        # Per-industry eigendecompositions from the build, or None; never solved here
+        with self._lock:
+            if self._eigen is None:
+                eigen_file = os.path.join(self.path, EIGEN_FILE)
+                if os.path.exists(eigen_file):
+                    self.checksums().verify_file(EIGEN_FILE)
+                    with open(eigen_file, "rb") as f:
+                        eigen = pickle.load(f)
+                    if eigen['version'] == self.version:
+                        self._eigen = eigen
+            return self._eigen
+
+    def network_levels(self):
+        # Thresholds with a precomputed edge list, or [] if the build did not write the network
+        network_file = os.path.join(self.path, NETWORK_FILE)
+        if not os.path.exists(network_file):
+            return []
+        self.checksums().verify_file(NETWORK_FILE)
+        with open(network_file) as f:
+            network = json.load(f)
+        return network['levels'] if network['version'] == self.version else []
+
+    def network(self, level):
+        """
+        CSR edge list (indptr, indices, corr) of the co-movement network at one precomputed level,
+        as memory maps of the build's files: nothing is read until the arrays are indexed.
+        """
+        with self._lock:
+            if level not in self._network:
+                i = self.network_levels().index(level)
+                self._network[level] = tuple(
+                    np.load(os.path.join(self.path, NETWORK_ARRAY_FILE.format(index=i, part=part)), mmap_mode='r')
+                    for part in NETWORK_PARTS
+                )
+            return self._network[level]
+
+    def network_rows(self, level, rows):
+        """
+        Edges of the given rows (positions) of the network at one level, as source positions,
+        target positions and correlations. Only the pointers and edges of those rows are read from
+        the memory maps, and only the chunks holding them are verified.
+        """
+        arrays = self.network(level)
+        indptr, indices, corr = arrays
+        i = self.network_levels().index(level)
+        checksums = self.checksums()
+        rows = np.asarray(rows, dtype=np.int64)
+        pointers = indptr.offset + rows * indptr.itemsize
+        checksums.verify_spans(NETWORK_ARRAY_FILE.format(index=i, part='indptr'),
+                               pointers, pointers + 2 * indptr.itemsize)
+        starts, stops = np.asarray(indptr[rows], dtype=np.int64), np.asarray(indptr[rows + 1], dtype=np.int64)
+        for part, array in zip(NETWORK_PARTS[1:], arrays[1:]):
+            checksums.verify_spans(NETWORK_ARRAY_FILE.format(index=i, part=part),
+                                   array.offset + starts * array.itemsize, array.offset + stops * array.itemsize)
+        counts = stops - starts
+        # Positions of every edge of the rows in the CSR arrays, without a Python loop over rows
+        edges = np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(rows, counts), np.asarray(indices[edges]), np.asarray(corr[edges])
+
+    def neighbours(self):
+        # (indices, corr) nearest-neighbour table from the build, or None
+        with self._lock:
+            if self._neighbours is None:
+                neighbours_file = os.path.join(self.path, NEIGHBOURS_FILE)
+                if os.path.exists(neighbours_file):
+                    self.checksums().verify_file(NEIGHBOURS_FILE)
+                    with np.load(neighbours_file) as table:
+                        if str(table['version']) == self.version:
+                            self._neighbours = (table['indices'], table['corr'])
+            return self._neighbours
+
+    def similar_tickers(self, ticker, k=10, live=False):
+        """
+        The k tickers most correlated with ticker, as a Series of correlations (strongest first).
+
+        Answered from the build's nearest-neighbour table when it holds at least k neighbours;
+        otherwise (or with live=True) from the ticker's row of the memory-mapped matrix.
+
+        Returns the Series and 'index' or 'live'. Raises ValueError for an unknown ticker.
+        """
+        self.open()
+        if ticker not in self.tickers:
+            raise ValueError(f"Unknown ticker: {ticker}")
+        i = self.tickers.get_loc(ticker)
+        k = max(1, min(int(k), len(self.tickers) - 1))
+        table = None if live else self.neighbours()
+        if table is not None and table[0].shape[1] >= k:
+            pos, corr = table[0][i, :k], table[1][i, :k]
+            source = 'index'
+        else:
+            with self._lock:
+                if self._std is None:
+                    self._std = np.sqrt(self.values.diagonal())
+            self.verify(np.array([i]))
+            corr = np.array(self.values[i]) / (self._std[i] * self._std)
+            corr[i] = -np.inf
+            pos = np.argpartition(-corr, k - 1)[:k]
+            pos = pos[np.argsort(-corr[pos])]
+            corr = corr[pos]
+            source = 'live'
+        return pd.Series(corr.astype(float), index=self.tickers[pos], name='correlation'), source
+
+
+class SnapshotStore:
+    """
+    All snapshots under one directory, ordered by name (ISO dates sort chronologically).
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        self.snapshots = {}
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.scan()
+
+    def _listing(self):
+        return [(name, os.path.join(self.root, name)) for name in snapshot_names(self.root)]
+
+    def scan(self):
+        snapshots = {}
+        for name, path in self._listing():
+            existing = self.snapshots.get(name)
+            snapshots[name] = existing if existing is not None else Snapshot(path, self)
+        self.snapshots = snapshots
+        return self
+
+    def reload(self):
+        """
+        Picks up new and rebuilt snapshots without interrupting requests.
+
+        Snapshots whose manifest version or storage changed (or that are new) are opened and
+        validated first; the served set is then replaced in one assignment. Snapshots that were replaced or removed
+        are retired: requests already using them finish on them, and their memory maps are released
+        when the last of those requests ends. Snapshots that fail validation are skipped, keeping the
+        currently served version if there is one.
+
+        Returns the names whose data changed and the retired Snapshot objects.
+        """
+        with self._reload_lock:
+            current = self.snapshots
+            fresh, changed = {}, []
+            for name, path in self._listing():
+                old = current.get(name)
+                try:
+                    candidate = Snapshot(path, self)
+                    # Packing a snapshot as factors keeps its version but changes how it is read
+                    if (old is not None and old.version == candidate.version
+                            and old.manifest.get('storage') == candidate.manifest.get('storage')):
+                        fresh[name] = old
+                        continue
+                    candidate.validate()
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Not loading snapshot '{name}': {e}")
+                    if old is not None:
+                        fresh[name] = old
+                    continue
+                fresh[name] = candidate
+                changed.append(name)
+
+            with self._lock:
+                retired = [old for name, old in current.items() if fresh.get(name) is not old]
+                self.snapshots = fresh
+                for old in retired:
+                    old.retired = True
+                    if old.users == 0:
+                        old.release_memory()
+            return changed, retired
+
+    def acquire(self, name=None):
+        """Opens a snapshot for a request; pair with release() when the request is done."""
+        with self._lock:
+            snap = self.snapshots[name or self.latest()]
+            snap.users += 1
+        try:
+            return snap.open()
+        except Exception:
+            self.release(snap)
+            raise
+
+    def release(self, snap):
+        with self._lock:
+            snap.users -= 1
+            if snap.users == 0 and snap.retired:
+                snap.release_memory()
+
+    def names(self):
+        return list(self.snapshots)
+
+    def latest(self):
+        return self.names()[-1] if self.snapshots else None
+
+    def get(self, name=None):
+        return self.snapshots[name or self.latest()].open()
+
+    def previous_name(self, name):
+        """Name of the snapshot dated just before name, or None for the oldest one."""
+        names = self.names()
+        i = names.index(name) if name in names else 0
+        return names[i - 1] if i > 0 else None
+
+
+def delta_block(current, previous, rows, cols):
+    """
+    Change of a block between two snapshots, matched by ticker. Tickers missing from the previous
+    snapshot come out as NaN.
+
+    Parameters:
+    - current, previous: Snapshot objects
+    - rows, cols: Row and column positions in the current snapshot
+    """
+    block = current.block(rows, cols)
+    prev_rows = previous.tickers.get_indexer(current.tickers[rows])
+    prev_cols = previous.tickers.get_indexer(current.tickers[cols])
+    prev_block = np.full(block.shape, np.nan)
+    found_rows, found_cols = prev_rows >= 0, prev_cols >= 0
+    prev_block[np.ix_(found_rows, found_cols)] = previous.block(prev_rows[found_rows], prev_cols[found_cols])
+    return block - prev_block
@@ -0,0 +1,214 @@
+import os
+import numpy as np
+
+# Replace covariance.npy in snapshots stored as dense industry blocks plus a factor model
+FACTOR_LOADINGS = "factor_loadings.npy"
+FACTOR_BLOCKS = "factor_blocks.npy"
+FACTOR_INDEX = "factor_index.npz"
+
+# Default number of factors fitted to the cross-industry structure
+FACTOR_RANK = 64
+
+
+def industry_groups(n, positions):
+    """
+    Assigns every matrix position to at most one industry.
+
+    Returns the industry number of each position (-1 for tickers in no industry), each position's
+    index within its industry, and the positions of every industry. A ticker listed under several
+    industries belongs to the first.
+    """
+    groups = np.full(n, -1, dtype=np.int32)
+    local = np.zeros(n, dtype=np.int32)
+    members = []
+    for pos in positions.values():
+        pos = np.asarray(pos)
+        pos = pos[groups[pos] < 0]
+        if not len(pos):
+            continue
+        groups[pos] = len(members)
+        local[pos] = np.arange(len(pos))
+        members.append(pos)
+    return groups, local, members
+
+
+def _apply(values, members, blocks, loadings, x, block_rows):
+    # values @ x, read a band of rows at a time. With loadings, the cells the factor model does not
+    # have to explain (within-industry blocks, the diagonal) are taken from the model instead
+    y = np.empty((values.shape[0], x.shape[1]))
+    for start in range(0, len(y), block_rows):
+        y[start:start + block_rows] = np.asarray(values[start:start + block_rows], dtype=float) @ x
+    if loadings is None:
+        return y
+    lone = np.ones(len(y), dtype=bool)
+    for pos, block in zip(members, blocks):
+        y[pos] += loadings[pos] @ (loadings[pos].T @ x[pos]) - block @ x[pos]
+        lone[pos] = False
+    diagonal = np.asarray(values.diagonal(), dtype=float)[lone]
+    y[lone] += (np.einsum('ij,ij->i', loadings[lone], loadings[lone]) - diagonal)[:, None] * x[lone]
+    return y
+
+
+def fit_factor_model(values, positions, rank=FACTOR_RANK, refits=2, oversample=10, power_iterations=2,
+                     block_rows=1024, seed=0):
+    """
+    Fits loadings B (n x rank) so that B B' approximates the covariance between different industries.
+
+    The leading eigenvectors are found by randomized subspace iteration, which only needs products of
+    the matrix with n x (rank + oversample) blocks, each one pass over the (memory-mapped) matrix.
+    The first fit is to the whole matrix; every refit replaces the within-industry blocks and the
+    diagonal, which are stored exactly anyway, by the current model, so the factors are spent on the
+    cross-industry structure.
+
+    Parameters:
+    - values: The full covariance matrix as a 2-D array
+    - positions: Dictionary with industries as keys and matrix positions as values
+    - rank: Number of factors
+    - refits: Fits after the first one
+    - oversample, power_iterations: Accuracy settings of the randomized eigensolver
+    - block_rows: Rows per band read from values
+    - seed: Seed of the random starting block
+
+    Returns the loadings and the residual variances D (diag(values) - diag(B B')).
+    """
+    n = values.shape[0]
+    rank = min(rank, n)
+    _, _, members = industry_groups(n, positions)
+    blocks = [np.asarray(values[np.ix_(pos, pos)], dtype=float) for pos in members]
+    rng = np.random.default_rng(seed)
+    loadings = None
+    for _ in range(refits + 1):
+        basis = np.linalg.qr(_apply(values, members, blocks, loadings,
+                                    rng.standard_normal((n, min(n, rank + oversample))), block_rows))[0]
+        for _ in range(power_iterations):
+            basis = np.linalg.qr(_apply(values, members, blocks, loadings, basis, block_rows))[0]
+        projected = basis.T @ _apply(values, members, blocks, loadings, basis, block_rows)
+        eigenvalues, vectors = np.linalg.eigh((projected + projected.T) / 2)
+        order = np.argsort(eigenvalues)[::-1][:rank]
+        order = order[eigenvalues[order] > 0]
+        loadings = (basis @ vectors[:, order]) * np.sqrt(eigenvalues[order])
+    # Loadings are stored as float32; the residuals are taken against those, so diagonals stay exact
+    loadings = loadings.astype(np.float32).astype(float)
+    residual = np.asarray(values.diagonal(), dtype=float) - np.einsum('ij,ij->i', loadings, loadings)
+    return loadings, residual
+
+
+def factor_error(values, loadings, groups, block_rows=1024):
+    """
+    Error of B B' on the cells the factor model stands for: every cell between two different
+    industries (or involving a ticker in none), except the diagonal.
+
+    Returns the relative Frobenius error, the largest absolute error, and the largest error in
+    correlation units (absolute error over the product of the two standard deviations).
+    """
+    n = values.shape[0]
+    std = np.sqrt(np.asarray(values.diagonal(), dtype=float))
+    error_sq, total_sq, max_abs, max_corr = 0.0, 0.0, 0.0, 0.0
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        band = np.array(values[start:stop], dtype=float)
+        error = band - loadings[start:stop] @ loadings.T
+        modelled = (groups[start:stop, None] != groups[None, :]) | (groups[start:stop, None] < 0)
+        modelled[np.arange(stop - start), np.arange(start, stop)] = False
+        error[~modelled] = 0.0
+        band[~modelled] = 0.0
+        error_sq += np.square(error).sum()
+        total_sq += np.square(band).sum()
+        max_abs = max(max_abs, float(np.abs(error).max()))
+        max_corr = max(max_corr, float((np.abs(error) / np.outer(std[start:stop], std)).max()))
+    return {
+        'relative_frobenius': float(np.sqrt(error_sq / total_sq)) if total_sq else 0.0,
+        'max_abs': max_abs,
+        'max_abs_correlation': max_corr,
+    }
+
+
+def save_factor_model(path, values, positions, loadings, residual):
+    """
+    Writes the factor files of a snapshot folder: the loadings (float32), the residual variances and
+    every within-industry block, dense and exact, one after the other in a flat array.
+
+    Returns the number of bytes written.
+    """
+    groups, local, members = industry_groups(values.shape[0], positions)
+    sizes = np.array([len(pos) for pos in members], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes ** 2)])
+    blocks_file = os.path.join(path, FACTOR_BLOCKS)
+    blocks = np.lib.format.open_memmap(blocks_file, mode='w+', dtype=values.dtype, shape=(int(offsets[-1]),))
+    for g, pos in enumerate(members):
+        blocks[offsets[g]:offsets[g + 1]] = np.asarray(values[np.ix_(pos, pos)]).ravel()
+    blocks.flush()
+    del blocks
+    np.save(os.path.join(path, FACTOR_LOADINGS), loadings.astype(np.float32))
+    np.savez(os.path.join(path, FACTOR_INDEX), groups=groups, local=local, sizes=sizes, offsets=offsets,
+             residual=residual)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in (FACTOR_BLOCKS, FACTOR_LOADINGS, FACTOR_INDEX))
+
+
+class FactorMatrix:
+    """
+    Read-only covariance matrix of a factor-stored snapshot, indexed like the memory-mapped array it
+    replaces (rows, row slices, [rows, cols] and np.ix_ blocks).
+
+    Within-industry blocks are read exactly from the memory-mapped block file; every other cell is
+    reconstructed on demand from the loadings, B_rows B_cols', plus the residual variance on the
+    diagonal of tickers outside every industry.
+
+    Parameters:
+    - path: Snapshot folder holding the files written by save_factor_model
+    """
+
+    def __init__(self, path):
+        self.loadings = np.load(os.path.join(path, FACTOR_LOADINGS))
+        self.blocks = np.load(os.path.join(path, FACTOR_BLOCKS), mmap_mode='r')
+        with np.load(os.path.join(path, FACTOR_INDEX)) as index:
+            self.groups = index['groups']
+            self.local = index['local']
+            self.sizes = index['sizes']
+            self.offsets = index['offsets']
+            self.residual = index['residual']
+        n = len(self.groups)
+        self.shape = (n, n)
+        self.ndim = 2
+        self.dtype = self.blocks.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _positions(self, key):
+        if isinstance(key, slice):
+            return np.arange(*key.indices(self.shape[0]))
+        return np.atleast_1d(np.asarray(key)).ravel()
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        block = self.block(self._positions(rows), self._positions(cols))
+        if np.ndim(rows) == 0 and not isinstance(rows, slice):
+            block = block[0]
+        if np.ndim(cols) == 0 and not isinstance(cols, slice):
+            block = block[..., 0]
+        return block
+
+    def block(self, rows, cols):
+        """Block for the given row and column positions, as an in-memory array."""
+        out = self.loadings[rows].astype(float) @ self.loadings[cols].astype(float).T
+        row_groups, col_groups = self.groups[rows], self.groups[cols]
+        for g in np.intersect1d(row_groups, col_groups):
+            if g < 0:
+                continue
+            ri, ci = np.flatnonzero(row_groups == g), np.flatnonzero(col_groups == g)
+            dense = self.blocks[self.offsets[g]:self.offsets[g + 1]].reshape(self.sizes[g], self.sizes[g])
+            out[np.ix_(ri, ci)] = dense[np.ix_(self.local[rows[ri]], self.local[cols[ci]])]
+        # Diagonal cells of tickers in no industry
+        lone = np.flatnonzero(row_groups < 0)
+        if len(lone):
+            for i in lone:
+                out[i, cols == rows[i]] += self.residual[rows[i]]
+        return out.astype(self.dtype, copy=False)
+
+    def diagonal(self):
+        diagonal = np.einsum('ij,ij->i', self.loadings.astype(float), self.loadings.astype(float)) + self.residual
+        for g, size in enumerate(self.sizes):
+            dense = self.blocks[self.offsets[g]:self.offsets[g + 1]].reshape(size, size)
+            diagonal[self.groups == g] = np.diagonal(dense)[self.local[self.groups == g]]
+        return diagonal.astype(self.dtype, copy=False)
@@ -0,0 +1,98 @@
+import functools
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+
+try:
+    # Plotly 6 and later send NumPy arrays as base64 typed arrays ({'dtype', 'bdata', 'shape'})
+    from _plotly_utils.utils import convert_to_base64
+except ImportError:
+    # Older versions send them as nested lists, which the JSON encoder writes from the arrays
+    convert_to_base64 = None
+
+
+@functools.lru_cache(maxsize=None)
+def colorscale(name):
+    # Named scales are expanded to [position, colour] pairs, as plotly's validator does
+    return go.Heatmap(colorscale=name).to_plotly_json()['colorscale']
+
+
+@functools.lru_cache(maxsize=None)
+def default_template():
+    # Template every go.Figure carries in its layout
+    return go.Figure().to_plotly_json()['layout']['template']
+
+
+def subplot_grid(rows, cols, titles=()):
+    """
+    Layout of make_subplots(rows=rows, cols=cols, subplot_titles=titles) as a plain dictionary: an
+    x/y axis pair per cell, with the same domains (and the same floating point arithmetic) as plotly,
+    and one title annotation per subplot, filled row by row from the top left.
+    """
+    horizontal_spacing = 0.2 / cols
+    vertical_spacing = (0.5 if titles else 0.3) / rows
+    widths = [(1.0 - horizontal_spacing * (cols - 1)) / cols] * cols
+    heights = [(1.0 - vertical_spacing * (rows - 1)) / rows] * rows
+
+    layout = {}
+    title_positions = []
+    for r in range(rows):
+        # Row 0 is drawn at the top, so it starts after all rows below it
+        below = rows - 1 - r
+        y_start = sum(heights[:below]) + below * vertical_spacing
+        y_end = y_start + heights[-1 - r]
+        y_domain = [max(0.0, min(1.0, y_start)), max(0.0, min(1.0, y_end))]
+        for c in range(cols):
+            x_start = sum(widths[:c]) + c * horizontal_spacing
+            x_domain = [max(0.0, x_start), min(1.0, x_start + widths[c])]
+            suffix = subplot_suffix(r * cols + c + 1)
+            layout['xaxis' + suffix] = {'anchor': 'y' + suffix, 'domain': x_domain}
+            layout['yaxis' + suffix] = {'anchor': 'x' + suffix, 'domain': y_domain}
+            title_positions.append((sum(x_domain) / 2.0, y_domain[1]))
+
+    layout['annotations'] = [
+        {
+            'font': {'size': 16},
+            'showarrow': False,
+            'text': title,
+            'x': x,
+            'xanchor': 'center',
+            'xref': 'paper',
+            'y': y,
+            'yanchor': 'bottom',
+            'yref': 'paper',
+        }
+        for title, (x, y) in zip(titles, title_positions) if title
+    ]
+    return layout
+
+
+def subplot_suffix(subplot):
+    # Axes of subplot 1 are 'x'/'y', of subplot k 'x<k>'/'y<k>'
+    return '' if subplot == 1 else str(subplot)
+
+
+def heatmap_trace(subplot, **props):
+    """
+    The dictionary go.Heatmap(**props) added to the given subplot (numbered row by row from 1)
+    serializes to. Properties are not validated or copied; NumPy blocks are encoded the way the
+    installed plotly encodes them, as base64 typed arrays (plotly 6+) or left for the JSON encoder
+    to write as nested lists (older versions).
+    """
+    if isinstance(props.get('colorscale'), str):
+        props['colorscale'] = colorscale(props['colorscale'])
+    trace = dict(sorted(props.items()))
+    suffix = subplot_suffix(subplot)
+    trace.update(type='heatmap', xaxis='x' + suffix, yaxis='y' + suffix)
+    if convert_to_base64 is not None:
+        convert_to_base64(trace)
+    return trace
+
+
+def figure(data, layout):
+    """Figure dictionary with the default template, ready for dcc.Graph(figure=...)."""
+    return {'data': data, 'layout': {**layout, 'template': default_template()}}
+
+
+def encode(fig):
+    """JSON text of a figure dictionary, as Dash would send it (NumPy arrays are encoded directly)."""
+    return to_json_plotly(fig)
@@ -1,26 +1,271 @@
-from dash import Dash, dcc, html, Input, Output
+from dash import (
+    Dash, DiskcacheManager, ClientsideFunction, MATCH, dcc, html, Input, Output, State, Patch, dash_table, no_update
+)
+from flask import request, jsonify, g, has_request_context, send_file
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import pickle
 import io
 import base64
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import datetime
+import threading
+import diskcache
+from contextlib import ExitStack
+from urllib.parse import urlencode
+from plotly.subplots import make_subplots
+from build_artifacts import (
+    COVARIANCE_FILE, EIGEN_TOP_K, INDUSTRIES_FILE, SUMMARY_STATS, write_snapshot
+)
+from covariance_store import SnapshotStore, delta_block
+from portfolio_risk import parse_portfolios, parse_risk_request, portfolio_risk
+from precision import partial_correlations, precision_matrix
+from block_cache import BlockCache, caches, discard_version
+from single_flight import SingleFlight, flights
+from admission import Budget, BudgetExceeded, budgets, downsample
+from integrity import IntegrityError
+import metrics
+import fast_figure
+import profiling
 
 # Initialize the app
 app = Dash(__name__, suppress_callback_exceptions=True)  # Add this line to suppress callback exceptions
 
-# Load industry lists and covariance matrix from pickled files
-with open("new_sorted_industries.pkl", "rb") as f:
-    industry_lists = pickle.load(f)
-sigma_sorted = pd.read_pickle("new_sorted_covariance.pkl")
+# Dated covariance snapshots written by build_artifacts.py; each is memory-mapped once it is viewed
+store = SnapshotStore()
+if not store.names() and os.path.exists(COVARIANCE_FILE):
+    # No snapshot built yet: turn the pickle pair into today's snapshot
+    with open(INDUSTRIES_FILE, "rb") as f:
+        industry_lists = pickle.load(f)
+    sigma_sorted = pd.read_pickle(COVARIANCE_FILE)
+    write_snapshot(sigma_sorted.index, sigma_sorted.values, industry_lists,
+                   os.path.join(store.root, datetime.date.today().isoformat()))
+    del sigma_sorted
+    store.scan()
+latest = store.get()
+
+
+# Seconds between checks for new or rebuilt snapshots (0 disables the background check)
+RELOAD_INTERVAL = int(os.environ.get("RELOAD_INTERVAL", 30))
+# If set, /admin/... endpoints require this value in the X-Admin-Token header
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# 'lazy' checks matrix chunks against the build's checksums when a request first reads them;
+# 'eager' also checks every served snapshot in a background thread after startup and each reload
+INTEGRITY_CHECK = os.environ.get("INTEGRITY_CHECK", "lazy")
+
+
+def get_snapshot(name):
+    # The named snapshot, or the latest one for a missing or unknown name. Inside a request the
+    # snapshot is held until the request ends, so a reload never swaps data out from under it.
+    if not has_request_context():
+        return store.get(name if name in store.snapshots else None)
+    held = g.setdefault('snapshots', {})
+    if name not in held:
+        held[name] = store.acquire(name if name in store.snapshots else None)
+    return held[name]
+
+
+def metrics_handler():
+    # Label of the current request: the first output of a Dash callback, or the route pattern
+    if request.path.endswith('/_dash-update-component'):
+        output = (request.get_json(silent=True) or {}).get('output', '')
+        output = output.strip('.').split('...')[0].split('@')[0]
+        if output.startswith('{'):
+            # Pattern-matching id: one label per component type, not one per industry
+            component_id, _, prop = output.rpartition('.')
+            try:
+                output = f"{json.loads(component_id)['type']}.{prop}"
+            except (ValueError, KeyError, TypeError):
+                pass
+        return output or 'callback'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.server.before_request
+def start_metrics():
+    if metrics.enabled and request.path != '/metrics':
+        metrics.start_request(metrics_handler())
+
+
+@app.server.before_request
+def start_profile():
+    # Asking by header or query needs the admin token (if one is set); sampled requests do not
+    if request.path.startswith('/admin/') or request.path == '/metrics':
+        return
+    asked = profiling.requested(request.headers, request.args)
+    if asked and not admin_allowed():
+        return
+    if asked or profiling.sampled():
+        handler, path = metrics_handler(), request.full_path.rstrip('?')
+        profiling.start(handler, path)
+        # A request starting a heatmap render job has the job profiled too (polls carry a cacheKey)
+        if handler == 'industry-payload.data' and 'cacheKey' not in request.args:
+            inputs = render_job_inputs()
+            if inputs is not None:
+                profiling.request_job(render_job_key(*inputs), RENDER_JOB, path)
+
+
+@app.server.before_request
+def admit_render_result():
+    # The poll that collects a finished render job reads the encoded payload from the background
+    # cache and encodes it again into the response, so it is admitted like the render itself
+    if 'cacheKey' not in request.args or not request.path.endswith('/_dash-update-component'):
+        return
+    if metrics_handler() != 'industry-payload.data' or request.args['cacheKey'] not in background_manager.handle:
+        return
+    inputs = render_job_inputs()
+    if inputs is None:
+        return
+    industry, render_request = inputs
+    pos = get_snapshot(render_request.get('snapshot')).positions.get(industry)
+    if pos is None:
+        return
+    try:
+        hold_admission(memory_budget.admit(render_cost(pos, pos, memory_budget.step(len(pos), len(pos)))))
+    except BudgetExceeded:
+        return jsonify(error="The server is busy sending other large heatmaps."), 503
+
+
+def hold_admission(admission):
+    # Enters an admission that is only released when the request ends, so a callback's figure is
+    # still admitted while Dash encodes it into the response
+    g.setdefault('admissions', ExitStack()).enter_context(admission)
+
+
+@app.server.after_request
+def finish_metrics(response):
+    callback = request.path.endswith('/_dash-update-component')
+    metrics.finish_request(response.status_code, response.content_length, 'serialize' if callback else 'other')
+    return response
+
+
+@app.server.after_request
+def finish_profile(response):
+    capture_id = profiling.finish(response.status_code)
+    if capture_id is not None:
+        response.headers['X-Profile-Id'] = capture_id
+    return response
+
+
+@app.server.teardown_request
+def abandon_profile(exc):
+    profiling.abandon()
+
+
+@app.server.teardown_request
+def release_admissions(exc):
+    admissions = g.pop('admissions', None)
+    if admissions is not None:
+        admissions.close()
+
+
+@app.server.teardown_request
+def release_snapshots(exc):
+    for snap in g.pop('snapshots', {}).values():
+        store.release(snap)
+
+
+def reload_snapshots():
+    # Swap in new snapshot versions and drop cached results of the versions no longer served
+    changed, retired = store.reload()
+    live = {snap.version for snap in store.snapshots.values()}
+    for snap in retired:
+        if snap.version not in live:
+            discard_version(snap.version)
+    if changed:
+        print(f"Reloaded snapshots: {', '.join(changed)}")
+        if INTEGRITY_CHECK == 'eager':
+            threading.Thread(target=verify_snapshots, daemon=True).start()
+    return changed
+
+
+def verify_snapshots():
+    # Checks every file of every served snapshot once. Corrupt chunks stay marked, so requests
+    # reading them get an error instead of wrong data
+    for snap in list(store.snapshots.values()):
+        try:
+            read = snap.verify_all()
+        except (OSError, IntegrityError) as e:
+            print(f"Integrity check of snapshot '{snap.name}' failed: {e}")
+            continue
+        if read:
+            print(f"Snapshot '{snap.name}' matches its checksums ({read / 2**20:.1f} MB checked)")
+
+
+def watch_snapshots():
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        try:
+            reload_snapshots()
+        except Exception as e:
+            print(f"Snapshot reload failed: {e}")
+
+
+if RELOAD_INTERVAL > 0:
+    threading.Thread(target=watch_snapshots, daemon=True).start()
+if INTEGRITY_CHECK == 'eager':
+    threading.Thread(target=verify_snapshots, daemon=True).start()
+
+
+def industry_options(snap):
+    return [{'label': industry, 'value': industry} for industry in snap.industry_lists.keys()]
+
+
+def heatmap_block(snap, rows, cols, delta=False):
+    # Block of a snapshot, or its change since the previous snapshot (None if there is none)
+    with metrics.stage('extract'):
+        if delta:
+            previous_name = store.previous_name(snap.name)
+            if previous_name is None:
+                return None
+            block = delta_block(snap, get_snapshot(previous_name), rows, cols)
+        else:
+            block = snap.block(rows, cols)
+    metrics.add_cells(block.size)
+    return block
+
+
+def heatmap_overview(snap, rows, cols, delta, step):
+    # Block averaged over step x step tiles. It is read in bands of whole tile rows, so only about
+    # one request's budget of cells is in memory at a time
+    if step == 1:
+        return heatmap_block(snap, rows, cols, delta)
+    band = step * max(1, memory_budget.request_cells // (step * len(cols)))
+    return np.vstack([downsample(heatmap_block(snap, rows[start:start + band], cols, delta), step)
+                      for start in range(0, len(rows), band)])
+
+
+def render_cost(rows, cols, step):
+    # Cells a render holds: the block itself, or at most one request's budget when downsampled
+    return len(rows) * len(cols) if step == 1 else memory_budget.request_cells
+
+
+def data_versions(snap, delta=False):
+    # Versions the displayed values depend on: the snapshot, and for changes also the previous one
+    if delta:
+        return snap.version, get_snapshot(store.previous_name(snap.name)).version
+    return snap.version
+
+
+def version_tag(snap, delta=False):
+    # data_versions as one string, which the browser keys its cached figures by
+    versions = data_versions(snap, delta)
+    return ':'.join(versions) if isinstance(versions, tuple) else versions
+
+
+def color_range(snap, delta=False):
+    # Changes are centred on zero; covariances use the snapshot's mean +/- 2 std limits
+    return dict(zmid=0) if delta else dict(zmin=snap.vmin, zmax=snap.vmax)
 
-# Define vmin and vmax for color scale limits
-overall_mean = sigma_sorted.values.mean()
-overall_std = sigma_sorted.values.std()
-vmin = overall_mean - 2 * overall_std
-vmax = overall_mean + 2 * overall_std
 
 # Prepare options for the dropdown
-dropdown_options = [{'label': industry, 'value': industry} for industry in industry_lists.keys()]
+dropdown_options = industry_options(latest)
 
 # Color scales options
 color_scales = ['Viridis', 'Cividis', 'Blues', 'YlGnBu', 'RdBu']
@@ -28,6 +273,55 @@ color_scales = ['Viridis', 'Cividis', 'Blues', 'YlGnBu', 'RdBu']
 # Store the color scale selections for each heatmap
 color_scale_dict = {}
 
+# Inverted covariance blocks, keyed by data version, block and ridge, so views and downloads share them
+precision_cache = BlockCache('precision', int(os.environ.get("PRECISION_CACHE_MB", 512)) * 2**20)
+
+# Heavy renders run as background jobs in worker processes, so request threads stay free for cheap
+# callbacks; results pass through this on-disk cache. The browser cancels a job it has superseded.
+background_manager = DiskcacheManager(
+    diskcache.Cache(os.environ.get("BACKGROUND_CACHE_DIR", os.path.join("cache", "background")))
+)
+
+# Identical concurrent renders and downloads are computed once and shared. Renders run in job
+# processes, so they always coalesce through lock and result files (a result is only written when
+# another job waits for it); downloads (whose CSV can be hundreds of MB) only do so when several
+# server processes are given a shared SINGLE_FLIGHT_DIR
+SINGLE_FLIGHT_DIR = os.environ.get("SINGLE_FLIGHT_DIR")
+render_flight = SingleFlight('heatmaps', SINGLE_FLIGHT_DIR or os.path.join("cache", "single-flight"))
+download_flight = SingleFlight('downloads', SINGLE_FLIGHT_DIR)
+
+# One request may hold REQUEST_MEMORY_MB of matrix cells; larger heatmaps are shown averaged over
+# tiles. Heavy requests of all server and job processes together hold at most MEMORY_BUDGET_MB;
+# the others wait up to ADMISSION_TIMEOUT seconds for room and are then turned away
+memory_budget = Budget(
+    'memory',
+    os.environ.get("BUDGET_DIR", os.path.join("cache", "budget")),
+    request_bytes=int(os.environ.get("REQUEST_MEMORY_MB", 256)) * 2**20,
+    total_bytes=int(os.environ.get("MEMORY_BUDGET_MB", 1024)) * 2**20,
+    timeout=float(os.environ.get("ADMISSION_TIMEOUT", 30)),
+)
+
+# Cell values are written on a heatmap only while its zoomed view shows at most this many cells
+ANNOTATION_CELL_LIMIT = int(os.environ.get("ANNOTATION_CELL_LIMIT", 400))
+# Largest limit a page may set: every labelled cell is sent with its value and text
+MAX_ANNOTATION_CELLS = int(os.environ.get("MAX_ANNOTATION_CELLS", 2500))
+
+# Every selected industry gets its own graph of this size, rendered only while it is scrolled near view
+GRAPH_WIDTH = 1000
+GRAPH_HEIGHT = 800
+
+# Rendered industry heatmaps are kept in the browser, up to BROWSER_CACHE_MB, and with
+# BROWSER_CACHE_PERSIST=1 also in its IndexedDB across visits. The mode tells cached figures apart
+# when the server renders differently (downsampling depends on the request memory budget)
+FIGURE_CACHE_SETTINGS = {
+    'max_bytes': int(os.environ.get("BROWSER_CACHE_MB", 256)) * 2**20,
+    'persist': os.environ.get("BROWSER_CACHE_PERSIST", "0") == "1",
+    'mode': f"cells={memory_budget.request_cells}",
+}
+
+# The network view draws at most this many edges (the strongest ones) so the browser stays responsive
+NETWORK_EDGE_LIMIT = int(os.environ.get("NETWORK_EDGE_LIMIT", 20000))
+
 # Layout definition
 app.layout = html.Div(
     [
@@ -41,6 +335,70 @@ app.layout = html.Div(
                         'margin-bottom': '20px'
                     }
                 ),
+                html.Label(
+                    "Snapshot:",
+                    style={
+                        'font-size': '1.2em',
+                        'margin-bottom': '10px',
+                        'display': 'block'
+                    }
+                ),
+                dcc.Dropdown(
+                    id='snapshot-dropdown',
+                    options=store.names(),
+                    value=latest.name,
+                    clearable=False,
+                    style={
+                        'width': '100%',
+                        'margin-bottom': '10px',
+                        'font-size': '1em'
+                    }
+                ),
+                dcc.Store(id='data-version', data=latest.version),  # Version of the selected snapshot
+                dcc.Store(id='figure-cache-settings', data=FIGURE_CACHE_SETTINGS),  # See assets/figure_cache.js
+                dcc.Interval(
+                    id='reload-interval',
+                    interval=max(RELOAD_INTERVAL, 1) * 1000,
+                    disabled=RELOAD_INTERVAL <= 0
+                ),
+                dcc.Checklist(
+                    id='delta-toggle',
+                    options=[{'label': 'Show change vs. previous snapshot', 'value': 'delta'}],
+                    value=[],
+                    style={'margin-bottom': '20px'}
+                ),
+                html.Label(
+                    "Industry Overview (click a cell to open that block):",
+                    style={
+                        'font-size': '1.2em',
+                        'margin-bottom': '10px',
+                        'display': 'block'
+                    }
+                ),
+                dcc.RadioItems(
+                    id='summary-measure',
+                    options=[
+                        {'label': 'Covariance', 'value': 'covariance'},
+                        {'label': 'Correlation', 'value': 'correlation'}
+                    ],
+                    value='correlation',
+                    inline=True,
+                    style={'margin-bottom': '10px'}
+                ),
+                dcc.RadioItems(
+                    id='summary-stat',
+                    options=[{'label': stat.capitalize(), 'value': stat} for stat in SUMMARY_STATS],
+                    value='mean',
+                    inline=True,
+                    style={'margin-bottom': '10px'}
+                ),
+                dcc.Graph(id='summary-heatmap'),
+                html.Div(
+                    id='block-container',
+                    style={
+                        'margin-bottom': '30px'
+                    }
+                ),  # Display the block clicked in the overview here
                 html.Label(
                     "Select Industries:",
                     style={
@@ -78,6 +436,22 @@ app.layout = html.Div(
                         'font-size': '1em'
                     }
                 ),
+                dcc.Checklist(
+                    id='annotation-toggle',
+                    options=[{'label': 'Show covariance values when zoomed in to at most', 'value': 'show'}],
+                    value=['show'],
+                    inline=True,
+                    style={'display': 'inline-block'}
+                ),
+                dcc.Input(
+                    id='annotation-limit',
+                    type='number',
+                    min=1,
+                    max=MAX_ANNOTATION_CELLS,
+                    value=ANNOTATION_CELL_LIMIT,
+                    style={'width': '80px', 'margin': '0 5px'}
+                ),
+                html.Span("cells"),
                 html.Div(
                     id='heatmap-container',
                     style={
@@ -89,7 +463,173 @@ app.layout = html.Div(
                     style={
                         'margin-top': '30px'
                     }
-                )  # Display download buttons here
+                ),  # Display download buttons here
+                html.Label(
+                    "Factor Structure by Industry:",
+                    style={
+                        'font-size': '1.2em',
+                        'margin-top': '30px',
+                        'margin-bottom': '10px',
+                        'display': 'block'
+                    }
+                ),
+                dcc.Dropdown(
+                    id='pca-industry',
+                    options=dropdown_options,
+                    placeholder="Select an industry",
+                    style={
+                        'width': '100%',
+                        'margin-bottom': '20px',
+                        'font-size': '1em'
+                    }
+                ),
+                html.Label("Approximation rank:"),
+                dcc.Slider(
+                    id='pca-rank',
+                    min=1,
+                    max=EIGEN_TOP_K,
+                    step=1,
+                    value=3
+                ),
+                html.Div(id='pca-factors'),  # Display spectrum and loadings here
+                html.Div(id='pca-approximation'),  # Display raw / rank-k / residual heatmaps here
+                html.Label(
+                    "Co-movement Network (|correlation| above a threshold):",
+                    style={
+                        'font-size': '1.2em',
+                        'margin-top': '30px',
+                        'margin-bottom': '10px',
+                        'display': 'block'
+                    }
+                ),
+                dcc.Dropdown(
+                    id='network-industries',
+                    options=dropdown_options,
+                    multi=True,
+                    placeholder="Select industries",
+                    style={
+                        'width': '100%',
+                        'margin-bottom': '10px',
+                        'font-size': '1em'
+                    }
+                ),
+                dcc.Dropdown(
+                    id='network-level',
+                    options=latest.network_levels(),
+                    value=(latest.network_levels() or [None])[-1],
+                    clearable=False,
+                    placeholder="Threshold",
+                    style={
+                        'width': '50%',
+                        'margin-bottom': '20px',
+                        'font-size': '1em'
+                    }
+                ),
+                html.Div(id='network-container'),  # Display the network graph here
+                html.Label(
+                    "Similar Tickers (most correlated across all industries):",
+                    style={
+                        'font-size': '1.2em',
+                        'margin-top': '30px',
+                        'margin-bottom': '10px',
+                        'display': 'block'
+                    }
+                ),
+                dcc.Input(
+                    id='similar-ticker',
+                    type='text',
+                    placeholder="Ticker",
+                    debounce=True,
+                    style={'width': '150px', 'margin-right': '10px'}
+                ),
+                html.Label("Neighbours:"),
+                dcc.Input(
+                    id='similar-k',
+                    type='number',
+                    min=1,
+                    max=500,
+                    step=1,
+                    value=10,
+                    debounce=True,
+                    style={'width': '80px', 'margin': '0 5px'}
+                ),
+                html.Div(id='similar-output'),  # Display the most correlated tickers here
+                html.Label(
+                    "Partial Correlations and Precision Matrix:",
+                    style={
+                        'font-size': '1.2em',
+                        'margin-top': '30px',
+                        'margin-bottom': '10px',
+                        'display': 'block'
+                    }
+                ),
+                dcc.Dropdown(
+                    id='precision-industry',
+                    options=dropdown_options,
+                    placeholder="Select an industry, or enter a custom basket below",
+                    style={
+                        'width': '100%',
+                        'margin-bottom': '10px',
+                        'font-size': '1em'
+                    }
+                ),
+                dcc.Textarea(
+                    id='precision-basket',
+                    placeholder="Custom basket: tickers separated by commas",
+                    style={
+                        'width': '100%',
+                        'height': '60px',
+                        'font-family': 'monospace'
+                    }
+                ),
+                dcc.RadioItems(
+                    id='precision-mode',
+                    options=[
+                        {'label': 'Partial correlations', 'value': 'partial'},
+                        {'label': 'Precision matrix', 'value': 'precision'}
+                    ],
+                    value='partial',
+                    inline=True,
+                    style={'margin-top': '10px'}
+                ),
+                html.Label("Ridge (fraction of average variance added to the diagonal):"),
+                dcc.Input(
+                    id='precision-ridge',
+                    type='number',
+                    min=0,
+                    step=0.01,
+                    value=0,
+                    debounce=True,
+                    style={'width': '80px', 'margin': '0 5px'}
+                ),
+                html.Div(id='precision-container'),  # Display the partial correlation heatmap here
+                html.Label(
+                    "Portfolio Risk (CSV: header of tickers, one row of weights per portfolio):",
+                    style={
+                        'font-size': '1.2em',
+                        'margin-top': '30px',
+                        'margin-bottom': '10px',
+                        'display': 'block'
+                    }
+                ),
+                dcc.Textarea(
+                    id='risk-input',
+                    placeholder="AAPL,MSFT,XOM\n0.5,0.3,0.2\n0.2,0.2,0.6",
+                    style={
+                        'width': '100%',
+                        'height': '120px',
+                        'font-family': 'monospace'
+                    }
+                ),
+                html.Button(
+                    'Compute Risk',
+                    id='risk-button',
+                    style={
+                        'margin-top': '10px',
+                        'margin-bottom': '20px'
+                    }
+                ),
+                html.Div(id='risk-output')  # Display portfolio risk tables here
             ],
             style={
                 'maxWidth': '80%',
@@ -108,110 +648,1035 @@ app.layout = html.Div(
 )
 
 
+@app.callback(
+    [Output('snapshot-dropdown', 'options'),
+     Output('snapshot-dropdown', 'value'),
+     Output('data-version', 'data')],
+    [Input('reload-interval', 'n_intervals')],
+    [State('snapshot-dropdown', 'value'),
+     State('data-version', 'data')]
+)
+def refresh_snapshots(n_intervals, snapshot_name, shown_version):
+    # Re-selecting the snapshot re-renders every view once its data has been reloaded or removed
+    snap = get_snapshot(snapshot_name)
+    if snap.name == snapshot_name and snap.version == shown_version:
+        return store.names(), no_update, no_update
+    return store.names(), snap.name, snap.version
+
+
+@app.callback(
+    Output('data-version', 'data', allow_duplicate=True),
+    [Input('snapshot-dropdown', 'value')],
+    prevent_initial_call=True
+)
+def track_data_version(snapshot_name):
+    return get_snapshot(snapshot_name).version
+
+
+@app.callback(
+    [Output('industry-dropdown', 'options'),
+     Output('pca-industry', 'options'),
+     Output('precision-industry', 'options'),
+     Output('network-industries', 'options'),
+     Output('network-level', 'options')],
+    [Input('snapshot-dropdown', 'value')]
+)
+def update_industry_options(snapshot_name):
+    # Industries (and network thresholds) can differ between snapshots
+    snap = get_snapshot(snapshot_name)
+    options = industry_options(snap)
+    return options, options, options, options, snap.network_levels()
+
+
 @app.callback(
     [Output('heatmap-container', 'children'),
      Output('download-container', 'children')],
     [Input('industry-dropdown', 'value'),
-     Input('color-dropdown', 'value')]
+     Input('snapshot-dropdown', 'value'),
+     Input('delta-toggle', 'value')]
 )
-def update_heatmap_and_color_scale(selected_industries, selected_color_scale):
+def update_heatmap_panels(selected_industries, snapshot_name, delta_toggle):
     if not selected_industries:
         return html.Div("Select industries to view heatmaps."), []
 
-    # Store the selected color scale for each industry
+    snap = get_snapshot(snapshot_name)
+    delta = 'delta' in (delta_toggle or [])
+    if delta and store.previous_name(snap.name) is None:
+        return html.Div("There is no earlier snapshot to compare with."), []
+    query = urlencode({'snapshot': snap.name, **({'delta': 1} if delta else {})})
+
+    # One empty panel of fixed size per industry. assets/lazy_graphs.js asks for a panel's heatmap
+    # when it scrolls near view and releases it when it is scrolled far away; the render id tells
+    # the script that the panels were replaced, even where the industries stayed the same
+    render_id = uuid.uuid4().hex
+    version = version_tag(snap, delta)
+    panels = []
+    download_buttons = []
     for industry in selected_industries:
-        color_scale_dict[industry] = selected_color_scale
+        if not snap.industry_lists.get(industry):
+            continue
+        panels.append(
+            html.Div(
+                [
+                    dcc.Store(id={'type': 'industry-visible', 'index': industry}, data=False),
+                    dcc.Store(id={'type': 'industry-request', 'index': industry}),
+                    dcc.Store(id={'type': 'industry-viewport', 'index': industry}, data={}),  # Zoom, label trace shown
+                    dcc.Store(id={'type': 'industry-version', 'index': industry}, data=version),
+                    dcc.Loading([
+                        dcc.Graph(
+                            id={'type': 'industry-graph', 'index': industry},
+                            figure=empty_figure(),
+                            style={'width': f'{GRAPH_WIDTH}px', 'height': f'{GRAPH_HEIGHT}px'}
+                        ),
+                        dcc.Store(id={'type': 'industry-payload', 'index': industry}),  # Rendered figure
+                    ]),
+                ],
+                className='industry-panel',
+                style={'height': f'{GRAPH_HEIGHT}px', 'margin-bottom': '20px'},
+                **{'data-industry': industry, 'data-render': render_id}
+            )
+        )
 
-    from plotly.subplots import make_subplots
-    import plotly.graph_objects as go
+        # Create a download button for this heatmap
+        download_buttons.append(
+            html.Div(
+                [
+                    html.A(
+                        'Download CSV',
+                        id=f'download-button-{industry}',
+                        href=f"/download/{industry}?{query}",
+                        download=f'{industry}_covariance_matrix.csv',
+                        style={
+                            'display': 'block',
+                            'margin-top': '10px',
+                            'text-align': 'center',
+                            'padding': '10px',
+                            'background-color': '#007BFF',
+                            'color': 'white',
+                            'border-radius': '5px',
+                            'text-decoration': 'none'
+                        }
+                    )
+                ],
+                style={
+                    'display': 'flex',
+                    'flex-direction': 'column',
+                    'align-items': 'center',
+                    'margin-top': '10px',
+                }
+            )
+        )
 
-    # Prepare subplots for multiple heatmaps (2 per row)
-    num_industries = len(selected_industries)
-    cols = 2
-    rows = (num_industries + cols - 1) // cols
-    fig = make_subplots(rows=rows, cols=cols, subplot_titles=selected_industries)
+    return panels, download_buttons
 
-    heatmaps = []
-    download_buttons = []
 
-    # Generate the heatmaps and corresponding download buttons
-    for idx, industry in enumerate(selected_industries):
-        tickers = industry_lists.get(industry)
-        if tickers:
-            submatrix = sigma_sorted.loc[tickers, tickers]
-            
-            # Set color scale from the dict, default to 'Viridis'
-            current_color_scale = color_scale_dict.get(industry, 'Viridis')
-            
-            heatmap = go.Heatmap(
-                z=submatrix.values,
-                x=tickers,
-                y=tickers,
-                colorscale=current_color_scale,
-                zmin=vmin,
-                zmax=vmax
-            )
-            row, col = divmod(idx, cols)
-            fig.add_trace(heatmap, row=row + 1, col=col + 1)
+def empty_figure(message=None):
+    # Placeholder of a panel whose heatmap is not loaded (yet), optionally saying why
+    layout = {'xaxis': {'visible': False}, 'yaxis': {'visible': False}}
+    if message:
+        layout['annotations'] = [{'text': message, 'showarrow': False, 'xref': 'paper', 'yref': 'paper',
+                                  'x': 0.5, 'y': 0.5, 'font': {'size': 16}}]
+    return {'data': [], 'layout': layout}
 
-            # Create a download button for this heatmap
-            download_buttons.append(
-                html.Div(
-                    [
-                        html.A(
-                            'Download CSV',
-                            id=f'download-button-{industry}',
-                            href=f"/download/{industry}",
-                            download=f'{industry}_covariance_matrix.csv',
-                            style={
-                                'display': 'block',
-                                'margin-top': '10px',
-                                'text-align': 'center',
-                                'padding': '10px',
-                                'background-color': '#007BFF',
-                                'color': 'white',
-                                'border-radius': '5px',
-                                'text-decoration': 'none'
-                            }
-                        )
-                    ],
-                    style={
-                        'display': 'flex',
-                        'flex-direction': 'column',
-                        'align-items': 'center',
-                        'margin-top': '10px',
-                    }
-                )
-            )
-    
-    # Update layout and return the graph along with download buttons
+
+# Runs in the browser: a panel that became visible shows its heatmap from the browser's figure cache,
+# or asks the server for it if the cache does not hold it for the current data version and colour
+# scale; a panel scrolled far away drops its figure without a round trip
+app.clientside_callback(
+    ClientsideFunction(namespace='heatmaps', function_name='request_industry'),
+    [Output({'type': 'industry-request', 'index': MATCH}, 'data'),
+     Output({'type': 'industry-graph', 'index': MATCH}, 'figure', allow_duplicate=True),
+     Output({'type': 'industry-viewport', 'index': MATCH}, 'data', allow_duplicate=True)],
+    [Input({'type': 'industry-visible', 'index': MATCH}, 'data'),
+     Input('color-dropdown', 'value')],
+    [State('snapshot-dropdown', 'value'),
+     State('delta-toggle', 'value'),
+     State({'type': 'industry-version', 'index': MATCH}, 'data'),
+     State('figure-cache-settings', 'data'),
+     State({'type': 'industry-graph', 'index': MATCH}, 'id')],
+    prevent_initial_call=True
+)
+
+# Runs in the browser: keeps a figure sent by the server in the cache and shows it, unless the
+# panel was scrolled away in the meantime
+app.clientside_callback(
+    ClientsideFunction(namespace='heatmaps', function_name='show_industry'),
+    [Output({'type': 'industry-graph', 'index': MATCH}, 'figure', allow_duplicate=True),
+     Output({'type': 'industry-viewport', 'index': MATCH}, 'data', allow_duplicate=True)],
+    [Input({'type': 'industry-payload', 'index': MATCH}, 'data')],
+    [State({'type': 'industry-visible', 'index': MATCH}, 'data'),
+     State('figure-cache-settings', 'data')],
+    prevent_initial_call=True
+)
+
+
+# Metrics and profile label of render jobs, which run in job processes without a request
+RENDER_JOB = 'industry-payload.data/job'
+
+
+def render_job_inputs():
+    # Industry and render request of a request starting or polling a heatmap render job
+    body = request.get_json(silent=True) or {}
+    try:
+        render_request = body['inputs'][0]['value']
+        industry = body['inputs'][0]['id']['index']
+    except (KeyError, IndexError, TypeError):
+        return None
+    return (industry, render_request) if render_request else None
+
+
+def render_job_key(industry, render_request):
+    # Identifies a render job in both the request that starts it and the job process
+    return hashlib.sha1(json.dumps([industry, render_request], sort_keys=True).encode()).hexdigest()
+
+
+@app.callback(
+    Output({'type': 'industry-payload', 'index': MATCH}, 'data'),
+    [Input({'type': 'industry-request', 'index': MATCH}, 'data')],
+    [State({'type': 'industry-graph', 'index': MATCH}, 'id')],
+    background=True,
+    manager=background_manager,
+    interval=250,
+    prevent_initial_call=True
+)
+def update_heatmap_and_color_scale(render_request, graph_id):
+    if not render_request:
+        return no_update
+    industry = graph_id['index']
+    # The job records its own stage timings and cells (and its profile, if the starting request
+    # was profiled); the server's request metrics only see the cheap polls
+    with metrics.job(RENDER_JOB), profiling.job(render_job_key(industry, render_request)):
+        return render_payload(industry, render_request)
+
+
+@metrics.timed('figure')
+def render_payload(industry, render_request):
+    snap = get_snapshot(render_request['snapshot'])
+    delta = 'delta' in (render_request['delta'] or [])
+    # The figure goes out with the versions it was drawn from, which the browser caches it under
+    payload = {'industry': industry, 'snapshot': snap.name, 'version': None, 'color': render_request['color'],
+               'delta': delta, 'cache': False}
+    if not snap.industry_lists.get(industry) or (delta and store.previous_name(snap.name) is None):
+        return encode_payload(payload, empty_figure())
+
+    # Sessions asking for the same render at the same time share one computation, already encoded.
+    # Only the computing job takes memory, and holds it until the figure is encoded, so the copies
+    # made while encoding are admitted too; jobs waiting for it hold no slots
+    pos = snap.positions[industry]
+    key = (data_versions(snap, delta), industry, render_request['color'])
+
+    def encoded_figure():
+        with memory_budget.admit(render_cost(pos, pos, memory_budget.step(len(pos), len(pos)))):
+            return encode_figure(render_heatmap(industry, render_request['color'], snap, delta))
+
+    try:
+        fig = render_flight.do(key, encoded_figure)
+        return encode_payload({**payload, 'version': version_tag(snap, delta), 'cache': True}, fig)
+    except BudgetExceeded:
+        return encode_payload(payload, empty_figure("The server is busy drawing other large heatmaps. "
+                                                    "Change the colour scale or scroll away and back to try again."))
+    except IntegrityError as e:
+        print(e)
+        return encode_payload(payload, empty_figure("The stored data of this industry failed its integrity check."))
+
+
+def encode_figure(fig):
+    with metrics.stage('serialize'):
+        return fast_figure.encode(fig)
+
+
+def encode_payload(payload, fig):
+    # The payload as one JSON string, with the figure (a dictionary, or already encoded) spliced
+    # in. The background cache writes a large string to its own file as it is, where a dictionary
+    # would be pickled into another copy; the browser parses it (see lazy_graphs.js)
+    if not isinstance(fig, str):
+        fig = encode_figure(fig)
+    return json.dumps(payload)[:-1] + ', "figure": ' + fig + '}'
+
+
+def render_heatmap(industry, selected_color_scale, snap, delta):
+    # Store the selected color scale for the industry
+    color_scale_dict[industry] = selected_color_scale
+    current_color_scale = color_scale_dict.get(industry, 'Viridis')
+
+    # The figure is assembled as a plain dictionary equal to the go.Figure one, skipping plotly's
+    # validation and copies. An industry too large for one request's memory budget is shown as the
+    # means of step x step tiles, each labelled by its first ticker. The caller admits its memory
+    pos = snap.positions[industry]
+    step = memory_budget.step(len(pos), len(pos))
+    tickers = snap.tickers[pos[::step]].tolist()
+    submatrix = heatmap_overview(snap, pos, pos, delta, step)
+    title = industry
+    if step > 1:
+        memory_budget.count('degraded')
+        title = f"{industry} (mean of {step} x {step} tiles: too large to show every cell)"
+    heatmap = fast_figure.heatmap_trace(
+        1,
+        z=submatrix,
+        x=tickers,
+        y=tickers,
+        colorscale=current_color_scale,
+        **color_range(snap, delta)
+    )
+    # Empty text-only copy of the heatmap, filled with the zoomed window by update_value_labels
+    label_trace = fast_figure.heatmap_trace(
+        1,
+        z=[],
+        colorscale=current_color_scale,
+        showscale=False,
+        texttemplate='%{text}',
+        hoverinfo='skip',
+        **color_range(snap, delta)
+    )
+
+    layout = fast_figure.subplot_grid(1, 1, [title])
+    layout.update(
+        showlegend=False,
+        margin=dict(t=50, b=50, l=50, r=50),
+    )
+    return fast_figure.figure([heatmap, label_trace], layout)
+
+
+def visible_cells(axis_range, n):
+    # Category k of an axis is drawn over [k - 0.5, k + 0.5]; None means the full axis
+    if axis_range is None:
+        return 0, n
+    start = max(0, int(np.ceil(axis_range[0] - 0.5)))
+    stop = min(n, int(np.floor(axis_range[1] + 0.5)) + 1)
+    return start, max(start, stop)
+
+
+@app.callback(
+    [Output({'type': 'industry-graph', 'index': MATCH}, 'figure', allow_duplicate=True),
+     Output({'type': 'industry-viewport', 'index': MATCH}, 'data', allow_duplicate=True)],
+    [Input({'type': 'industry-graph', 'index': MATCH}, 'relayoutData'),
+     Input('annotation-toggle', 'value'),
+     Input('annotation-limit', 'value')],
+    [State({'type': 'industry-graph', 'index': MATCH}, 'id'),
+     State({'type': 'industry-viewport', 'index': MATCH}, 'data'),
+     State({'type': 'industry-visible', 'index': MATCH}, 'data'),
+     State('snapshot-dropdown', 'value'),
+     State('delta-toggle', 'value')],
+    prevent_initial_call=True
+)
+@metrics.timed('figure')
+def update_value_labels(relayout_data, toggle, limit, graph_id, viewport, visible, snapshot_name, delta_toggle):
+    # A released, loading or placeholder panel has no label trace to patch (see viewportOf in
+    # lazy_graphs.js)
+    if not visible or not (viewport or {}).get('labels'):
+        return no_update, no_update
+
+    # Track the zoomed range of both axes; relayoutData only carries the axes that changed
+    viewport = dict(viewport or {})
+    for key, value in (relayout_data or {}).items():
+        match = re.match(r'^([xy]axis)\.(range\[0\]|range\[1\]|range|autorange)$', key)
+        if not match:
+            continue
+        axis, prop = match.groups()
+        if prop == 'autorange':
+            viewport.pop(axis, None)
+        elif prop == 'range':
+            viewport[axis] = list(value)
+        else:
+            bounds = viewport.get(axis, [None, None])
+            bounds[int(prop[-2])] = value
+            viewport[axis] = bounds
+
+    # Rebuild only the label trace, and only for the cells inside the zoomed window. Cells of a
+    # downsampled heatmap are its tiles, so their labels are tile means too
+    snap = get_snapshot(snapshot_name)
+    delta = 'delta' in (delta_toggle or [])
+    pos = snap.positions.get(graph_id['index'])
+    if pos is None or not len(pos):
+        return no_update, viewport
+    step = memory_budget.step(len(pos), len(pos))
+    num_tiles = -(-len(pos) // step)
+    col_start, col_stop = visible_cells(viewport.get('xaxis'), num_tiles)
+    row_start, row_stop = visible_cells(viewport.get('yaxis'), num_tiles)
+    num_cells = (col_stop - col_start) * (row_stop - row_start)
+
+    # The limit comes from the page, so it is capped here as well as by the input's max
+    try:
+        limit = min(int(limit or 0), MAX_ANNOTATION_CELLS)
+    except (TypeError, ValueError):
+        limit = 0
+    patched = Patch()
+    if 'show' in (toggle or []) and 0 < num_cells <= limit:
+        rows, cols = pos[row_start * step:row_stop * step], pos[col_start * step:col_stop * step]
+        window = heatmap_overview(snap, rows, cols, delta, step)
+        patched['data'][1].update({
+            'z': window.tolist(),
+            'x': snap.tickers[cols[::step]].tolist(),
+            'y': snap.tickers[rows[::step]].tolist(),
+            'text': np.char.mod('%.3g', window).tolist(),
+        })
+    else:
+        patched['data'][1].update({'z': [], 'x': [], 'y': [], 'text': []})
+    return patched, viewport
+
+
+@app.callback(
+    Output('summary-heatmap', 'figure'),
+    [Input('summary-measure', 'value'),
+     Input('summary-stat', 'value'),
+     Input('color-dropdown', 'value'),
+     Input('snapshot-dropdown', 'value')]
+)
+@metrics.timed('figure')
+def update_summary_heatmap(measure, stat, selected_color_scale, snapshot_name):
+    # Only K x K numbers are sent, so this is cheap enough for the landing page
+    try:
+        summary = get_snapshot(snapshot_name).summary()
+    except IntegrityError as e:
+        print(e)
+        return empty_figure("The stored summary of this snapshot failed its integrity check.")
+    industries = summary['industries']
+    fig = go.Figure(
+        go.Heatmap(
+            z=summary['stats'][measure, stat],
+            x=industries,
+            y=industries,
+            colorscale=selected_color_scale,
+            hovertemplate='%{y} / %{x}<br>' + f'{stat} {measure}: ' + '%{z:.4g}<extra></extra>'
+        )
+    )
+    fig.update_layout(
+        title=f"{stat.capitalize()} {measure} between industries",
+        width=1000,
+        height=600,
+        margin=dict(t=50, b=50, l=50, r=50),
+    )
+    return fig
+
+
+@app.callback(
+    Output('block-container', 'children'),
+    [Input('summary-heatmap', 'clickData'),
+     Input('color-dropdown', 'value'),
+     Input('snapshot-dropdown', 'value'),
+     Input('delta-toggle', 'value')]
+)
+@metrics.timed('figure')
+def show_summary_block(click_data, selected_color_scale, snapshot_name, delta_toggle):
+    snap = get_snapshot(snapshot_name)
+    if not click_data:
+        return []
+
+    # Rows come from the clicked row industry, columns from the clicked column industry; a click
+    # from another snapshot's summary may name an industry this one does not have
+    point = click_data['points'][0]
+    row_industry, col_industry = point.get('y'), point.get('x')
+    if row_industry not in snap.positions or col_industry not in snap.positions:
+        return []
+    rows, cols = snap.positions[row_industry], snap.positions[col_industry]
+    delta = 'delta' in (delta_toggle or [])
+    if delta and store.previous_name(snap.name) is None:
+        return html.Div("There is no earlier snapshot to compare with.")
+    step = memory_budget.step(len(rows), len(cols))
+    try:
+        hold_admission(memory_budget.admit(render_cost(rows, cols, step)))
+        block = heatmap_overview(snap, rows, cols, delta, step)
+    except BudgetExceeded:
+        return html.Div("The server is busy drawing other large heatmaps. Click the block again to retry.")
+    except IntegrityError as e:
+        print(e)
+        return html.Div("The stored data of this block failed its integrity check.", style={'color': 'red'})
+    query = urlencode({'snapshot': snap.name, **({'delta': 1} if delta else {})})
+
+    if row_industry == col_industry:
+        title = row_industry
+        href = f"/download/{row_industry}?{query}"
+    else:
+        title = f"{row_industry} x {col_industry}"
+        href = f"/download/{row_industry}/{col_industry}?{query}"
+
+    figure_title = title
+    if step > 1:
+        memory_budget.count('degraded')
+        figure_title = f"{title} (mean of {step} x {step} tiles: too large to show every cell)"
+
+    fig = go.Figure(
+        go.Heatmap(
+            z=block,
+            x=snap.tickers[cols[::step]],
+            y=snap.tickers[rows[::step]],
+            colorscale=selected_color_scale,
+            **color_range(snap, delta)
+        )
+    )
     fig.update_layout(
-        title="Industry Covariance Heatmaps",
+        title=figure_title,
         width=1000,
-        height=500 * rows,
+        height=600,
+        margin=dict(t=50, b=50, l=50, r=50),
+    )
+    return [
+        dcc.Graph(figure=fig),
+        html.A(
+            'Download CSV',
+            href=href,
+            download=f'{title}_covariance_matrix.csv',
+            style={
+                'display': 'block',
+                'margin-top': '10px',
+                'text-align': 'center',
+                'padding': '10px',
+                'background-color': '#007BFF',
+                'color': 'white',
+                'border-radius': '5px',
+                'text-decoration': 'none'
+            }
+        )
+    ]
+
+
+@app.callback(
+    Output('pca-factors', 'children'),
+    [Input('pca-industry', 'value'),
+     Input('snapshot-dropdown', 'value')]
+)
+def update_pca_factors(industry, snapshot_name):
+    if not industry:
+        return []
+    snap = get_snapshot(snapshot_name)
+    eigen = snap.eigen()
+    if eigen is None or industry not in eigen['industries']:
+        return html.Div("Factor structure not available: this snapshot was built without eigendecompositions "
+                        "(--no-eigen).")
+
+    factors = eigen['industries'][industry]
+    eigenvalues = factors['eigenvalues']
+    explained = eigenvalues / eigenvalues.sum()
+    tickers = snap.tickers[snap.positions[industry]]
+
+    spectrum = go.Figure(go.Bar(x=np.arange(1, len(eigenvalues) + 1), y=explained))
+    spectrum.update_layout(
+        title=f"Eigenvalue spectrum: {industry}",
+        xaxis_title="Component",
+        yaxis_title="Share of variance",
+        yaxis_type='log',
+        width=1000,
+        height=400,
+        margin=dict(t=50, b=50, l=50, r=50),
+    )
+
+    loadings = go.Figure(
+        go.Heatmap(
+            z=factors['eigenvectors'],
+            x=[f"PC{i + 1}" for i in range(factors['eigenvectors'].shape[1])],
+            y=tickers,
+            colorscale='RdBu',
+            zmid=0
+        )
+    )
+    loadings.update_layout(
+        title=f"Leading eigenvector loadings: {industry}",
+        width=1000,
+        height=600,
+        margin=dict(t=50, b=50, l=50, r=50),
+    )
+    return [dcc.Graph(figure=spectrum), dcc.Graph(figure=loadings)]
+
+
+@app.callback(
+    Output('pca-approximation', 'children'),
+    [Input('pca-industry', 'value'),
+     Input('pca-rank', 'value'),
+     Input('color-dropdown', 'value'),
+     Input('snapshot-dropdown', 'value')]
+)
+@metrics.timed('figure')
+def update_pca_approximation(industry, rank, selected_color_scale, snapshot_name):
+    snap = get_snapshot(snapshot_name)
+    try:
+        eigen = snap.eigen()
+    except IntegrityError as e:
+        print(e)
+        return html.Div("The stored factors of this snapshot failed their integrity check.", style={'color': 'red'})
+    if not industry or eigen is None or industry not in eigen['industries']:
+        return []
+
+    # Rank-k reconstruction from the cached factors: O(n^2 k), no eigensolve. The three panels are
+    # averaged over step x step tiles if they do not fit one request's memory budget; the tile means
+    # of V diag(l) V' are those of the tile-averaged eigenvectors, so the approximation stays exact
+    factors = eigen['industries'][industry]
+    pos = snap.positions[industry]
+    step = memory_budget.step(len(pos), 3 * len(pos))
+    vectors = downsample(factors['eigenvectors'][:, :rank].astype(float), step, axis=0)
+    tickers = snap.tickers[pos[::step]]
+    try:
+        with memory_budget.admit(3 * render_cost(pos, pos, 1) if step == 1 else memory_budget.request_cells):
+            approximation = (vectors * factors['eigenvalues'][:rank]) @ vectors.T
+            raw = heatmap_overview(snap, pos, pos, False, step)
+    except BudgetExceeded:
+        return html.Div("The server is busy drawing other large heatmaps. Select the rank again to retry.")
+    except IntegrityError as e:
+        print(e)
+        return html.Div("The stored data of this industry failed its integrity check.", style={'color': 'red'})
+    title = f"Rank-{rank} factor approximation: {industry}"
+    if step > 1:
+        memory_budget.count('degraded')
+        title += f" (mean of {step} x {step} tiles: too large to show every cell)"
+
+    fig = make_subplots(
+        rows=1, cols=3,
+        subplot_titles=["Raw", f"Rank-{rank} approximation", "Residual"]
+    )
+    for col, (z, scale) in enumerate([(raw, selected_color_scale),
+                                      (approximation, selected_color_scale),
+                                      (raw - approximation, 'RdBu')]):
+        fig.add_trace(
+            go.Heatmap(
+                z=z,
+                x=tickers,
+                y=tickers,
+                colorscale=scale,
+                zmin=snap.vmin if col < 2 else None,
+                zmax=snap.vmax if col < 2 else None,
+                zmid=0 if col == 2 else None,
+                showscale=col == 2
+            ),
+            row=1, col=col + 1
+        )
+    fig.update_layout(
+        title=title,
+        width=1500,
+        height=500,
         showlegend=False,
+        margin=dict(t=80, b=50, l=50, r=50),
+    )
+    return dcc.Graph(figure=fig)
+
+
+def network_edges(snap, industries, level):
+    """
+    Edges of the co-movement network that touch the given industries, each edge once.
+
+    Only the CSR rows of the selected tickers are read, so the cost follows the number of edges
+    shown rather than the size of the universe.
+
+    Parameters:
+    - snap: Snapshot with a network written by build_artifacts.py
+    - industries: Industries whose tickers are shown
+    - level: One of snap.network_levels()
+
+    Returns the selected positions and the source positions, target positions and correlations of the edges.
+    """
+    rows = np.concatenate([snap.positions[industry] for industry in industries])
+    sources, targets, corrs = snap.network_rows(level, rows)
+    # An edge between two selected tickers is stored in both rows; keep the copy with source < target
+    selected = np.zeros(len(snap.tickers), dtype=bool)
+    selected[rows] = True
+    keep = ~selected[targets] | (sources < targets)
+    return rows, sources[keep], targets[keep], corrs[keep]
+
+
+@app.callback(
+    Output('network-container', 'children'),
+    [Input('network-industries', 'value'),
+     Input('network-level', 'value'),
+     Input('snapshot-dropdown', 'value')]
+)
+@metrics.timed('figure')
+def update_network(industries, level, snapshot_name):
+    if not industries:
+        return []
+    snap = get_snapshot(snapshot_name)
+    if level not in snap.network_levels():
+        return html.Div("Network not available; run build_artifacts.py for this snapshot.")
+    industries = [industry for industry in industries if industry in snap.positions]
+    if not industries:
+        return []
+    rows, sources, targets, corrs = network_edges(snap, industries, level)
+    total = len(corrs)
+    if total > NETWORK_EDGE_LIMIT:
+        strongest = np.argpartition(-np.abs(corrs), NETWORK_EDGE_LIMIT)[:NETWORK_EDGE_LIMIT]
+        sources, targets, corrs = sources[strongest], targets[strongest], corrs[strongest]
+
+    # Tickers are sorted by industry, so placing them on a circle by position groups each industry
+    # in its own arc; tickers outside the selection sit on a slightly larger circle
+    n = len(snap.tickers)
+    nodes = np.unique(np.concatenate([rows, targets]))
+    selected = np.zeros(n, dtype=bool)
+    selected[rows] = True
+    angle = 2 * np.pi * np.arange(n) / n
+    radius = np.where(selected, 1.0, 1.15)
+    x, y = radius * np.cos(angle), radius * np.sin(angle)
+    ticker_industry = snap.ticker_industries()
+
+    fig = go.Figure()
+    for sign, color in [(1, 'rgba(200, 30, 30, 0.3)'), (-1, 'rgba(30, 30, 200, 0.3)')]:
+        mask = np.sign(corrs) == sign
+        # One trace per sign: segments separated by gaps (None)
+        ex = np.column_stack([x[sources[mask]], x[targets[mask]], np.full(mask.sum(), None)]).ravel()
+        ey = np.column_stack([y[sources[mask]], y[targets[mask]], np.full(mask.sum(), None)]).ravel()
+        fig.add_trace(go.Scattergl(x=ex, y=ey, mode='lines', line=dict(width=1, color=color),
+                                   hoverinfo='skip', name='positive' if sign > 0 else 'negative'))
+    degree = np.bincount(np.concatenate([sources, targets]), minlength=n)
+    node_industry = ticker_industry.iloc[nodes]
+    for industry in node_industry.unique():
+        group = nodes[(node_industry == industry).to_numpy()]
+        fig.add_trace(go.Scattergl(
+            x=x[group], y=y[group], mode='markers', name=industry,
+            marker=dict(size=6 + 2 * np.log1p(degree[group])),
+            text=[f"{ticker} ({industry}): {d} edges" for ticker, d in zip(snap.tickers[group], degree[group])],
+            hoverinfo='text'
+        ))
+    fig.update_layout(
+        title=f"|correlation| >= {level}: {total} edges"
+              + (f" (strongest {NETWORK_EDGE_LIMIT} shown)" if total > NETWORK_EDGE_LIMIT else ""),
+        width=900,
+        height=900,
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False, scaleanchor='x'),
         margin=dict(t=50, b=50, l=50, r=50),
     )
-    heatmap_layout = dcc.Graph(figure=fig)
+    return dcc.Graph(figure=fig)
+
+
+def similar_table(snap, ticker, k, live=False):
+    # Rows of the similar-tickers table and the source of the answer ('index' or 'live')
+    similar, source = snap.similar_tickers(ticker, k, live)
+    industries = snap.ticker_industries()
+    rows = [{'ticker': t, 'industry': industries[t], 'correlation': round(c, 4)} for t, c in similar.items()]
+    return rows, source
+
+
+@app.callback(
+    Output('similar-output', 'children'),
+    [Input('similar-ticker', 'value'),
+     Input('similar-k', 'value'),
+     Input('snapshot-dropdown', 'value')]
+)
+def update_similar_tickers(ticker, k, snapshot_name):
+    if not ticker:
+        return []
+    snap = get_snapshot(snapshot_name)
+    try:
+        rows, source = similar_table(snap, ticker.strip(), k or 10)
+    except ValueError as e:
+        return html.Div(str(e), style={'color': 'red'})
+    return [
+        html.Div(f"{len(rows)} most correlated with {ticker.strip()} "
+                 f"({'precomputed index' if source == 'index' else 'computed live'})",
+                 style={'margin-top': '10px'}),
+        dash_table.DataTable(
+            data=rows,
+            columns=[{'name': c.title(), 'id': c} for c in ('ticker', 'industry', 'correlation')],
+            page_size=20,
+            style_table={'width': '60%'}
+        )
+    ]
+
 
-    return heatmap_layout, download_buttons
+def precision_block(snap, industry, basket, ridge):
+    # Tickers and inverse covariance of an industry or a custom basket, factorized once per version
+    if basket:
+        tickers = list(dict.fromkeys(t.strip() for t in re.split(r'[,\s]+', basket) if t.strip()))
+        pos = snap.tickers.get_indexer(tickers)
+        missing = [ticker for ticker, p in zip(tickers, pos) if p < 0]
+        if missing:
+            raise ValueError(f"Unknown tickers: {', '.join(missing)}")
+    elif industry in snap.positions:
+        pos = snap.positions[industry]
+    else:
+        raise ValueError("Select an industry or enter tickers")
+
+    ridge = float(ridge or 0)
+    key = (snap.version, tuple(pos), ridge)
+    # Inverting is never downsampled, and the block, its inverse and the partial correlations are
+    # all n x n: the request holds its share of the memory budget until its response is sent
+    hold_admission(memory_budget.admit(len(pos) * len(pos)))
+    with metrics.stage('extract'):
+        precision = precision_cache.get_or_compute(key, lambda: precision_matrix(snap.block(pos, pos), ridge))
+    metrics.add_cells(precision.size)
+    return snap.tickers[pos], precision
+
+
+@app.callback(
+    Output('precision-container', 'children'),
+    [Input('precision-industry', 'value'),
+     Input('precision-basket', 'value'),
+     Input('precision-mode', 'value'),
+     Input('precision-ridge', 'value'),
+     Input('snapshot-dropdown', 'value')]
+)
+@metrics.timed('figure')
+def update_precision(industry, basket, mode, ridge, snapshot_name):
+    if not industry and not basket:
+        return []
+    snap = get_snapshot(snapshot_name)
+    try:
+        tickers, precision = precision_block(snap, industry, basket, ridge)
+    except ValueError as e:
+        return html.Div(str(e), style={'color': 'red'})
+    except np.linalg.LinAlgError:
+        return html.Div("The block is not positive definite; increase the ridge.", style={'color': 'red'})
+    except BudgetExceeded:
+        return html.Div("The server is busy with other large requests. Change the selection to retry.")
+
+    if mode == 'partial':
+        z, title, zrange = partial_correlations(precision), "Partial correlations", dict(zmin=-1, zmax=1)
+    else:
+        z, title, zrange = precision, "Precision matrix", dict(zmid=0)
+    title = f"{title}: {'custom basket' if basket else industry}"
+    # Like the industry heatmaps, a block too large for one request is shown as step x step tile
+    # means, and the figure is assembled as a plain dictionary
+    step = memory_budget.step(len(tickers), len(tickers))
+    if step > 1:
+        memory_budget.count('degraded')
+        z = downsample(z, step)
+        title = f"{title} (mean of {step} x {step} tiles: too large to show every cell)"
+    labels = tickers[::step].tolist()
+    fig = fast_figure.figure(
+        [fast_figure.heatmap_trace(1, z=z, x=labels, y=labels, colorscale='RdBu', **zrange)],
+        {'title': {'text': title}, 'width': 1000, 'height': 600, 'margin': dict(t=50, b=50, l=50, r=50)}
+    )
+
+    query = {'snapshot': snap.name, 'mode': mode, 'ridge': ridge or 0}
+    if basket:
+        query['tickers'] = ','.join(tickers)
+    else:
+        query['industry'] = industry
+    return [
+        dcc.Graph(figure=fig),
+        html.A(
+            'Download CSV',
+            href='/download-precision?' + urlencode(query),
+            style={
+                'display': 'block',
+                'margin-top': '10px',
+                'text-align': 'center',
+                'padding': '10px',
+                'background-color': '#007BFF',
+                'color': 'white',
+                'border-radius': '5px',
+                'text-decoration': 'none'
+            }
+        )
+    ]
+
+
+def risk_tables(result, max_rows=50):
+    # Summary of every portfolio plus the per-ticker breakdown of the first one
+    summary_table = pd.DataFrame({
+        'portfolio': np.arange(1, len(result['variance']) + 1),
+        'variance': result['variance'],
+        'volatility': result['volatility'],
+    })
+    for i, industry in enumerate(result['industries']):
+        summary_table[industry] = result['industry_contribution'][:, i]
+    ticker_table = pd.DataFrame({
+        'ticker': result['tickers'],
+        'marginal': result['marginal'][0],
+        'component': result['component'][0],
+    })
+    tables = []
+    for title, table in [(f"{len(summary_table)} portfolio(s)", summary_table.head(max_rows)),
+                         ("Risk contributions of portfolio 1", ticker_table)]:
+        tables.append(html.H4(title))
+        tables.append(
+            dash_table.DataTable(
+                data=table.round(6).to_dict('records'),
+                columns=[{'name': column, 'id': column} for column in table.columns],
+                page_size=10,
+                style_table={'overflowX': 'auto'}
+            )
+        )
+    return tables
+
+
+@app.callback(
+    Output('risk-output', 'children'),
+    [Input('risk-button', 'n_clicks')],
+    [State('risk-input', 'value'),
+     State('snapshot-dropdown', 'value')]
+)
+def update_portfolio_risk(n_clicks, portfolio_text, snapshot_name):
+    if not n_clicks or not portfolio_text:
+        return []
+    snap = get_snapshot(snapshot_name)
+    try:
+        tickers, weights = parse_portfolios(portfolio_text)
+        result = portfolio_risk(snap.submatrix(tickers), tickers, weights, snap.industry_lists)
+    except ValueError as e:
+        return html.Div(f"Could not compute risk: {e}", style={'color': 'red'})
+    return risk_tables(result)
+
+
+# Portfolio risk as JSON, for scripts scoring many candidate portfolios at once
+@app.server.route('/risk', methods=['POST'])
+def risk_endpoint():
+    # Accepts {"tickers": [...], "weights": [[...], ...]} or {"portfolios": [{ticker: weight}, ...]},
+    # optionally with "snapshot": "YYYY-MM-DD"
+    payload = request.get_json(silent=True) or {}
+    try:
+        tickers, weights = parse_risk_request(payload)
+        if not isinstance(payload.get('snapshot'), (str, type(None))):
+            raise ValueError("'snapshot' must be a date string")
+        snap = get_snapshot(payload.get('snapshot'))
+        result = portfolio_risk(snap.submatrix(tickers), tickers, weights, snap.industry_lists)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({key: value.tolist() if isinstance(value, np.ndarray) else value
+                    for key, value in result.items()})
+
+
+# The k most correlated tickers as JSON; ?live=1 reads the matrix row instead of the precomputed index
+@app.server.route('/similar/<ticker>')
+def similar_endpoint(ticker):
+    snap = get_snapshot(request.args.get('snapshot'))
+    try:
+        rows, source = similar_table(snap, ticker, request.args.get('k', 10, type=int),
+                                     live=request.args.get('live') == '1')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'ticker': ticker, 'snapshot': snap.name, 'source': source, 'similar': rows})
+
+
+# Partial correlations or precision matrix of an industry or basket as CSV
+@app.server.route('/download-precision')
+def download_precision():
+    mode = request.args.get('mode', 'partial')
+    snap = get_snapshot(request.args.get('snapshot'))
+    try:
+        tickers, precision = precision_block(
+            snap, request.args.get('industry'), request.args.get('tickers'), request.args.get('ridge', 0)
+        )
+    except ValueError as e:
+        return str(e), 400
+    except np.linalg.LinAlgError:
+        return "The block is not positive definite; increase the ridge.", 400
+    except BudgetExceeded:
+        return app.server.response_class(
+            "The server is busy with other large requests; try the download again shortly.",
+            status=503, mimetype='text/plain', headers={'Retry-After': str(int(memory_budget.timeout))}
+        )
+
+    values = partial_correlations(precision) if mode == 'partial' else precision
+    with metrics.stage('serialize'):
+        csv_string = pd.DataFrame(values, index=tickers, columns=tickers).to_csv(index=True, header=True)
+    name = request.args.get('industry') or 'basket'
+    return app.server.response_class(
+        csv_string,
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{name}_{mode}.csv"'}
+    )
+
+
+def admin_allowed():
+    return ADMIN_TOKEN is None or request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+
+# Request timings, cells sent and cache statistics in the Prometheus text format
+@app.server.route('/metrics')
+def metrics_endpoint():
+    return app.server.response_class(metrics.exposition(caches, flights, budgets), mimetype='text/plain; version=0.0.4')
+
+
+# Turns request recording on or off without a restart: POST /admin/metrics?enabled=0|1
+@app.server.route('/admin/metrics', methods=['POST'])
+def metrics_toggle_endpoint():
+    if not admin_allowed():
+        return jsonify({'error': 'forbidden'}), 403
+    if 'enabled' in request.args:
+        metrics.set_enabled(request.args.get('enabled') not in ('0', 'false', 'off'))
+    return jsonify({'enabled': metrics.enabled})
+
+
+# Stored request profiles: the list, a capture's pstats file, or ?format=text for a readable report
+@app.server.route('/admin/profiles')
+@app.server.route('/admin/profiles/<capture_id>')
+def profiles_endpoint(capture_id=None):
+    if not admin_allowed():
+        return jsonify({'error': 'forbidden'}), 403
+    if capture_id is None:
+        return jsonify({'profiles': profiling.captures(), 'sample_rate': profiling.PROFILE_SAMPLE_RATE})
+    if request.args.get('format') == 'text':
+        report = profiling.capture_report(capture_id)
+        if report is None:
+            return jsonify({'error': 'unknown profile'}), 404
+        return app.server.response_class(report, mimetype='text/plain')
+    path = profiling.capture_path(capture_id)
+    if path is None:
+        return jsonify({'error': 'unknown profile'}), 404
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f"{capture_id}.prof")
+
+
+# Picks up new or rebuilt snapshots now instead of waiting for the background check
+@app.server.route('/admin/reload', methods=['POST'])
+def reload_endpoint():
+    if not admin_allowed():
+        return jsonify({'error': 'forbidden'}), 403
+    changed = reload_snapshots()
+    return jsonify({
+        'changed': changed,
+        'snapshots': {name: snap.version for name, snap in store.snapshots.items()},
+    })
+
+
+# Verified and total checksum chunks of every served snapshot, and failures; ?verify=1 checks the
+# rest now (in the request, so it can take a while for large snapshots)
+@app.server.route('/admin/integrity')
+def integrity_endpoint():
+    if not admin_allowed():
+        return jsonify({'error': 'forbidden'}), 403
+    report = {}
+    for name, snap in store.snapshots.items():
+        try:
+            if request.args.get('verify') == '1':
+                snap.verify_all()
+            checksums = snap.checksums()
+            verified, total = checksums.status()
+            report[name] = {'verified_chunks': verified, 'chunks': total, 'failed': checksums.failures()}
+        except (OSError, IntegrityError) as e:
+            report[name] = {'error': str(e)}
+    return jsonify(report)
 
 
 # Callback to generate CSV file for download
 @app.server.route('/download/<industry>')
-def download_csv(industry):
-    # Generate CSV for the selected industry
-    tickers = industry_lists.get(industry)
-    if tickers:
-        submatrix = sigma_sorted.loc[tickers, tickers]
-        # Convert to CSV
-        csv_string = submatrix.to_csv(index=True, header=True)
+@app.server.route('/download/<industry>/<col_industry>')
+def download_csv(industry, col_industry=None):
+    # Generate CSV for the selected industry, or for a cross-industry block
+    snap = get_snapshot(request.args.get('snapshot'))
+    delta = request.args.get('delta') == '1'
+    rows = snap.positions.get(industry)
+    cols = snap.positions.get(col_industry or industry)
+    if rows is not None and cols is not None and len(rows) and len(cols):
+        if delta and store.previous_name(snap.name) is None:
+            return "There is no earlier snapshot to compare with."
+
+        def block_csv():
+            # Downloads are never downsampled: a large block waits for its share of the memory budget
+            with memory_budget.admit(len(rows) * len(cols)):
+                block = heatmap_block(snap, rows, cols, delta)
+                submatrix = pd.DataFrame(block, index=snap.tickers[rows], columns=snap.tickers[cols])
+                # Convert to CSV
+                with metrics.stage('serialize'):
+                    return submatrix.to_csv(index=True, header=True)
+
+        # Concurrent downloads of the same block share one CSV
+        try:
+            csv_string = download_flight.do(('csv', data_versions(snap, delta), industry, col_industry),
+                                            block_csv)
+        except BudgetExceeded:
+            return app.server.response_class(
+                "The server is busy with other large requests; try the download again shortly.",
+                status=503, mimetype='text/plain', headers={'Retry-After': str(int(memory_budget.timeout))}
+            )
+        except IntegrityError as e:
+            print(e)
+            return app.server.response_class("The stored data of this block failed its integrity check.",
+                                             status=500, mimetype='text/plain')
 
+        name = industry if col_industry is None else f"{industry} x {col_industry}"
         # Create response with CSV content
         response = app.server.response_class(
             csv_string,
             mimetype='text/csv',
-            content_disposition=f'attachment; filename={industry}_covariance_matrix.csv'
+            headers={'Content-Disposition': f'attachment; filename="{name}_covariance_matrix.csv"'}
         )
         return response
     return "Industry not found"
@@ -0,0 +1,146 @@
+import os
+import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from build_artifacts import (
+    COVARIANCE_NPY, INDUSTRIES_PKL, SNAPSHOT_DIR, TICKERS_PKL, derive_artifacts, publish_snapshot, staging_folder,
+    write_manifest
+)
+from covariance_store import SnapshotStore
+
+# Last `window` return vectors of a rolling-window snapshot, needed to drop the oldest ones later
+RETURNS_WINDOW_PKL = "returns_window.pkl"
+
+# RiskMetrics decay for daily returns
+DEFAULT_DECAY = 0.94
+
+
+def low_rank_update(values, observations, weights, scale, block_rows=512, max_workers=None):
+    """
+    Updates a (memory-mapped) covariance matrix in place: values = scale * values + R' diag(weights) R.
+
+    Bands of rows are updated on a thread pool (NumPy releases the GIL in the matrix products), so
+    with k observations the whole update costs O(n^2 k) and never holds more than a few bands in memory.
+
+    Parameters:
+    - values: n x n matrix, e.g. np.load(..., mmap_mode='r+')
+    - observations: k x n array R of return vectors
+    - weights: Length-k weight of each observation (negative to remove an observation)
+    - scale: Factor applied to the existing matrix first
+    - block_rows: Rows per band
+    - max_workers: Size of the thread pool (defaults to the number of CPUs)
+    """
+    n = values.shape[0]
+    weighted = observations * np.asarray(weights, dtype=float)[:, None]
+
+    def update_band(start):
+        stop = min(start + block_rows, n)
+        band = np.array(values[start:stop]) * scale
+        band += weighted[:, start:stop].T @ observations
+        values[start:stop] = band
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        list(pool.map(update_band, range(0, n, block_rows)))
+    if hasattr(values, 'flush'):
+        values.flush()
+
+
+def ewma_update(values, returns, decay=DEFAULT_DECAY, **kwargs):
+    """
+    Exponentially weighted update with k new (zero-mean) return vectors, oldest first:
+    S = decay^k S + sum_t (1 - decay) decay^(k-1-t) r_t r_t'.
+    """
+    k = len(returns)
+    weights = (1 - decay) * decay ** np.arange(k - 1, -1, -1)
+    low_rank_update(values, returns, weights, decay ** k, **kwargs)
+
+
+def rolling_update(values, new_returns, dropped_returns, window, **kwargs):
+    """
+    Rolling-window update of S = (1/window) sum r_t r_t': adds the new return vectors and removes
+    the ones that fall out of the window, as one rank-(k + dropped) update.
+    """
+    observations = np.vstack([new_returns, dropped_returns])
+    weights = np.concatenate([np.full(len(new_returns), 1.0 / window),
+                              np.full(len(dropped_returns), -1.0 / window)])
+    low_rank_update(values, observations, weights, 1.0, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Update the latest covariance snapshot with new daily returns, writing a new snapshot."
+    )
+    parser.add_argument('returns', help="CSV of returns: one row per day (oldest first), one column per ticker")
+    parser.add_argument('--date', help="Name of the new snapshot (default: last date in the CSV)")
+    parser.add_argument('--base', help="Snapshot to update (default: the latest)")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--method', choices=['ewma', 'rolling'], default='ewma')
+    parser.add_argument('--decay', type=float, default=DEFAULT_DECAY, help="EWMA decay per observation")
+    parser.add_argument('--window', type=int, help="Rolling window length in observations")
+    parser.add_argument('--history', help="CSV of the returns in the base snapshot's window, for the first "
+                                          "rolling update of a snapshot without a saved window")
+    parser.add_argument('--workers', type=int, help="Threads used for the update (default: all CPUs)")
+    parser.add_argument('--no-eigen', action='store_true',
+                        help="Skip the per-industry eigendecompositions (not O(n^2 k)); the Factor Structure "
+                             "view is then unavailable for the new snapshot")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.snapshot_dir)
+    base = store.get(args.base)
+    returns = pd.read_csv(args.returns, index_col=0)
+    missing = base.tickers.difference(returns.columns)
+    if len(missing):
+        print(f"{len(missing)} tickers have no returns in '{args.returns}'; using 0 for them")
+    returns = returns.reindex(columns=base.tickers).fillna(0.0)
+    name = args.date or str(returns.index[-1])
+    path = os.path.join(args.snapshot_dir, name)
+    if os.path.exists(path):
+        raise SystemExit(f"Snapshot '{path}' already exists")
+
+    window = None
+    if args.method == 'rolling':
+        window_file = os.path.join(base.path, RETURNS_WINDOW_PKL)
+        if args.history:
+            history = pd.read_csv(args.history, index_col=0)
+        elif os.path.exists(window_file):
+            history = pd.read_pickle(window_file)
+        else:
+            raise SystemExit(f"Rolling updates need --history or a '{RETURNS_WINDOW_PKL}' in the base snapshot")
+        if not args.window:
+            raise SystemExit("Rolling updates need --window")
+        history = history.reindex(columns=base.tickers).fillna(0.0)
+        window = pd.concat([history, returns])
+        dropped = window.iloc[:max(len(window) - args.window, 0)]
+        window = window.iloc[len(dropped):]
+
+    if not os.path.exists(os.path.join(base.path, COVARIANCE_NPY)):
+        raise SystemExit(f"Snapshot '{base.name}' is stored as a factor model; updates need a dense base")
+    # The new snapshot starts as a copy of the base and is updated in place through a memory map, in a
+    # staging folder that is renamed into place once its artifacts and checksums are written
+    staging = staging_folder(path)
+    for file_name in (COVARIANCE_NPY, TICKERS_PKL, INDUSTRIES_PKL):
+        shutil.copyfile(os.path.join(base.path, file_name), os.path.join(staging, file_name))
+    values = np.load(os.path.join(staging, COVARIANCE_NPY), mmap_mode='r+')
+    if args.method == 'ewma':
+        ewma_update(values, returns.to_numpy(), args.decay, max_workers=args.workers)
+    else:
+        rolling_update(values, returns.to_numpy(), dropped.to_numpy(), args.window, max_workers=args.workers)
+        window.to_pickle(os.path.join(staging, RETURNS_WINDOW_PKL))
+
+    manifest = write_manifest(
+        staging, base.tickers, values,
+        name=name,
+        updated_from=base.name,
+        update={'method': args.method, 'observations': len(returns)},
+    )
+    del values
+    print(f"Snapshot '{path}' updated from '{base.name}' with {len(returns)} observations "
+          f"(version {manifest['version']})")
+    derive_artifacts(staging, with_eigen=not args.no_eigen)
+    publish_snapshot(staging, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import os
+import json
+import mmap
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+# Checksums of every file of a snapshot folder, written by the build next to manifest.json
+INTEGRITY_FILE = "integrity.json"
+
+# Files are checksummed in chunks of this many bytes, so a block can be verified without the rest
+CHUNK_BYTES = 4 * 2**20
+
+# Largest |S_ij - S_ji| / sqrt(S_ii S_jj) accepted as symmetric (matrix products round differently)
+SYMMETRY_TOLERANCE = 1e-8
+
+
+class IntegrityError(ValueError):
+    """Raised when snapshot files are corrupt, inconsistent or do not match their checksums."""
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_checksums(file, chunk_bytes=CHUNK_BYTES):
+    # One digest per chunk of the file's bytes, read one chunk at a time
+    chunks = []
+    with open(file, "rb") as f:
+        while True:
+            data = f.read(chunk_bytes)
+            if not data:
+                break
+            chunks.append(_digest(data))
+    return {'size': os.path.getsize(file), 'chunks': chunks}
+
+
+def check_matrix(values, tickers, industry_lists, block_rows=1024):
+    """
+    Checks that a covariance matrix can be served, reading it one block_rows x block_rows tile
+    (and its mirror tile) at a time: every cell finite, every variance positive, the matrix
+    symmetric, the tickers unique, and every industry's tickers in the matrix in the order of its
+    (sorted) list.
+
+    Raises IntegrityError naming every failed check. Returns the largest asymmetry found, in
+    correlation units.
+    """
+    n = len(tickers)
+    index = pd.Index(tickers)
+    problems = []
+    if values.shape != (n, n):
+        problems.append(f"matrix shape {values.shape} does not match {n} tickers")
+        raise IntegrityError('; '.join(problems))
+    if not index.is_unique:
+        problems.append(f"{int(index.duplicated().sum())} duplicate tickers")
+    for industry, members in industry_lists.items():
+        found = index.get_indexer(members)
+        found = found[found >= 0]
+        if np.any(np.diff(found) <= 0):
+            problems.append(f"tickers of '{industry}' are not in list order")
+
+    diagonal = np.asarray(values.diagonal(), dtype=float)
+    bad = ~(np.isfinite(diagonal) & (diagonal > 0))
+    if bad.any():
+        problems.append(f"{int(bad.sum())} variances are not finite and positive (first: {index[np.argmax(bad)]})")
+        raise IntegrityError('; '.join(problems))
+    std = np.sqrt(diagonal)
+
+    non_finite, asymmetry = 0, 0.0
+    for i in range(0, n, block_rows):
+        rows = slice(i, min(i + block_rows, n))
+        for j in range(i, n, block_rows):
+            cols = slice(j, min(j + block_rows, n))
+            tile = np.asarray(values[rows, cols], dtype=float)
+            mirror = tile if i == j else np.asarray(values[cols, rows], dtype=float)
+            non_finite += int((~np.isfinite(tile)).sum()) + (0 if i == j else int((~np.isfinite(mirror)).sum()))
+            with np.errstate(invalid='ignore'):
+                gap = np.abs(tile - mirror.T) / np.outer(std[rows], std[cols])
+            asymmetry = max(asymmetry, float(np.nanmax(gap)) if np.isfinite(gap).any() else 0.0)
+    if non_finite:
+        problems.append(f"{non_finite} cells are not finite")
+    if asymmetry > SYMMETRY_TOLERANCE:
+        problems.append(f"matrix is not symmetric (largest gap {asymmetry:.3g} in correlation)")
+    if problems:
+        raise IntegrityError('; '.join(problems))
+    return asymmetry
+
+
+def write_json(file, data, indent=None):
+    """
+    Writes data as JSON to a temporary file next to file and renames it into place, so readers (and
+    a crash half way) see either the old or the new file, never a partial one.
+    """
+    fd, temporary = tempfile.mkstemp(prefix=os.path.basename(file) + '.', suffix='.partial',
+                                     dir=os.path.dirname(os.path.abspath(file)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=indent)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, file)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def write_integrity(path, version, chunk_bytes=CHUNK_BYTES, rebuilt=(), **checks):
+    """
+    Writes integrity.json: per-chunk checksums of every file of a snapshot folder, tied to the
+    manifest's data version, plus the results of the build's checks. Without checks, those of the
+    previous integrity.json of the same version are kept (for files repacked after the build).
+
+    Files named in rebuilt are about to be replaced by a packed encoding that the app rebuilds them
+    from; their checksums are kept under 'rebuilt' (also by later calls of the same version), so a
+    rebuilt file can be verified against the exact bytes it had.
+
+    Returns the number of checksummed bytes.
+    """
+    integrity_file = os.path.join(path, INTEGRITY_FILE)
+    previous = {}
+    if os.path.exists(integrity_file):
+        with open(integrity_file) as f:
+            previous = json.load(f)
+        if previous['version'] != version:
+            previous = {}
+    if not checks:
+        checks = previous.get('checks', {})
+    rebuilt_files = dict(previous.get('rebuilt', {}))
+    files = {}
+    for name in sorted(os.listdir(path)):
+        file = os.path.join(path, name)
+        if name == INTEGRITY_FILE or name.endswith(('.partial', '.lock')) or not os.path.isfile(file):
+            continue
+        if name in rebuilt:
+            rebuilt_files[name] = file_checksums(file, chunk_bytes)
+        elif name not in rebuilt_files:
+            files[name] = file_checksums(file, chunk_bytes)
+    write_json(integrity_file, {'version': version, 'chunk_bytes': chunk_bytes, 'checks': checks, 'files': files,
+                                'rebuilt': rebuilt_files}, indent=1)
+    return sum(entry['size'] for entry in files.values())
+
+
+def _span(index, n):
+    # Positions selected by a slice or an array of positions
+    if isinstance(index, slice):
+        return np.arange(*index.indices(n), dtype=np.int64)
+    return np.asarray(index, dtype=np.int64).ravel()
+
+
+class Checksums:
+    """
+    Verifies a snapshot's files against its integrity.json, one chunk at a time and each chunk
+    only once. Requests verify the chunks they read on first access; verify_all checks the rest,
+    e.g. from a background thread. A chunk that failed keeps failing without being read again.
+
+    Files the build did not checksum (and snapshots built without integrity.json) pass unchecked.
+    A file rebuilt from a packed encoding is checked against the checksums it had before packing
+    once it is included (see include).
+    Chunks of a file the snapshot has memory-mapped (see attach) are read from the mapping, so
+    they are the bytes requests see, even after packing has replaced or removed the file.
+
+    Parameters:
+    - path: Snapshot folder
+    - version: Data version of the snapshot's manifest; checksums of another version are refused
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.name = os.path.basename(path.rstrip(os.sep))
+        integrity_file = os.path.join(path, INTEGRITY_FILE)
+        self.files = {}
+        self.rebuilt = {}
+        self.chunk_bytes = CHUNK_BYTES
+        # False for a snapshot without integrity.json, whose files all pass unchecked
+        self.found = os.path.exists(integrity_file)
+        if self.found:
+            with open(integrity_file) as f:
+                integrity = json.load(f)
+            if integrity['version'] != version:
+                raise IntegrityError(f"Snapshot '{self.name}': checksums are of version {integrity['version']}, "
+                                     f"not {version}")
+            self.files = integrity['files']
+            self.rebuilt = integrity.get('rebuilt', {})
+            self.chunk_bytes = integrity['chunk_bytes']
+        self._verified = {name: np.zeros(len(entry['chunks']), dtype=bool) for name, entry in self.files.items()}
+        self._failed = {}
+        self._mapped = {}
+        self._lock = threading.Lock()
+
+    def include(self, name, verified=False):
+        """
+        Checks file name, rebuilt from a packed encoding, against its checksums from before packing
+        from now on; verified marks it as already checked in full (see check_rebuilt).
+        """
+        with self._lock:
+            if name in self.rebuilt and name not in self.files:
+                self.files[name] = self.rebuilt[name]
+                self._verified[name] = np.full(len(self.rebuilt[name]['chunks']), verified)
+
+    def check_rebuilt(self, name, file):
+        """
+        Raises IntegrityError unless file, a rebuilt copy of file name not yet in place, has exactly
+        the bytes name had before packing. Returns False if there are no such checksums to compare.
+        """
+        if name not in self.rebuilt:
+            return False
+        if file_checksums(file, self.chunk_bytes) != self.rebuilt[name]:
+            raise IntegrityError(f"Snapshot '{self.name}': rebuilt {name} does not match its checksums")
+        return True
+
+    def attach(self, name, array):
+        """Reads the chunks of file name from the memory map array instead of the file."""
+        mapping = array
+        while isinstance(mapping, np.ndarray):
+            mapping = mapping.base
+        # np.memmap maps the file from the allocation boundary below the array's offset
+        start = array.offset - array.offset % mmap.ALLOCATIONGRANULARITY
+        if isinstance(mapping, mmap.mmap) and start == 0:
+            self._mapped[name] = mapping
+
+    def verify_file(self, name):
+        """Verifies every chunk of one file."""
+        if name in self.files:
+            self._verify_chunks(name, np.arange(len(self.files[name]['chunks'])))
+
+    def verify_spans(self, name, starts, stops):
+        """Verifies the chunks of a file overlapping the byte ranges [starts[i], stops[i])."""
+        if name not in self.files:
+            return
+        starts, stops = np.atleast_1d(starts).astype(np.int64), np.atleast_1d(stops).astype(np.int64)
+        keep = stops > starts
+        first, last = starts[keep] // self.chunk_bytes, (stops[keep] - 1) // self.chunk_bytes
+        counts = last - first + 1
+        # first[i], first[i] + 1, ..., last[i] for every span, without a Python loop
+        chunks = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        self._verify_chunks(name, np.unique(chunks))
+
+    def verify_block(self, name, array, rows, cols):
+        """
+        Verifies the chunks holding a block of a C-ordered 2-D array memory-mapped from file name.
+        Rows and columns are each a slice or an array of positions; every row is checked from its
+        first to its last column.
+        """
+        if name not in self.files:
+            return
+        rows, cols = _span(rows, array.shape[0]), _span(cols, array.shape[1])
+        if not len(rows) or not len(cols):
+            return
+        starts = array.offset + rows * array.strides[0] + cols.min() * array.strides[1]
+        self.verify_spans(name, starts, starts + (cols.max() - cols.min() + 1) * array.strides[1])
+
+    def verify_all(self):
+        """
+        Verifies every chunk not verified yet, file after file; returns the number of bytes read.
+        Raises the first IntegrityError once every file was checked.
+        """
+        read, errors = 0, []
+        for name, verified in list(self._verified.items()):
+            pending = np.flatnonzero(~verified)
+            try:
+                self._verify_chunks(name, pending)
+            except IntegrityError as e:
+                errors.append(e)
+            read += int(min(len(pending) * self.chunk_bytes, self.files[name]['size']))
+        if errors:
+            raise errors[0]
+        return read
+
+    def failures(self):
+        # Files with chunks that did not match, and how many
+        return {name: len(chunks) for name, chunks in self._failed.items()}
+
+    def status(self):
+        # Verified and total chunks over all files
+        verified = list(self._verified.values())
+        return sum(int(chunks.sum()) for chunks in verified), sum(len(chunks) for chunks in verified)
+
+    def _verify_chunks(self, name, chunks):
+        entry, verified = self.files[name], self._verified[name]
+        if name in self._failed and np.isin(chunks, self._failed[name]).any():
+            raise self._error(name, self._failed[name])
+        pending = chunks[~verified[chunks]]
+        if not len(pending):
+            return
+        mapping = self._mapped.get(name)
+        try:
+            size = len(mapping) if mapping is not None else os.path.getsize(os.path.join(self.path, name))
+            if size != entry['size']:
+                self._failed[name] = np.arange(len(entry['chunks']))
+                raise IntegrityError(f"Snapshot '{self.name}': {name} has {size} bytes, expected {entry['size']}")
+            if mapping is not None:
+                digests = [_digest(mapping[chunk * self.chunk_bytes:(chunk + 1) * self.chunk_bytes])
+                           for chunk in pending.tolist()]
+            else:
+                with open(os.path.join(self.path, name), "rb") as f:
+                    digests = []
+                    for chunk in pending.tolist():
+                        f.seek(chunk * self.chunk_bytes)
+                        digests.append(_digest(f.read(self.chunk_bytes)))
+        except OSError as e:
+            # Missing or unreadable, e.g. removed by packing while the snapshot was not open
+            raise IntegrityError(f"Snapshot '{self.name}': cannot read {name}: {e}") from e
+        failed = [chunk for chunk, digest in zip(pending, digests) if digest != entry['chunks'][chunk]]
+        with self._lock:
+            verified[np.setdiff1d(pending, failed)] = True
+            if failed:
+                self._failed[name] = np.union1d(self._failed.get(name, []), failed).astype(np.int64)
+        if failed:
+            raise self._error(name, failed)
+
+    def _error(self, name, chunks):
+        start = int(chunks[0]) * self.chunk_bytes
+        return IntegrityError(f"Snapshot '{self.name}': {name} does not match its checksums "
+                              f"({len(chunks)} chunk(s) of {self.chunk_bytes} bytes, first at byte {start})")
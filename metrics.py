@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import fcntl
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+from flask import g, has_request_context
+
+# Recording can be switched off at startup (METRICS=0) or at runtime through set_enabled()
+enabled = os.environ.get("METRICS", "1") != "0"
+
+# Background jobs run in their own processes; their records are appended here and added to the
+# server's metrics on the next scrape
+JOB_SPOOL = os.environ.get("METRICS_JOB_SPOOL", os.path.join("cache", "metrics", "jobs.jsonl"))
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'heatmap_requests_total': ('counter', "Requests by callback or route and status code", None),
+    'heatmap_request_seconds': ('histogram', "Total request time by callback or route", TIME_BUCKETS),
+    'heatmap_stage_seconds': ('histogram', "Time per request spent in each stage (extract, figure, "
+                                           "serialize, other)", TIME_BUCKETS),
+    'heatmap_response_bytes': ('histogram', "Response body size by callback or route", BYTE_BUCKETS),
+    'heatmap_cells_sent_total': ('counter', "Matrix cells read for a response, by callback or route", None),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+# Timing state of the background job running in this thread (see job)
+_job = threading.local()
+
+
+def set_enabled(value):
+    global enabled
+    enabled = bool(value)
+
+
+def inc(name, labels, value=1):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    key = (name, tuple(sorted(labels.items())))
+    buckets = METRICS[name][2]
+    with _lock:
+        counts = _histograms.get(key)
+        if counts is None:
+            # One count per bucket plus +Inf, then the sum
+            counts = _histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+
+def _current():
+    # Timing state of the request being served or the job being run, or None outside both
+    if not enabled:
+        return None
+    if not has_request_context():
+        return getattr(_job, 'state', None)
+    return g.get('metrics')
+
+
+def _new_state(handler):
+    return {'handler': handler, 'start': time.perf_counter(), 'stages': {}, 'stack': [], 'cells': 0}
+
+
+def _record(handler, status, total, stages, cells, nbytes=None):
+    labels = {'handler': handler}
+    inc('heatmap_requests_total', {**labels, 'status': str(status)})
+    observe('heatmap_request_seconds', labels, total)
+    for stage_name, seconds in stages.items():
+        observe('heatmap_stage_seconds', {**labels, 'stage': stage_name}, seconds)
+    if nbytes is not None:
+        observe('heatmap_response_bytes', labels, nbytes)
+    if cells:
+        inc('heatmap_cells_sent_total', labels, cells)
+
+
+def start_request(handler):
+    if enabled:
+        g.metrics = _new_state(handler)
+
+
+def finish_request(status, nbytes, residual='other'):
+    """
+    Records the request started by start_request. Time outside the marked stages is booked to
+    residual: for Dash callbacks that is mostly the JSON encoding of the returned figure.
+    """
+    state = _current()
+    if state is None:
+        return
+    total = time.perf_counter() - state['start']
+    stages = state['stages']
+    stages[residual] = stages.get(residual, 0.0) + max(0.0, total - sum(stages.values()))
+    _record(state['handler'], status, total, stages, state['cells'], nbytes)
+
+
+@contextmanager
+def job(handler):
+    """
+    Records a background job, which runs in a worker process without a request, like a request
+    labelled handler: stage() and add_cells() inside it are booked to the job. The record is
+    appended to JOB_SPOOL and reaches /metrics when the server next builds the exposition. Inside
+    a request (a callback run without a job manager) the request records everything as usual.
+    """
+    if not enabled or has_request_context():
+        yield
+        return
+    state = _job.state = _new_state(handler)
+    status = 200
+    try:
+        yield
+    except Exception:
+        status = 500
+        raise
+    finally:
+        _job.state = None
+        total = time.perf_counter() - state['start']
+        stages = state['stages']
+        stages['other'] = stages.get('other', 0.0) + max(0.0, total - sum(stages.values()))
+        record = {'handler': handler, 'status': status, 'total': total, 'stages': stages, 'cells': state['cells']}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(JOB_SPOOL)), exist_ok=True)
+            with open(JOB_SPOOL, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            print(f"Could not record job metrics: {e}")
+
+
+def collect_jobs():
+    # Adds the records background jobs spooled since the last call, and empties the spool
+    try:
+        with open(JOB_SPOOL, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            lines = f.read().splitlines()
+            f.seek(0)
+            f.truncate()
+    except FileNotFoundError:
+        return
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        _record(record['handler'], record['status'], record['total'], record['stages'], record['cells'])
+
+
+@contextmanager
+def stage(name):
+    """
+    Books the time spent in the block to the named stage of the current request. Stages nest:
+    time in an inner stage is not counted again in the outer one.
+    """
+    state = _current()
+    if state is None:
+        yield
+        return
+    stack, stages = state['stack'], state['stages']
+    now = time.perf_counter()
+    if stack:
+        outer = stack[-1]
+        stages[outer[0]] = stages.get(outer[0], 0.0) + now - outer[1]
+    stack.append([name, now])
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        inner = stack.pop()
+        stages[name] = stages.get(name, 0.0) + now - inner[1]
+        if stack:
+            stack[-1][1] = now
+
+
+def timed(name):
+    """Decorator running the whole function in stage(name)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_cells(count):
+    state = _current()
+    if state is not None:
+        state['cells'] += int(count)
+
+
+def _format_labels(labels):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}' if labels else ''
+
+
+def exposition(caches=(), flights=(), budgets=()):
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+
+    Parameters:
+    - caches: BlockCache instances whose statistics are reported as well
+    - flights: SingleFlight instances whose computed and shared call counts are reported
+    - budgets: admission.Budget instances whose admissions, rejections and degraded renders are reported
+    """
+    collect_jobs()
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(counts) for key, counts in _histograms.items()}
+    lines = ['# HELP heatmap_metrics_enabled Whether requests are currently being recorded',
+             '# TYPE heatmap_metrics_enabled gauge',
+             f'heatmap_metrics_enabled {int(enabled)}']
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            continue
+        for (metric, labels), counts in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {counts[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+    cache_metrics = [
+        ('heatmap_cache_hits_total', 'counter', "Cache lookups that found a result", 'hits'),
+        ('heatmap_cache_misses_total', 'counter', "Cache lookups that had to compute the result", 'misses'),
+        ('heatmap_cache_entries', 'gauge', "Results currently cached", 'entries'),
+        ('heatmap_cache_bytes', 'gauge', "Bytes held by cached results", 'bytes'),
+    ]
+    stats = [cache.stats() for cache in caches]
+    for name, kind, help_text, field in cache_metrics:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        lines += [f'{name}{_format_labels((("cache", s["name"]),))} {s[field]}' for s in stats]
+
+    lines += ['# HELP heatmap_single_flight_calls_total Coalesced calls that computed a result or shared '
+              'one already in flight',
+              '# TYPE heatmap_single_flight_calls_total counter']
+    for s in (flight.stats() for flight in flights):
+        for result in ('computed', 'shared'):
+            lines.append(f'heatmap_single_flight_calls_total'
+                         f'{_format_labels((("name", s["name"]), ("result", result)))} {s[result]}')
+
+    budget_metrics = [
+        ('heatmap_budget_admissions_total', 'counter', "Heavy requests that got memory, by whether they "
+                                                       "had to queue for it", None),
+        ('heatmap_budget_rejections_total', 'counter', "Requests turned away after waiting for memory",
+         'rejected'),
+        ('heatmap_budget_degraded_total', 'counter', "Heatmaps shown downsampled because they exceed one "
+                                                     "request's memory", 'degraded'),
+        ('heatmap_budget_slots', 'gauge', "Memory slots shared by the server's processes", 'slots'),
+        ('heatmap_budget_slot_bytes', 'gauge', "Memory per slot", 'slot_bytes'),
+    ]
+    stats = [budget.stats() for budget in budgets]
+    for name, kind, help_text, field in budget_metrics:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for s in stats:
+            if field is None:
+                for queued, counter in (('false', 'admitted'), ('true', 'waited')):
+                    lines.append(f'{name}{_format_labels((("budget", s["name"]), ("queued", queued)))} '
+                                 f'{s[counter]}')
+            else:
+                lines.append(f'{name}{_format_labels((("budget", s["name"]),))} {s[field]}')
+    return '\n'.join(lines) + '\n'
@@ -1,5 +1,41 @@
+import os
+import re
+import json
+import html
+import hashlib
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import plotly
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from build_artifacts import SNAPSHOT_DIR
+from covariance_store import SnapshotStore, open_matrix
+
+# Colour scales offered by the app
+COLOR_SCALES = ['Viridis', 'Cividis', 'Blues', 'YlGnBu', 'RdBu']
+
+# Bump when the look of exported reports changes, so unchanged blocks are rendered again
+REPORT_FORMAT = 1
+REPORT_MANIFEST = "report_manifest.json"
+
+RESET_ZOOM_MENU = dict(
+    type="buttons",
+    direction="left",
+    buttons=[dict(
+        args=[{'xaxis.autorange': True, 'yaxis.autorange': True}],
+        label="Reset Zoom",
+        method="relayout"
+    )],
+    pad={"r": 10, "t": 10},
+    showactive=False,
+    x=0.15,
+    xanchor="left",
+    y=1.15,
+    yanchor="top"
+)
+
 
 def plot_industries_with_zoom(industries, industry_tickers, covariance_matrix, vmin, vmax):
     """
@@ -48,25 +84,223 @@ def plot_industries_with_zoom(industries, industry_tickers, covariance_matrix, v
         showlegend=False,
         autosize=False,  # Disable automatic resizing
         margin=dict(t=50, b=50, l=50, r=50),  # Set margins to avoid clipping
-        updatemenus=[dict(
-            type="buttons",
-            direction="left",
-            buttons=[dict(
-                args=[{'xaxis.autorange': True, 'yaxis.autorange': True}],
-                label="Reset Zoom",
-                method="relayout"
-            )],
-            pad={"r": 10, "t": 10},
-            showactive=False,
-            x=0.15,
-            xanchor="left",
-            y=1.15,
-            yanchor="top"
-        )]
+        updatemenus=[RESET_ZOOM_MENU]
     )
 
     fig.show()
 
+
+def block_figure(title, row_tickers, col_tickers, block, vmin, vmax, colorscale='Viridis'):
+    """
+    A single zoomable heatmap of one industry or cross-industry block, as exported to the report site.
+
+    Parameters:
+    - title: Figure title
+    - row_tickers, col_tickers: Labels of the rows and columns of the block
+    - block: Covariance values (2-D array)
+    - vmin, vmax: Limits of the color scale
+    - colorscale: Plotly color scale name
+    """
+    fig = go.Figure(
+        go.Heatmap(
+            z=block,
+            x=col_tickers,
+            y=row_tickers,
+            colorscale=colorscale,
+            zmin=vmin,
+            zmax=vmax,
+            colorbar=dict(title='Covariance')
+        )
+    )
+    fig.update_layout(
+        title=title,
+        width=1000, height=1000,
+        dragmode='zoom',
+        autosize=False,
+        margin=dict(t=50, b=50, l=50, r=50),
+        updatemenus=[RESET_ZOOM_MENU]
+    )
+    return fig
+
+
+def slug(name):
+    return re.sub(r'[^A-Za-z0-9]+', '-', name).strip('-').lower() or 'industry'
+
+
+def _export_block(snapshot_path, job, previous_hashes, out_dir):
+    # Runs in a pool worker: reads and hashes only this block of the memory-mapped (or factor-stored)
+    # matrix, once, and renders it in every colour scale whose content hash differs from the previous
+    # export or whose files are missing. Returns {report name: (content hash, rendered)}
+    values = open_matrix(snapshot_path)
+    block = np.ascontiguousarray(values[np.ix_(job['rows'], job['cols'])])
+    block_digest = hashlib.sha256(block.tobytes())
+    results = {}
+    for report in job['reports']:
+        digest = block_digest.copy()
+        digest.update(json.dumps([REPORT_FORMAT, plotly.__version__, job['title'], job['row_tickers'],
+                                  job['col_tickers'], job['vmin'], job['vmax'], report['colorscale']]).encode())
+        content_hash = digest.hexdigest()
+        files = [os.path.join(out_dir, f"{report['name']}.{fmt}") for fmt in job['formats']]
+        if content_hash == previous_hashes.get(report['name']) and all(os.path.exists(path) for path in files):
+            results[report['name']] = content_hash, False
+            continue
+
+        fig = block_figure(job['title'], job['row_tickers'], job['col_tickers'], block, job['vmin'], job['vmax'],
+                           report['colorscale'])
+        for fmt, path in zip(job['formats'], files):
+            if fmt == 'html':
+                # plotly.min.js is written once next to the reports instead of into every file
+                fig.write_html(path, include_plotlyjs='directory')
+            else:
+                fig.write_image(path, format=fmt)
+        results[report['name']] = content_hash, True
+    return results
+
+
+def report_jobs(snap, pairs=(), color_scales=COLOR_SCALES, formats=('html',)):
+    """
+    One export job per industry block and cross-industry pair, with a report per colour scale.
+    Report names are made from the industries' names; names that would collide get a numbered suffix.
+
+    Parameters:
+    - snap: Opened covariance_store.Snapshot
+    - pairs: (row industry, column industry) blocks to export besides the industries themselves
+    - color_scales: Plotly colour scale names
+    - formats: 'html' and/or image formats supported by plotly's write_image ('png', 'svg', ...)
+    """
+    blocks = [(industry, industry) for industry, pos in snap.positions.items() if len(pos)]
+    blocks += [tuple(pair) for pair in pairs]
+    jobs, used = [], set()
+    for row_industry, col_industry in blocks:
+        rows, cols = snap.positions[row_industry], snap.positions[col_industry]
+        if row_industry == col_industry:
+            title, base = row_industry, slug(row_industry)
+        else:
+            title, base = f"{row_industry} x {col_industry}", f"{slug(row_industry)}__{slug(col_industry)}"
+        name, suffix = base, 1
+        while name in used:
+            suffix += 1
+            name = f"{base}-{suffix}"
+        used.add(name)
+        jobs.append({
+            'title': title,
+            'rows': rows,
+            'cols': cols,
+            'row_tickers': snap.tickers[rows].tolist(),
+            'col_tickers': snap.tickers[cols].tolist(),
+            'vmin': snap.vmin,
+            'vmax': snap.vmax,
+            'reports': [{'name': f"{name}_{colorscale.lower()}", 'colorscale': colorscale}
+                        for colorscale in color_scales],
+            'formats': list(formats),
+        })
+    return jobs
+
+
+def export_reports(snap, out_dir, pairs=(), color_scales=COLOR_SCALES, formats=('html',), max_workers=None):
+    """
+    Renders heatmap reports of a snapshot to standalone files and writes an index page linking them.
+
+    Blocks are rendered in a process pool. Every worker memory-maps the snapshot's matrix and reads
+    only its own block, once for all colour scales, so only positions and labels are sent to it. A
+    report whose content hash (values, labels and colour settings) matches the previous export is
+    not rendered again.
+
+    Parameters:
+    - snap: Opened covariance_store.Snapshot
+    - out_dir: Folder of the report site
+    - pairs, color_scales, formats: See report_jobs
+    - max_workers: Size of the process pool (default: number of CPUs)
+
+    Returns the numbers of rendered and skipped reports.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_file = os.path.join(out_dir, REPORT_MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            previous = json.load(f)['reports']
+
+    jobs = report_jobs(snap, pairs, color_scales, formats)
+    reports, rendered = {}, 0
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_export_block, snap.path, job,
+                               {report['name']: previous.get(report['name']) for report in job['reports']}, out_dir)
+                   for job in jobs]
+        for future in futures:
+            for name, (content_hash, was_rendered) in future.result().items():
+                reports[name] = content_hash
+                rendered += was_rendered
+
+    with open(manifest_file, "w") as f:
+        json.dump({'snapshot': snap.name, 'version': snap.version, 'reports': reports}, f, indent=2)
+    write_index(snap.name, jobs, out_dir)
+    return rendered, len(reports) - rendered
+
+
+def write_index(snapshot_name, jobs, out_dir):
+    # Static landing page: one row per block, with a link per colour scale and format
+    rows = []
+    for job in jobs:
+        cells = []
+        for report in job['reports']:
+            links = ' '.join(f'<a href="{html.escape(report["name"])}.{fmt}">{fmt}</a>' for fmt in job['formats'])
+            cells.append(f"{html.escape(report['colorscale'])}: {links}")
+        rows.append(f"<tr><td>{html.escape(job['title'])}</td><td>{' &middot; '.join(cells)}</td></tr>")
+    table = '\n'.join(rows)
+    with open(os.path.join(out_dir, "index.html"), "w") as f:
+        f.write(
+            '<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+            f'<title>Industry Covariance Heatmaps {html.escape(snapshot_name)}</title></head>\n'
+            f'<body><h1>Industry Covariance Heatmaps, {html.escape(snapshot_name)}</h1>\n'
+            f'<table>\n{table}\n</table></body></html>\n'
+        )
+
+
+def parse_pair(text):
+    # 'Energy:Technology'
+    row_industry, sep, col_industry = text.partition(':')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected 'ROW INDUSTRY:COLUMN INDUSTRY', got '{text}'")
+    return row_industry.strip(), col_industry.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export static heatmap reports of a covariance snapshot.")
+    parser.add_argument('out_dir', help="Folder of the report site")
+    parser.add_argument('--snapshot', help="Snapshot name, YYYY-MM-DD (default: the latest)")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--pairs', type=parse_pair, nargs='*', default=[],
+                        help="Cross-industry blocks, e.g. 'Energy:Technology'")
+    parser.add_argument('--all-pairs', action='store_true', help="Export every cross-industry block")
+    parser.add_argument('--color-scales', nargs='+', default=COLOR_SCALES)
+    parser.add_argument('--formats', nargs='+', default=['html'],
+                        help="html and/or image formats such as png or svg (images need the kaleido package)")
+    parser.add_argument('--workers', type=int, default=None, help="Processes (default: number of CPUs)")
+    args = parser.parse_args()
+    if any(fmt != 'html' for fmt in args.formats) and importlib.util.find_spec('kaleido') is None:
+        parser.error("Image formats need the kaleido package (pip install kaleido); use --formats html without it")
+
+    store = SnapshotStore(args.snapshot_dir)
+    if not store.names():
+        parser.error(f"No snapshots in '{args.snapshot_dir}'")
+    snap = store.get(args.snapshot)
+    pairs = list(args.pairs)
+    if args.all_pairs:
+        industries = [industry for industry, pos in snap.positions.items() if len(pos)]
+        pairs += [(a, b) for i, a in enumerate(industries) for b in industries[i + 1:]]
+    unknown = {industry for pair in pairs for industry in pair if industry not in snap.positions}
+    if unknown:
+        parser.error(f"Unknown industries: {', '.join(sorted(unknown))}")
+
+    rendered, skipped = export_reports(snap, args.out_dir, pairs, args.color_scales, args.formats, args.workers)
+    print(f"Reports of snapshot '{snap.name}' written to '{args.out_dir}': {rendered} rendered, "
+          f"{skipped} unchanged")
+
+
+if __name__ == "__main__":
+    main()
+
     
     
 # # Example usage
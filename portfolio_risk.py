@@ -0,0 +1,111 @@
+import io
+import numpy as np
+import pandas as pd
+
+
+def parse_portfolios(text):
+    """
+    Reads portfolios from CSV text: a header row of tickers and one row of weights per portfolio.
+
+    Returns the list of tickers and a (portfolios x tickers) weight array. Missing weights count as 0.
+    """
+    frame = pd.read_csv(io.StringIO(text.strip()), skipinitialspace=True)
+    frame.columns = [str(column).strip() for column in frame.columns]
+    weights = frame.apply(pd.to_numeric, errors='raise').fillna(0.0)
+    return list(weights.columns), weights.to_numpy(dtype=float)
+
+
+def parse_risk_request(payload):
+    """
+    Reads portfolios from a /risk request body: {"tickers": [...], "weights": [...]} with one weight vector or a
+    list of them, or {"portfolios": [{ticker: weight}, ...]}.
+
+    Returns the list of tickers and a weight array; raises ValueError for anything else.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Expected a JSON object")
+    if 'portfolios' in payload:
+        portfolios = payload['portfolios']
+        if not isinstance(portfolios, list) or not all(isinstance(p, dict) for p in portfolios):
+            raise ValueError("'portfolios' must be a list of {ticker: weight} objects")
+        # Tickers in order of first appearance; a portfolio without a ticker holds none of it
+        tickers = list(dict.fromkeys(ticker for portfolio in portfolios for ticker in portfolio))
+        weights = [[portfolio.get(ticker, 0.0) for ticker in tickers] for portfolio in portfolios]
+    else:
+        tickers, weights = payload.get('tickers', []), payload.get('weights', [])
+    if not isinstance(tickers, list) or not all(isinstance(ticker, str) for ticker in tickers):
+        raise ValueError("'tickers' must be a list of ticker strings")
+
+    message = "'weights' must be a list of numbers or a list of equally long lists of numbers"
+    if not isinstance(weights, list):
+        raise ValueError(message)
+    try:
+        values = np.asarray(weights, dtype=object)
+    except ValueError:
+        raise ValueError(message) from None
+    if values.ndim not in (1, 2) or not all(
+        isinstance(w, (int, float)) and not isinstance(w, bool) for w in values.ravel()
+    ):
+        raise ValueError(message)
+    values = values.astype(float)
+    if not np.isfinite(values).all():
+        raise ValueError("'weights' must be finite")
+    return tickers, values
+
+
+def portfolio_risk(covariance_matrix, held_tickers, weights, industry_lists):
+    """
+    Scores many portfolios at once against the covariance matrix.
+
+    Only the submatrix of the held tickers is taken (by position, not by label), and every
+    portfolio is handled in one matrix-matrix product, so thousands of candidate weight
+    vectors cost about as much as one.
+
+    Parameters:
+    - covariance_matrix: The full covariance matrix (DataFrame)
+    - held_tickers: List of the n tickers the weights refer to
+    - weights: Array of shape (n,) for one portfolio or (portfolios, n) for many
+    - industry_lists: Dictionary with industries as keys and ticker lists as values
+
+    Returns a dictionary with, per portfolio:
+    - variance and volatility (w' S w and its square root)
+    - marginal: d(volatility)/d(weight) for every held ticker
+    - component: weight * marginal, which sums to the volatility
+    - industry_contribution: the component risk summed within each industry
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    positions = covariance_matrix.index.get_indexer(held_tickers)
+    missing = [ticker for ticker, pos in zip(held_tickers, positions) if pos < 0]
+    if missing:
+        raise ValueError(f"Unknown tickers: {', '.join(missing)}")
+    if weights.shape[1] != len(held_tickers):
+        raise ValueError(f"Expected {len(held_tickers)} weights per portfolio, got {weights.shape[1]}")
+
+    held_sigma = covariance_matrix.values[np.ix_(positions, positions)]
+    sigma_w = weights @ held_sigma  # (portfolios x n), one product for every portfolio
+    variance = np.einsum('pi,pi->p', sigma_w, weights)
+    volatility = np.sqrt(np.clip(variance, 0.0, None))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        marginal = np.where(volatility[:, None] > 0, sigma_w / volatility[:, None], 0.0)
+    component = weights * marginal
+
+    # One-hot industry membership of the held tickers; anything unclassified goes to "Other"
+    industries = list(industry_lists.keys())
+    ticker_industry = {ticker: i for i, industry in enumerate(industries) for ticker in industry_lists[industry]}
+    membership = np.zeros((len(held_tickers), len(industries) + 1))
+    for row, ticker in enumerate(held_tickers):
+        membership[row, ticker_industry.get(ticker, len(industries))] = 1.0
+    if not membership[:, -1].any():
+        membership = membership[:, :-1]
+    else:
+        industries.append('Other')
+
+    return {
+        'tickers': list(held_tickers),
+        'industries': industries,
+        'variance': variance,
+        'volatility': volatility,
+        'marginal': marginal,
+        'component': component,
+        'industry_contribution': component @ membership,
+    }
@@ -0,0 +1,36 @@
+import numpy as np
+from scipy.linalg import cho_factor
+from scipy.linalg.lapack import dpotri
+
+
+def precision_matrix(block, ridge=0.0):
+    """
+    Inverts a covariance block through its Cholesky factor.
+
+    Parameters:
+    - block: Square covariance block (2-D array)
+    - ridge: Regularization for ill-conditioned blocks, as a fraction of the average variance
+      added to the diagonal before factorizing (0 for none)
+
+    Raises numpy.linalg.LinAlgError if the (regularized) block is not positive definite.
+    """
+    block = np.array(block, dtype=float)
+    n = len(block)
+    if ridge:
+        block[np.diag_indices(n)] += ridge * np.trace(block) / n
+    factor, lower = cho_factor(block, lower=True, overwrite_a=True, check_finite=False)
+    inverse, info = dpotri(factor, lower=lower, overwrite_c=True)
+    if info != 0:
+        raise np.linalg.LinAlgError(f"Inverting the Cholesky factor failed (info={info})")
+    # dpotri only fills the lower triangle
+    return np.tril(inverse) + np.tril(inverse, -1).T
+
+
+def partial_correlations(precision):
+    """
+    Partial correlation of every pair given all other tickers in the block: -P_ij / sqrt(P_ii P_jj).
+    """
+    scale = 1.0 / np.sqrt(np.diag(precision))
+    partial = -precision * np.outer(scale, scale)
+    np.fill_diagonal(partial, 1.0)
+    return partial
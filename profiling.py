@@ -0,0 +1,204 @@
+import os
+import io
+import json
+import time
+import pstats
+import random
+import cProfile
+import datetime
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from flask import g, has_request_context
+
+# Captures are written here, and only the newest PROFILE_KEEP are kept
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+# Fraction of requests profiled without being asked to (0 for none)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# Allocation sites listed in each capture
+TOP_ALLOCATIONS = 25
+
+# The profiler and tracemalloc are process-wide, so one request is captured at a time; requests
+# asking for a capture while another runs are served normally
+_busy = threading.Lock()
+
+
+def requested(headers, args):
+    # A capture is asked for with an X-Profile: 1 header or ?profile=1
+    return headers.get('X-Profile') == '1' or args.get('profile') == '1'
+
+
+def sampled():
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _begin(handler, path):
+    # Starts a capture and returns its state, or None if another capture is running
+    if not _busy.acquire(blocking=False):
+        return None
+    # Leave an allocation trace started by someone else (e.g. a benchmark) running afterwards
+    own_trace = not tracemalloc.is_tracing()
+    if own_trace:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    state = {'handler': handler, 'path': path, 'start': time.perf_counter(), 'profiler': profiler,
+             'own_trace': own_trace}
+    profiler.enable()
+    return state
+
+
+def start(handler, path):
+    """Starts a CPU profile and allocation trace of the current request, unless another is running."""
+    state = _begin(handler, path)
+    if state is None:
+        return False
+    g.profile = state
+    return True
+
+
+def _stop():
+    # Stops the capture of the current request and returns its state (None if it has none)
+    state = g.pop('profile', None) if has_request_context() else None
+    return _end(state)
+
+
+def _end(state):
+    if state is None:
+        return None
+    state['profiler'].disable()
+    state['seconds'] = time.perf_counter() - state['start']
+    try:
+        state['allocations'] = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+        state['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        if state['own_trace']:
+            tracemalloc.stop()
+        _busy.release()
+    return state
+
+
+def finish(status):
+    """Ends the capture of the current request and writes it to PROFILE_DIR. Returns its id or None."""
+    return _write(_stop(), status)
+
+
+def _write(state, status):
+    if state is None:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    capture_id = datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    state['profiler'].dump_stats(os.path.join(PROFILE_DIR, f"{capture_id}.prof"))
+    meta = {
+        'id': capture_id,
+        'handler': state['handler'],
+        'path': state['path'],
+        'status': status,
+        'seconds': state['seconds'],
+        'peak_traced_mb': state['peak_bytes'] / 2**20,
+        'allocations': [
+            {'site': str(stat.traceback[0]), 'mb': stat.size / 2**20, 'blocks': stat.count}
+            for stat in state['allocations']
+        ],
+    }
+    with open(os.path.join(PROFILE_DIR, f"{capture_id}.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    _trim()
+    return capture_id
+
+
+def request_job(key, handler, path):
+    """
+    Asks for a capture of the background job identified by key, which the current (profiled)
+    request is starting. Jobs run in other processes, so the request is left as a marker file.
+    """
+    jobs_dir = os.path.join(PROFILE_DIR, 'jobs')
+    os.makedirs(jobs_dir, exist_ok=True)
+    with open(os.path.join(jobs_dir, key), "w") as f:
+        json.dump({'handler': handler, 'path': path}, f)
+
+
+@contextmanager
+def job(key):
+    """
+    Captures the block like a request if request_job asked for it (each request is used once).
+    The capture is stored with the others under PROFILE_DIR.
+    """
+    marker = os.path.join(PROFILE_DIR, 'jobs', key)
+    try:
+        with open(marker) as f:
+            meta = json.load(f)
+        # Whoever removes the marker runs the capture
+        os.remove(marker)
+    except (OSError, ValueError):
+        meta = None
+    state = _begin(meta['handler'], meta['path']) if meta is not None else None
+    if state is None:
+        yield
+        return
+    status = 200
+    try:
+        yield
+    except Exception:
+        status = 500
+        raise
+    finally:
+        _write(_end(state), status)
+
+
+def abandon():
+    # Called when a request ends without a response, so a failed request never keeps the lock
+    _stop()
+
+
+def _trim():
+    # Ids sort by time, so the oldest captures are dropped first
+    for capture_id in list_ids()[:-PROFILE_KEEP or None]:
+        for ext in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, capture_id + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_ids():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted(name[:-5] for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+
+
+def captures():
+    """Metadata of the stored captures, newest first."""
+    result = []
+    for capture_id in reversed(list_ids()):
+        try:
+            with open(os.path.join(PROFILE_DIR, f"{capture_id}.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        result.append({key: value for key, value in meta.items() if key != 'allocations'})
+    return result
+
+
+def capture_path(capture_id):
+    """Path of a capture's pstats file, or None for an unknown id."""
+    if capture_id not in list_ids():
+        return None
+    return os.path.join(PROFILE_DIR, f"{capture_id}.prof")
+
+
+def capture_report(capture_id, limit=40):
+    """Readable summary of a capture: the functions with the most cumulative time and the top allocation sites."""
+    path = capture_path(capture_id)
+    if path is None:
+        return None
+    with open(os.path.join(PROFILE_DIR, f"{capture_id}.json")) as f:
+        meta = json.load(f)
+    out = io.StringIO()
+    out.write(f"{meta['handler']} ({meta['path']}): {meta['seconds']:.3f}s, status {meta['status']}, "
+              f"peak traced memory {meta['peak_traced_mb']:.1f} MB\n\n")
+    pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(limit)
+    out.write("Largest allocation sites still held at the end of the request:\n")
+    for allocation in meta['allocations']:
+        out.write(f"  {allocation['mb']:10.2f} MB {allocation['blocks']:>8} blocks  {allocation['site']}\n")
+    return out.getvalue()
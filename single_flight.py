@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import fcntl
+import pickle
+import hashlib
+import threading
+
+# Every SingleFlight created, so their statistics can be reported
+flights = []
+
+# Shared result files older than this are swept, at most once per interval (lock files never are)
+SWEEP_AGE = 600
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time: concurrent callers with an equal key wait for the call
+    already in flight and share its result instead of computing it again.
+
+    Keys should include the data version, so a result is never shared across different matrices.
+    Threads of one process are coalesced in memory. With a directory, processes are coalesced too:
+    the computing process holds a lock file for the key, and a process that finds the lock taken
+    leaves a marker before waiting on it. Only when such a marker exists does the computing process
+    write its result next to the lock, and a waiting process reads that result if it is at most
+    ttl seconds old. Computed and shared calls are then counted in a file in the directory, so
+    calls of every process are counted.
+
+    Parameters:
+    - name: Label used in file names and when reporting statistics
+    - directory: Folder for lock and result files shared by worker processes (None for threads only)
+    - ttl: Seconds a shared result file is served to processes that were waiting for it
+    """
+
+    def __init__(self, name, directory=None, ttl=2.0):
+        self.name = name
+        self.directory = directory
+        self.ttl = ttl
+        self.computed = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        flights.append(self)
+
+    def do(self, key, compute):
+        """Returns compute(), or the result of an identical call that is already running."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            self.count('shared')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            if self.directory is None:
+                call.value = compute()
+                self.count('computed')
+            else:
+                call.value = self._do_shared(key, compute)
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _do_shared(self, key, compute):
+        os.makedirs(self.directory, exist_ok=True)
+        self._sweep()
+        base = os.path.join(self.directory, f"{self.name}-{hashlib.sha1(repr(key).encode()).hexdigest()}")
+        with open(base + '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is computing: ask it to publish its result, then wait for it
+                with open(base + '.waiting', 'a'):
+                    pass
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    if time.time() - os.path.getmtime(base + '.pkl') <= self.ttl:
+                        with open(base + '.pkl', 'rb') as f:
+                            value = pickle.load(f)
+                        self.count('shared')
+                        return value
+                except (OSError, EOFError, pickle.UnpicklingError):
+                    pass
+                value = compute()
+                self.count('computed')
+                try:
+                    os.remove(base + '.waiting')
+                except FileNotFoundError:
+                    # Nobody waited, so the (possibly large) result is not written at all
+                    return value
+                # Written under a temporary name and renamed, so readers never see a partial file
+                temporary = f"{base}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temporary, 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temporary, base + '.pkl')
+                return value
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _sweep(self):
+        # Result and marker files of keys nobody asked for in a while (e.g. retired data versions).
+        # Lock files are kept: removing one that a process holds or is about to open would let
+        # two processes lock different files for the same key
+        now = time.time()
+        if now - self._last_sweep < SWEEP_AGE:
+            return
+        self._last_sweep = now
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if (name.startswith(self.name + '-') and name.endswith(('.pkl', '.waiting', '.tmp'))
+                        and now - os.path.getmtime(path) > SWEEP_AGE):
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def count(self, counter):
+        # Counted in memory, or with a directory in its statistics file, like admission.Budget
+        with self._lock:
+            if self.directory is None:
+                setattr(self, counter, getattr(self, counter) + 1)
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{self.name}.stats.json"), 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        counts = json.loads(f.read() or '{}')
+                    except ValueError:
+                        counts = {}
+                    counts[counter] = counts.get(counter, 0) + 1
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(counts))
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def stats(self):
+        counts = {'computed': self.computed, 'shared': self.shared}
+        if self.directory is not None:
+            try:
+                with open(os.path.join(self.directory, f"{self.name}.stats.json")) as f:
+                    fcntl.flock(f, fcntl.LOCK_SH)
+                    counts.update(json.loads(f.read() or '{}'))
+            except (OSError, ValueError):
+                pass
+        with self._lock:
+            return {'name': self.name, **counts, 'in_flight': len(self._calls)}
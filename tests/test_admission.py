@@ -0,0 +1,57 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from admission import BYTES_PER_CELL, Budget, BudgetExceeded, downsample  # noqa: E402
+
+
+class BudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        # 100 cells per request in slots of 25 cells, and two slots in all
+        self.root = tempfile.mkdtemp()
+        self.budget = Budget('test', self.root, 100 * BYTES_PER_CELL, 50 * BYTES_PER_CELL, timeout=0.2)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_step_fits_one_request(self):
+        self.assertEqual(self.budget.step(10, 10), 1)
+        for rows, cols in ((11, 10), (1000, 3), (999, 999)):
+            step = self.budget.step(rows, cols)
+            self.assertLessEqual(-(-rows // step) * -(-cols // step), 100)
+            # and is the smallest step that does
+            self.assertGreater(-(-rows // (step - 1)) * -(-cols // (step - 1)), 100)
+
+    def test_requests_queue_for_slots_and_are_rejected_after_the_timeout(self):
+        with self.budget.admit(10):
+            # Smaller than a slot: runs without one
+            with self.budget.admit(10_000):
+                with self.assertRaises(BudgetExceeded):
+                    with self.budget.admit(30):
+                        pass
+        with self.budget.admit(30):
+            pass
+        stats = self.budget.stats()
+        self.assertEqual((stats['slots'], stats['admitted'], stats['rejected']), (2, 2, 1))
+
+
+class DownsampleTest(unittest.TestCase):
+
+    def test_tile_means_leave_out_nan(self):
+        block = np.arange(20, dtype=float).reshape(4, 5)
+        block[0, 0] = np.nan
+        tiles = downsample(block, 2)
+        self.assertEqual(tiles.shape, (2, 3))
+        self.assertEqual(tiles[0, 0], (1 + 5 + 6) / 3)
+        self.assertEqual(tiles[1, 2], (14 + 19) / 2)
+        np.testing.assert_array_equal(downsample(np.arange(6.0).reshape(3, 2), 2, axis=0), [[1, 2], [4, 5]])
+        self.assertTrue(np.isnan(downsample(np.full((2, 2), np.nan), 2)).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
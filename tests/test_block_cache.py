@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from block_cache import BlockCache, discard_version  # noqa: E402
+
+
+class BlockCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_is_evicted_by_bytes(self):
+        cache = BlockCache('test', max_bytes=3 * 80)
+        for i in range(3):
+            cache.put(('v1', i), np.zeros(10), 80)
+        cache.get(('v1', 0))
+        cache.put(('v1', 3), np.zeros(10), 80)
+        self.assertIsNone(cache.get(('v1', 1)))
+        self.assertIsNotNone(cache.get(('v1', 0)))
+        self.assertEqual(cache.stats()['bytes'], 3 * 80)
+        # Too large for the cache at all: returned but not kept
+        cache.put(('v1', 4), np.zeros(100), 800)
+        self.assertIsNone(cache.get(('v1', 4)))
+
+    def test_get_or_compute_computes_once(self):
+        cache = BlockCache('test', max_bytes=1000)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return np.arange(4.0)
+
+        for _ in range(3):
+            np.testing.assert_array_equal(cache.get_or_compute(('v1', 'x'), compute), np.arange(4.0))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['hits'], 2)
+
+    def test_discard_version_drops_only_that_version(self):
+        cache = BlockCache('test', max_bytes=1000)
+        cache.put(('v1', 'x'), np.zeros(2), 16)
+        cache.put(('v2', 'x'), np.zeros(2), 16)
+        discard_version('v1')
+        self.assertIsNone(cache.get(('v1', 'x')))
+        self.assertIsNotNone(cache.get(('v2', 'x')))
+        self.assertEqual(cache.stats()['bytes'], 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
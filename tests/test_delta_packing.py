@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from build_artifacts import COVARIANCE_NPY, MANIFEST_FILE, pack_deltas, write_integrity, write_snapshot  # noqa: E402
+from covariance_store import SnapshotStore  # noqa: E402
+from integrity import INTEGRITY_FILE, IntegrityError  # noqa: E402
+
+
+class DeltaPackingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.rng = np.random.default_rng(0)
+        self.tickers = [f"T{i:03d}" for i in range(120)]
+        loadings = self.rng.normal(size=(120, 4))
+        self.base = loadings @ loadings.T + np.eye(120)
+        self.values = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def add_snapshot(self, name):
+        # Each date moves the matrix a little, as a daily refresh does
+        noise = self.rng.normal(scale=1e-3, size=self.base.shape)
+        values = self.base + (noise + noise.T) / 2
+        path = os.path.join(self.root, name)
+        manifest = write_snapshot(self.tickers, values, {'A': self.tickers[:60], 'B': self.tickers[60:]}, path)
+        write_integrity(path, manifest['version'])
+        self.values[name] = values
+
+    def manifest(self, name):
+        with open(os.path.join(self.root, name, MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    def test_packed_snapshots_rebuild_bit_exact_against_the_newest(self):
+        for name in ("2024-01-01", "2024-01-02", "2024-01-03"):
+            self.add_snapshot(name)
+        pack_deltas(self.root)
+        for name in ("2024-01-01", "2024-01-02"):
+            self.assertFalse(os.path.exists(os.path.join(self.root, name, COVARIANCE_NPY)))
+            self.assertEqual(self.manifest(name)['delta_base'], "2024-01-03")
+
+        store = SnapshotStore(self.root)
+        for name in ("2024-01-01", "2024-01-02"):
+            snap = store.get(name)
+            rebuilt = np.asarray(snap.values)
+            self.assertEqual(rebuilt.tobytes(), self.values[name].tobytes())
+            snap.verify_all()
+            verified, total = snap.checksums().status()
+            self.assertEqual(verified, total)
+
+    def test_new_snapshot_repacks_older_ones_without_chains(self):
+        for name in ("2024-01-01", "2024-01-02"):
+            self.add_snapshot(name)
+        pack_deltas(self.root)
+        self.add_snapshot("2024-01-03")
+        pack_deltas(self.root)
+        for name in ("2024-01-01", "2024-01-02"):
+            self.assertEqual(self.manifest(name)['delta_base'], "2024-01-03")
+            self.assertFalse(os.path.exists(os.path.join(self.root, name, COVARIANCE_NPY)))
+        snap = SnapshotStore(self.root).get("2024-01-01")
+        self.assertEqual(np.asarray(snap.values).tobytes(), self.values["2024-01-01"].tobytes())
+
+    def test_rebuild_not_matching_its_checksums_raises(self):
+        for name in ("2024-01-01", "2024-01-02"):
+            self.add_snapshot(name)
+        pack_deltas(self.root)
+        integrity_file = os.path.join(self.root, "2024-01-01", INTEGRITY_FILE)
+        with open(integrity_file) as f:
+            integrity = json.load(f)
+        integrity['rebuilt'][COVARIANCE_NPY]['chunks'][0] = '0' * 32
+        with open(integrity_file, "w") as f:
+            json.dump(integrity, f)
+        with self.assertRaises(IntegrityError):
+            SnapshotStore(self.root).get("2024-01-01")
+        self.assertFalse(os.path.exists(os.path.join(self.root, "2024-01-01", COVARIANCE_NPY)))
+
+
+if __name__ == "__main__":
+    unittest.main()
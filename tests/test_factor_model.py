@@ -0,0 +1,57 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from factor_model import FactorMatrix, factor_error, fit_factor_model, industry_groups, save_factor_model  # noqa: E402
+
+
+class FactorModelTest(unittest.TestCase):
+
+    def setUp(self):
+        # Two industries and two tickers in none; everything between them has rank 2
+        rng = np.random.default_rng(0)
+        loadings = rng.normal(size=(60, 2))
+        self.values = loadings @ loadings.T + np.diag(rng.uniform(0.5, 1.0, 60))
+        self.positions = {'A': np.arange(0, 30), 'B': np.arange(30, 58)}
+        for pos in self.positions.values():
+            noise = rng.normal(scale=0.1, size=(len(pos), len(pos)))
+            self.values[np.ix_(pos, pos)] += noise @ noise.T
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_industry_groups(self):
+        groups, local, members = industry_groups(6, {'A': [4, 1], 'B': [1, 2]})
+        np.testing.assert_array_equal(groups, [-1, 0, 1, -1, 0, -1])
+        np.testing.assert_array_equal(local[[4, 1, 2]], [0, 1, 0])
+        self.assertEqual(len(members), 2)
+
+    def test_factor_matrix_is_exact_within_industries_and_close_between(self):
+        loadings, residual = fit_factor_model(self.values, self.positions, rank=2)
+        groups, _, _ = industry_groups(60, self.positions)
+        error = factor_error(self.values, loadings, groups, block_rows=16)
+        self.assertLess(error['relative_frobenius'], 0.01)
+        self.assertLess(error['max_abs_correlation'], 0.01)
+
+        save_factor_model(self.root, self.values, self.positions, loadings, residual)
+        matrix = FactorMatrix(self.root)
+        self.assertEqual(matrix.shape, (60, 60))
+        full = matrix.block(np.arange(60), np.arange(60))
+        np.testing.assert_allclose(full[:30, 30:], loadings[:30] @ loadings[30:].T, rtol=1e-12)
+        np.testing.assert_allclose(full, self.values, atol=error['max_abs'])
+        for pos in self.positions.values():
+            np.testing.assert_array_equal(matrix[np.ix_(pos, pos)], self.values[np.ix_(pos, pos)])
+        np.testing.assert_allclose(matrix.diagonal(), np.diagonal(self.values), rtol=1e-12)
+        # Indexed like the array it replaces
+        self.assertEqual(matrix[3].shape, (60,))
+        self.assertEqual(matrix[5:9].shape, (4, 60))
+        self.assertEqual(matrix[3, 40], matrix.block(np.array([3]), np.array([40]))[0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
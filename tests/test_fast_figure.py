@@ -0,0 +1,46 @@
+import os
+import sys
+import json
+import unittest
+import numpy as np
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+from plotly.subplots import make_subplots
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fast_figure  # noqa: E402
+
+
+class FastFigureTest(unittest.TestCase):
+
+    def test_heatmap_figure_serializes_like_plotly(self):
+        rng = np.random.default_rng(0)
+        block = rng.normal(size=(30, 30))
+        tickers = [f"T{i}" for i in range(30)]
+
+        fig = make_subplots(rows=1, cols=1, subplot_titles=["Energy"])
+        fig.add_trace(go.Heatmap(z=block, x=tickers, y=tickers, colorscale='Viridis', zmin=-1, zmax=1),
+                      row=1, col=1)
+        fig.add_trace(go.Heatmap(z=[], colorscale='Viridis', showscale=False, texttemplate='%{text}',
+                                 hoverinfo='skip', zmin=-1, zmax=1), row=1, col=1)
+        fig.update_layout(showlegend=False, margin=dict(t=50, b=50, l=50, r=50))
+
+        layout = fast_figure.subplot_grid(1, 1, ["Energy"])
+        layout.update(showlegend=False, margin=dict(t=50, b=50, l=50, r=50))
+        fast = fast_figure.figure([
+            fast_figure.heatmap_trace(1, z=block, x=tickers, y=tickers, colorscale='Viridis', zmin=-1, zmax=1),
+            fast_figure.heatmap_trace(1, z=[], colorscale='Viridis', showscale=False, texttemplate='%{text}',
+                                      hoverinfo='skip', zmin=-1, zmax=1),
+        ], layout)
+
+        self.assertEqual(json.loads(fast_figure.encode(fast)), json.loads(to_json_plotly(fig)))
+
+    def test_subplot_grid_matches_make_subplots(self):
+        expected = make_subplots(rows=3, cols=2, subplot_titles=list("ABCDE")).to_plotly_json()['layout']
+        layout = fast_figure.subplot_grid(3, 2, list("ABCDE"))
+        self.assertEqual(json.loads(json.dumps(layout)),
+                         json.loads(to_json_plotly({k: v for k, v in expected.items() if k != 'template'})))
+
+
+if __name__ == "__main__":
+    unittest.main()
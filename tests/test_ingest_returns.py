@@ -0,0 +1,37 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ingest_returns import ewma_update, rolling_update  # noqa: E402
+
+
+class IngestReturnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.history = self.rng.normal(size=(20, 30))
+
+    def test_ewma_update_matches_one_day_at_a_time(self):
+        start = np.cov(self.history.T)
+        returns = self.rng.normal(size=(3, 30))
+        expected = start.copy()
+        for r in returns:
+            expected = 0.9 * expected + 0.1 * np.outer(r, r)
+        values = start.copy()
+        # Bands smaller than the matrix, so several are updated
+        ewma_update(values, returns, decay=0.9, block_rows=7, max_workers=2)
+        np.testing.assert_allclose(values, expected, rtol=1e-12)
+
+    def test_rolling_update_matches_recomputing_the_window(self):
+        window = len(self.history)
+        values = self.history.T @ self.history / window
+        new = self.rng.normal(size=(4, 30))
+        rolling_update(values, new, self.history[:4], window, block_rows=8)
+        moved = np.vstack([self.history[4:], new])
+        np.testing.assert_allclose(values, moved.T @ moved / window, rtol=1e-10, atol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
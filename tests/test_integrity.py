@@ -0,0 +1,61 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from build_artifacts import COVARIANCE_NPY, write_integrity, write_snapshot  # noqa: E402
+from covariance_store import SnapshotStore  # noqa: E402
+from integrity import CHUNK_BYTES, IntegrityError  # noqa: E402
+
+
+class SnapshotIntegrityTest(unittest.TestCase):
+
+    def setUp(self):
+        # 800 x 800 float64 is 5 MB, so the matrix spans two checksum chunks
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "2024-01-01")
+        rng = np.random.default_rng(0)
+        loadings = rng.normal(size=(800, 5))
+        values = loadings @ loadings.T + np.eye(800)
+        tickers = [f"T{i:03d}" for i in range(800)]
+        manifest = write_snapshot(tickers, values, {'A': tickers[:400], 'B': tickers[400:]}, self.path)
+        write_integrity(self.path, manifest['version'])
+        self.store = SnapshotStore(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_block_of_corrupt_chunk_raises(self):
+        with open(os.path.join(self.path, COVARIANCE_NPY), 'r+b') as f:
+            f.seek(CHUNK_BYTES + 8)
+            f.write(b'\xff' * 8)
+        snap = self.store.get()
+        snap.block(np.arange(10), np.arange(10))
+        with self.assertRaises(IntegrityError):
+            snap.block(np.arange(700, 800), np.arange(10))
+        with self.assertRaises(IntegrityError):
+            snap.verify_all()
+
+    def test_matrix_removed_after_opening(self):
+        # Packing removes covariance.npy of a snapshot the app may have open; the memory map still
+        # holds the data, and verifying it must neither fail nor raise anything but IntegrityError
+        snap = self.store.get()
+        os.remove(os.path.join(self.path, COVARIANCE_NPY))
+        block = snap.block(np.arange(700, 800), np.arange(100))
+        self.assertEqual(block.shape, (100, 100))
+        self.assertGreater(snap.verify_all(), 0)
+        verified, total = snap.checksums().status()
+        self.assertEqual(verified, total)
+
+    def test_removed_file_of_unopened_snapshot_raises_integrity_error(self):
+        snap = self.store.snapshots["2024-01-01"]
+        os.remove(os.path.join(self.path, COVARIANCE_NPY))
+        with self.assertRaises(IntegrityError):
+            snap.verify_all()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from portfolio_risk import parse_portfolios, parse_risk_request, portfolio_risk  # noqa: E402
+
+
+class PortfolioRiskTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        loadings = rng.normal(size=(6, 2))
+        tickers = [f"T{i}" for i in range(6)]
+        self.covariance = pd.DataFrame(loadings @ loadings.T + np.eye(6), index=tickers, columns=tickers)
+        self.industries = {'A': tickers[:3], 'B': tickers[3:5]}
+
+    def test_many_portfolios_match_one_at_a_time(self):
+        held = ["T4", "T0", "T5"]
+        weights = np.array([[0.5, 0.3, 0.2], [1.0, -1.0, 0.0]])
+        result = portfolio_risk(self.covariance, held, weights, self.industries)
+        sigma = self.covariance.loc[held, held].to_numpy()
+        for p, w in enumerate(weights):
+            self.assertAlmostEqual(result['variance'][p], w @ sigma @ w)
+        # Component risk adds up to the volatility, by ticker and by industry
+        np.testing.assert_allclose(result['component'].sum(axis=1), result['volatility'])
+        np.testing.assert_allclose(result['industry_contribution'].sum(axis=1), result['volatility'])
+        self.assertEqual(result['industries'], ['A', 'B', 'Other'])
+
+    def test_unknown_tickers_and_wrong_widths_raise(self):
+        with self.assertRaises(ValueError):
+            portfolio_risk(self.covariance, ["T0", "XX"], [0.5, 0.5], self.industries)
+        with self.assertRaises(ValueError):
+            portfolio_risk(self.covariance, ["T0", "T1"], [1.0], self.industries)
+
+    def test_parse_portfolios_fills_missing_weights(self):
+        tickers, weights = parse_portfolios("T0, T1\n0.5, 0.5\n1.0,\n")
+        self.assertEqual(tickers, ["T0", "T1"])
+        np.testing.assert_array_equal(weights, [[0.5, 0.5], [1.0, 0.0]])
+
+    def test_parse_risk_request(self):
+        tickers, weights = parse_risk_request({'portfolios': [{'T0': 1}, {'T1': 0.5, 'T0': 0.5}]})
+        self.assertEqual(tickers, ["T0", "T1"])
+        np.testing.assert_array_equal(weights, [[1.0, 0.0], [0.5, 0.5]])
+        for payload in ([], {'tickers': "T0", 'weights': [1]}, {'tickers': ["T0"], 'weights': "1"},
+                        {'tickers': ["T0", "T1"], 'weights': [[1, 2], [3]]}, {'tickers': ["T0"], 'weights': [True]},
+                        {'portfolios': [{'T0': "a"}]}):
+            with self.assertRaises(ValueError):
+                parse_risk_request(payload)
+
+
+if __name__ == "__main__":
+    unittest.main()
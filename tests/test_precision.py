@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from precision import partial_correlations, precision_matrix  # noqa: E402
+
+
+class PrecisionTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        loadings = rng.normal(size=(40, 3))
+        self.block = loadings @ loadings.T + np.eye(40)
+
+    def test_precision_is_the_inverse(self):
+        precision = precision_matrix(self.block)
+        np.testing.assert_allclose(precision, np.linalg.inv(self.block), rtol=1e-10, atol=1e-12)
+        np.testing.assert_array_equal(precision, precision.T)
+
+    def test_ridge_regularizes_singular_blocks(self):
+        singular = np.ones((3, 3))
+        with self.assertRaises(np.linalg.LinAlgError):
+            precision_matrix(singular)
+        ridged = singular + np.eye(3) * 0.1
+        np.testing.assert_allclose(precision_matrix(singular, ridge=0.1), np.linalg.inv(ridged))
+
+    def test_partial_correlations(self):
+        partial = partial_correlations(precision_matrix(self.block))
+        np.testing.assert_allclose(np.diag(partial), 1.0)
+        self.assertTrue((np.abs(partial) <= 1 + 1e-12).all())
+        # With two variables the partial correlation is the correlation itself
+        pair = self.block[:2, :2]
+        expected = pair[0, 1] / np.sqrt(pair[0, 0] * pair[1, 1])
+        self.assertAlmostEqual(partial_correlations(precision_matrix(pair))[0, 1], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
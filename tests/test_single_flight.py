@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from single_flight import SingleFlight  # noqa: E402
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_concurrent_threads_share_one_call(self):
+        flight = SingleFlight('test')
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 42
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        # Release the leader once the other three are waiting on it
+        deadline = time.time() + 5
+        while flight.stats()['shared'] < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [42] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), {'name': 'test', 'computed': 1, 'shared': 3, 'in_flight': 0})
+
+    def test_errors_reach_every_caller_and_are_not_kept(self):
+        flight = SingleFlight('test')
+
+        def fail():
+            raise KeyError('x')
+
+        with self.assertRaises(KeyError):
+            flight.do('key', fail)
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+
+    def test_result_is_published_only_to_waiting_processes(self):
+        # Two instances on one directory stand for two worker processes
+        leader, follower = SingleFlight('test', self.root), SingleFlight('test', self.root)
+        self.assertEqual(leader.do('quiet', lambda: 1), 1)
+        self.assertFalse([name for name in os.listdir(self.root) if name.endswith('.pkl')])
+
+        base = os.path.join(self.root, f"test-{hashlib.sha1(repr('key').encode()).hexdigest()}")
+
+        def compute():
+            # What a process that found the lock taken does before waiting for it
+            open(base + '.waiting', 'a').close()
+            return {'value': 1}
+
+        self.assertEqual(leader.do('key', compute), {'value': 1})
+        self.assertTrue(os.path.exists(base + '.pkl'))
+        self.assertEqual(follower.do('key', lambda: self.fail("computed again")), {'value': 1})
+        stats = follower.stats()
+        self.assertEqual((stats['computed'], stats['shared']), (2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()